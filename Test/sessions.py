@@ -0,0 +1,22 @@
+# Copyright 2022, Alvin Kuruvilla <alvineasokuruvilla@gmail.com>
+
+# Use of this source code is governed by an MIT-style
+# license that can be found in the LICENSE file or at
+# https://opensource.org/licenses/MIT.
+
+from core.td_data_dict import TD_Data_Dictionary
+from core.td_events import encode_actions
+
+
+def make_session(holds):
+    """Builds a session that presses and releases each (key, hold) in turn, one second apart"""
+    names = []
+    actions = []
+    times = []
+    start = 0.0
+    for key, hold in holds:
+        names += [key, key]
+        actions += ["P", "R"]
+        times += [start, start + hold]
+        start += 1.0
+    return TD_Data_Dictionary.from_columns(names, encode_actions(actions), times)
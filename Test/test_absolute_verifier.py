@@ -0,0 +1,71 @@
+# Copyright 2022, Alvin Kuruvilla <alvineasokuruvilla@gmail.com>
+
+# Use of this source code is governed by an MIT-style
+# license that can be found in the LICENSE file or at
+# https://opensource.org/licenses/MIT.
+
+import os
+import pickle
+import tempfile
+import numpy as np
+from converters.feature_store import get_feature_store
+from verifiers.absolute_verifier import AbsoluteVerifier, is_profile_path
+from Test.sessions import make_session
+
+
+def test_score_keys_matches_per_key_check():
+    template = make_session([("'a'", 0.1), ("'b'", 0.2), ("'c'", 0.3), ("'d'", 0.3)])
+    verification = make_session(
+        [("'a'", 0.15), ("'b'", 0.5), ("'c'", 0.3), ("'d'", 0.2)]
+    )
+    verifier = AbsoluteVerifier(template, verification, 1.6)
+    keys, valid = verifier.score_keys()
+    assert keys == ["'a'", "'b'", "'c'", "'d'"]
+    assert valid.tolist() == [True, False, True, True]
+    assert valid.tolist() == [verifier.check_key_hold_latencies(key) for key in keys]
+    assert verifier.find_all_valid_keys() == ["'a'", "'c'", "'d'"]
+    assert np.isclose(verifier.calculate_absolute_score(), 0.25)
+
+
+def test_score_keys_kit():
+    template = make_session([("'a'", 0.1), ("'b'", 0.2), ("'c'", 0.3)])
+    verification = make_session([("'a'", 0.1), ("'b'", 0.9), ("'c'", 0.3)])
+    verifier = AbsoluteVerifier(template, verification, 2.0)
+    keys, valid = verifier.score_keys(use_kit=True)
+    assert len(keys) == 2
+    assert valid.tolist() == [
+        verifier.check_key_interval_latencies(key) for key in keys
+    ]
+
+
+def test_evaluating_mode_reads_profiles_once():
+    store = get_feature_store()
+    with tempfile.TemporaryDirectory() as directory:
+        template_path = os.path.join(directory, "template.pickle")
+        verification_path = os.path.join(directory, "verification.pickle")
+        with open(template_path, "wb") as handle:
+            pickle.dump({"'a'": [0.1], "'b'": [0.2], "'c'": [0.3]}, handle)
+        with open(verification_path, "wb") as handle:
+            pickle.dump({"'a'": [0.15], "'b'": [0.5], "'d'": [0.3]}, handle)
+        verifier = AbsoluteVerifier(template_path, verification_path, 1.6)
+        misses = store.info()["misses"]
+        assert verifier.find_all_valid_keys(is_evaluating=True) == ["'a'"]
+        assert np.isclose(verifier.calculate_absolute_score(is_evaluating=True), 0.5)
+        assert store.info()["misses"] == misses + 2
+
+
+def test_is_profile_path():
+    template = os.path.join(os.getcwd(), "Test", "sources", "single-entry-template.csv")
+    assert not is_profile_path(template)
+    assert not is_profile_path(make_session([("'a'", 0.1)]))
+    with tempfile.TemporaryDirectory() as directory:
+        profile_path = os.path.join(directory, "template.pickle")
+        with open(profile_path, "wb") as handle:
+            pickle.dump({"'a'": [0.1]}, handle)
+        assert is_profile_path(profile_path)
+        missing = os.path.join(directory, "missing.csv")
+        try:
+            is_profile_path(missing)
+            assert False
+        except FileNotFoundError:
+            pass
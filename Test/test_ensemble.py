@@ -0,0 +1,48 @@
+# Copyright 2022, Alvin Kuruvilla <alvineasokuruvilla@gmail.com>
+
+# Use of this source code is governed by an MIT-style
+# license that can be found in the LICENSE file or at
+# https://opensource.org/licenses/MIT.
+
+import numpy as np
+from core.td_utils import ComparisonContext
+from verifiers.absolute_verifier import AbsoluteVerifier
+from verifiers.ensemble import score_all
+from verifiers.relative_verifier import RelativeVerifier
+from verifiers.similarity_verifier import SimilarityVerifier
+from Test.sessions import make_session
+
+
+def test_score_all_matches_individual_verifiers():
+    template = make_session(
+        [("'a'", 0.1), ("'b'", 0.2), ("'c'", 0.3), ("'d'", 0.15)]
+    )
+    verification = make_session(
+        [("'a'", 0.12), ("'b'", 0.5), ("'c'", 0.25), ("'d'", 0.1)]
+    )
+    thresholds = {
+        AbsoluteVerifier: 1.3,
+        RelativeVerifier: 0.5,
+        SimilarityVerifier: 0.03,
+    }
+    context = ComparisonContext(template, verification)
+    scores = score_all(context, thresholds=thresholds)
+    assert np.isclose(
+        scores["AbsoluteVerifier"],
+        AbsoluteVerifier(template, verification, 1.3).calculate_absolute_score(),
+    )
+    assert np.isclose(
+        scores["RelativeVerifier"],
+        RelativeVerifier(template, verification, 0.5).absolute_degree_of_disorder(),
+    )
+    assert np.isclose(
+        scores["SimilarityVerifier"],
+        SimilarityVerifier(template, verification, 0.03).calculate_similarity_score(),
+    )
+    # Every verifier read the latencies the shared context extracted
+    assert set(context._latency_vectors) == {False}
+
+
+def test_score_all_without_matches():
+    scores = score_all(make_session([("'a'", 0.1)]), make_session([("'b'", 0.1)]))
+    assert all(np.isnan(score) for score in scores.values())
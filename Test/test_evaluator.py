@@ -0,0 +1,200 @@
+# Copyright 2022, Alvin Kuruvilla <alvineasokuruvilla@gmail.com>
+
+# Use of this source code is governed by an MIT-style
+# license that can be found in the LICENSE file or at
+# https://opensource.org/licenses/MIT.
+
+import json
+import os
+import tempfile
+import numpy as np
+from core.profile import Template_Profile
+from core.td_data_dict import TD_Data_Dictionary
+from verifiers.absolute_verifier import AbsoluteVerifier
+from verifiers.evaluator import (
+    evaluate_against_directory,
+    evaluate_all_pairs,
+    evaluate_sequentially,
+    is_majority,
+    sequential_decision,
+    Verifier_Evaluator,
+)
+from verifiers.relative_verifier import RelativeVerifier
+from verifiers.similarity_verifier import SimilarityVerifier
+
+TEMPLATE = os.path.join(os.getcwd(), "Test", "sources", "single-entry-template.csv")
+
+
+def write_probe(path, holds):
+    with open(path, "w") as file:
+        file.write("Press or Release,Key,Time\n")
+        start = 0.0
+        for key, hold in holds:
+            file.write("P,%s,%r\n" % (key, start))
+            file.write("R,%s,%r\n" % (key, start + hold))
+            start += 1.0
+
+
+def test_evaluate_against_directory():
+    verifier = AbsoluteVerifier(TEMPLATE, TEMPLATE, 1.5)
+    with tempfile.TemporaryDirectory() as directory:
+        probes = os.path.join(directory, "probes")
+        os.mkdir(probes)
+        write_probe(os.path.join(probes, "1.csv"), [("'a'", 0.12), ("'o'", 0.14)])
+        write_probe(os.path.join(probes, "2.csv"), [("'a'", 0.5), ("'f'", 0.12)])
+        write_probe(os.path.join(probes, "3.csv"), [("'z'", 0.1)])
+        # The sidecar directory next to a probe is skipped
+        TD_Data_Dictionary(os.path.join(probes, "1.csv"), use_sidecar=True)
+        output_path = os.path.join(directory, "results.jsonl")
+        serial = evaluate_against_directory(TEMPLATE, probes, verifier, workers=1)
+        parallel = evaluate_against_directory(
+            TEMPLATE, probes, verifier, workers=2, chunksize=1, output_path=output_path
+        )
+        with open(output_path) as file:
+            lines = [json.loads(line) for line in file]
+    assert [os.path.basename(path) for path in serial["file"]] == [
+        "1.csv",
+        "2.csv",
+        "3.csv",
+    ]
+    assert serial["total_matches"].tolist() == [2, 2, 0]
+    assert serial["valid_matches"].tolist() == [2, 1, 0]
+    assert serial["majority"].tolist() == [True, False, False]
+    assert np.isnan(serial["percent"][2])
+    assert parallel["valid_matches"].tolist() == serial["valid_matches"].tolist()
+    assert [line["file"] for line in lines] == serial["file"].tolist()
+
+
+def test_evaluate_all_pairs_resumes():
+    generator = np.random.default_rng(8)
+    keys = ["'%s'" % letter for letter in "abcdefgh"]
+    verifiers = [
+        AbsoluteVerifier(TEMPLATE, TEMPLATE, 1.5),
+        SimilarityVerifier(TEMPLATE, TEMPLATE, 0.02),
+        RelativeVerifier(TEMPLATE, TEMPLATE, 0.5),
+    ]
+    with tempfile.TemporaryDirectory() as directory:
+        paths = []
+        for i in range(5):
+            path = os.path.join(directory, "%d.csv" % i)
+            write_probe(path, [(key, generator.uniform(0.05, 0.3)) for key in keys])
+            paths.append(path)
+        checkpoints = os.path.join(directory, "checkpoints")
+        first = evaluate_all_pairs(
+            paths, verifiers, checkpoint_directory=checkpoints, block_size=2, workers=2
+        )
+        assert len(os.listdir(checkpoints)) == 10
+        os.remove(os.path.join(checkpoints, "block_1_2.npz"))
+        resumed = evaluate_all_pairs(
+            paths, verifiers, checkpoint_directory=checkpoints, block_size=2, workers=1
+        )
+        score = AbsoluteVerifier(paths[3], paths[4], 1.5).score_keys()[1].mean()
+    for verifier in verifiers:
+        name = type(verifier).__name__
+        assert first[name].shape == (5, 5)
+        assert np.array_equal(first[name], resumed[name], equal_nan=True)
+    assert np.allclose(np.diag(first["AbsoluteVerifier"]), 1.0)
+    assert np.isclose(first["AbsoluteVerifier"][3, 4], score)
+
+
+def test_evaluate_all_pairs_reports_failures():
+    verifiers = [RelativeVerifier(TEMPLATE, TEMPLATE, 0.5)]
+    with tempfile.TemporaryDirectory() as directory:
+        paths = []
+        for i, holds in enumerate(
+            [
+                [("'a'", 0.1), ("'b'", 0.2)],
+                [("'z'", 0.1)],
+                [("'a'", 0.1), ("'b'", 0.3)],
+            ]
+        ):
+            path = os.path.join(directory, "%d.csv" % i)
+            write_probe(path, holds)
+            paths.append(path)
+        checkpoints = os.path.join(directory, "checkpoints")
+        first = evaluate_all_pairs(
+            paths, verifiers, checkpoint_directory=checkpoints, block_size=2, workers=2
+        )
+        resumed = evaluate_all_pairs(
+            paths, verifiers, checkpoint_directory=checkpoints, block_size=2, workers=1
+        )
+    # A single key has no degree of disorder
+    assert first["failures"] == [
+        {
+            "template": 1,
+            "probe": 1,
+            "verifier": "RelativeVerifier",
+            "error": "ZeroDivisionError: float division by zero",
+        }
+    ]
+    assert resumed["failures"] == first["failures"]
+    assert np.isnan(first["RelativeVerifier"][1, 1])
+
+
+def test_sequential_decision():
+    assert sequential_decision(iter([True, True, True, False, False]), 5) == (
+        True,
+        3,
+        3,
+    )
+    assert sequential_decision(iter([False, False, False, True, True]), 5) == (
+        False,
+        3,
+        0,
+    )
+    assert sequential_decision(iter([True, False, True, False]), 4) == (False, 4, 2)
+    generator = np.random.default_rng(4)
+    for _ in range(50):
+        valids = generator.random(9) < 0.5
+        decision, consumed, _ = sequential_decision(iter(valids), 9)
+        assert decision == is_majority(valids.mean())
+        assert consumed <= 9
+
+
+def test_evaluate_sequentially():
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "probe.csv")
+        write_probe(
+            path,
+            [("'a'", 0.5), ("'o'", 0.14), ("'f'", 0.9), ("'s'", 0.4), ("'a'", 0.4)],
+        )
+        verifier = AbsoluteVerifier(TEMPLATE, path, 1.5)
+        result = evaluate_sequentially(verifier, order="frequency")
+        keys, valid = verifier.score_keys()
+    assert result["total"] == 4
+    assert result["decision"] == is_majority(valid.mean())
+    assert result["consumed"] == 3
+
+
+class Counting_Verifier(AbsoluteVerifier):
+    def __init__(self, *args):
+        super().__init__(*args)
+        self.scored = 0
+
+    def check_latencies(self, template_latency, verification_latency) -> bool:
+        self.scored += 1
+        return super().check_latencies(template_latency, verification_latency)
+
+
+def test_evaluate_sequentially_scores_lazily():
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "probe.csv")
+        write_probe(
+            path,
+            [("'a'", 0.5), ("'o'", 0.14), ("'f'", 0.9), ("'s'", 0.4), ("'a'", 0.4)],
+        )
+        verifier = Counting_Verifier(TEMPLATE, path, 1.5)
+        result = evaluate_sequentially(verifier, order="frequency")
+        _, valid = verifier.score_keys()
+    assert verifier.scored == result["consumed"] == 3
+    assert result["total"] == 4
+    assert result["decision"] == is_majority(valid.mean())
+
+
+def test_evaluate_profile_verifier():
+    template = TD_Data_Dictionary(TEMPLATE)
+    profile = Template_Profile.from_sessions([template])
+    for source in (template, profile):
+        evaluator = Verifier_Evaluator(SimilarityVerifier(source, TEMPLATE, 0.01), 0.5)
+        assert len(evaluator.matched_keys()) == len(template.get_unique_keys())
+        assert evaluator.evaluate(*evaluator.extract_features()) == tuple("True")
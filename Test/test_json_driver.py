@@ -0,0 +1,32 @@
+# Copyright 2022, Alvin Kuruvilla <alvineasokuruvilla@gmail.com>
+
+# Use of this source code is governed by an MIT-style
+# license that can be found in the LICENSE file or at
+# https://opensource.org/licenses/MIT.
+
+import os
+import json
+import tempfile
+from converters.json_driver import JSONDriver
+from core.td_data_dict import TD_Data_Dictionary
+
+
+def test_write_td_data_round_trip():
+    path = os.path.join(os.getcwd(), "Test", "sources", "single-entry-template.csv")
+    holder = TD_Data_Dictionary(path)
+    with tempfile.TemporaryDirectory() as directory:
+        out = os.path.join(directory, "td.json")
+        JSONDriver().write_td_data_to_file(holder, out)
+        with open(out, "r") as handle:
+            text = handle.read()
+    # The kht and kit dictionaries are written back to back
+    decoder = json.JSONDecoder()
+    kht, end = decoder.raw_decode(text)
+    kit, _ = decoder.raw_decode(text, end)
+    assert kht.pop("ID") == "KHT"
+    assert kit.pop("ID") == "KIT"
+    assert kht == holder.make_kht_dictionary()
+    assert kit == {
+        json.dumps(key): value for key, value in holder.make_kit_dictionary().items()
+    }
+    assert "ID" not in holder.make_kht_dictionary()
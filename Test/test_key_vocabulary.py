@@ -0,0 +1,37 @@
+# Copyright 2022, Alvin Kuruvilla <alvineasokuruvilla@gmail.com>
+
+# Use of this source code is governed by an MIT-style
+# license that can be found in the LICENSE file or at
+# https://opensource.org/licenses/MIT.
+
+import os
+from core.key_vocabulary import KeyVocabulary, normalize_key_name
+from core.td_data_dict import TD_Data_Dictionary
+
+
+def test_normalize_key_name():
+    assert normalize_key_name("'A'") == "a"
+    assert normalize_key_name("Key.shift") == "key.shift"
+    assert normalize_key_name("'\\x03'") == "\\x03"
+    assert normalize_key_name("'''") == "'"
+
+
+def test_codes_are_stable():
+    vocabulary = KeyVocabulary()
+    codes = vocabulary.encode(["'a'", "Key.space", "'a'", "'\\x03'"])
+    assert list(codes) == [0, 1, 0, 2]
+    assert list(vocabulary.encode(["'\\x03'", "'b'"])) == [2, 3]
+    assert vocabulary.lookup("'c'") == -1
+    assert list(vocabulary.is_letter()) == [True, False, False, True]
+    assert list(vocabulary.is_space()) == [False, True, False, False]
+    assert list(vocabulary.is_control()) == [False, False, True, False]
+
+
+def test_sessions_share_codes():
+    d1 = TD_Data_Dictionary(
+        os.path.join(os.getcwd(), "Test", "sources", "single-entry-template.csv")
+    )
+    d2 = TD_Data_Dictionary(
+        os.path.join(os.getcwd(), "Test", "sources", "single-entry-verification.csv")
+    )
+    assert d1.key_codes[0] == d2.key_codes[0]
@@ -0,0 +1,65 @@
+# Copyright 2022, Alvin Kuruvilla <alvineasokuruvilla@gmail.com>
+
+# Use of this source code is governed by an MIT-style
+# license that can be found in the LICENSE file or at
+# https://opensource.org/licenses/MIT.
+
+import os
+import tempfile
+import numpy as np
+from core.profile import Latency_Statistics, Template_Profile
+from verifiers.similarity_verifier import SimilarityVerifier
+from Test.sessions import make_session
+
+
+def test_latency_statistics_welford_and_merge():
+    generator = np.random.default_rng(5)
+    samples = generator.uniform(0.05, 0.3, size=40)
+    single = Latency_Statistics()
+    for sample in samples:
+        single.add("'a'", [sample])
+    grouped = Latency_Statistics()
+    for part in np.array_split(samples, 3):
+        grouped.merge_groups(
+            ["'a'"], [len(part)], [part.mean()], [((part - part.mean()) ** 2).sum()]
+        )
+    for statistics in (single, grouped):
+        counts, means, variances = statistics.lookup(["'a'", "'b'"])
+        assert counts.tolist() == [40, 0]
+        assert np.isclose(means[0, 0], samples.mean())
+        assert np.isclose(variances[0, 0], samples.var())
+        assert np.isnan(means[1, 0])
+
+
+def test_profile_from_sessions():
+    first = make_session([("'a'", 0.1), ("'b'", 0.2), ("'a'", 0.3)])
+    second = make_session([("'b'", 0.4), ("'a'", 0.2)])
+    profile = Template_Profile.from_sessions([first, second])
+    assert profile.sessions == 2
+    assert profile.kht.keys() == ["'a'", "'b'"]
+    counts, means, variances = profile.kht.lookup(["'a'", "'b'"])
+    assert counts.tolist() == [3, 2]
+    assert np.allclose(means[:, 0], [0.2, 0.3])
+    assert np.allclose(variances[:, 0], [np.var([0.1, 0.3, 0.2]), 0.01])
+    counts, means, _ = profile.kit.lookup([("'a'", "'b'"), ("'b'", "'a'")])
+    assert counts.tolist() == [1, 2]
+    assert np.allclose(means[1], [1.0, 1.25, 0.7, 0.95])
+
+
+def test_similarity_verifier_with_profile():
+    template = make_session([("'a'", 0.1), ("'b'", 0.2), ("'c'", 0.3)])
+    verification = make_session([("'a'", 0.12), ("'b'", 0.8), ("'c'", 0.3)])
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "profile.pickle")
+        Template_Profile.from_sessions([template]).save(path)
+        profile = Template_Profile.load(path)
+    from_profile = SimilarityVerifier(profile, verification, 0.05)
+    from_session = SimilarityVerifier(template, verification, 0.05)
+    assert from_profile.find_all_valid_keys() == ["'a'", "'c'"]
+    assert from_session.find_all_valid_keys() == ["'a'", "'c'"]
+    assert from_profile.is_key_valid("'a'") and not from_profile.is_key_valid("'b'")
+    assert np.isclose(from_profile.calculate_similarity_score(), 1 / 3)
+    keys, valid = from_profile.score_keys(use_kit=True)
+    assert valid.tolist() == [
+        from_profile.is_key_valid(key, use_kit=True) for key in keys
+    ]
@@ -0,0 +1,71 @@
+# Copyright 2022, Alvin Kuruvilla <alvineasokuruvilla@gmail.com>
+
+# Use of this source code is governed by an MIT-style
+# license that can be found in the LICENSE file or at
+# https://opensource.org/licenses/MIT.
+
+import numpy as np
+from verifiers.relative_verifier import (
+    IncrementalRelativeVerifier,
+    RelativeVerifier,
+    rank_disorder,
+)
+from Test.sessions import make_session
+
+
+def test_degree_of_disorder_example():
+    # Ordered by latency the template reads C H M Q W and the verification H W C Q M
+    template = make_session(
+        [("'h'", 0.2), ("'w'", 0.5), ("'c'", 0.1), ("'q'", 0.4), ("'m'", 0.3)]
+    )
+    verification = make_session(
+        [("'h'", 0.1), ("'w'", 0.2), ("'c'", 0.3), ("'q'", 0.4), ("'m'", 0.5)]
+    )
+    verifier = RelativeVerifier(template, verification, 0.5)
+    assert verifier.degree_of_disorder() == 8
+    assert verifier.find_distance("'w'") == 3
+    assert verifier.max_degree_of_disorder() == 12
+    assert np.isclose(verifier.absolute_degree_of_disorder(), 8 / 12)
+    scores = verifier.score_sessions(
+        [verification, template, make_session([("'h'", 0.1)])]
+    )
+    assert np.allclose(scores[:2], [8 / 12, 0.0])
+    assert np.isnan(scores[2])
+
+
+def test_rank_disorder_ignores_missing_keys():
+    disorder, n = rank_disorder(
+        [1.0, 2.0, 3.0, 4.0], [[4.0, 3.0, 2.0, 1.0], [np.nan, 3.0, 2.0, 1.0]]
+    )
+    assert disorder.tolist() == [8, 4]
+    assert n.tolist() == [4, 3]
+
+
+def test_incremental_matches_batch():
+    generator = np.random.default_rng(3)
+    keys = ["'%s'" % letter for letter in "abcdefghij"]
+    template = make_session([(key, generator.uniform(0.05, 0.3)) for key in keys])
+    holds = [
+        (keys[generator.integers(len(keys))], generator.uniform(0.05, 0.3))
+        for _ in range(60)
+    ]
+    incremental = IncrementalRelativeVerifier(template, 0.5)
+    for count, (key, hold) in enumerate(holds, start=1):
+        incremental.add_hold(key, hold)
+        verifier = RelativeVerifier(template, make_session(holds[:count]), 0.5)
+        assert incremental.degree_of_disorder() == verifier.degree_of_disorder()
+    assert np.isclose(
+        incremental.absolute_degree_of_disorder(),
+        verifier.absolute_degree_of_disorder(),
+    )
+
+
+def test_incremental_events():
+    template = make_session([("'a'", 0.1), ("'b'", 0.2)])
+    incremental = IncrementalRelativeVerifier(template, 0.5)
+    assert incremental.add_event("P", "'b'", 0.0) is None
+    assert np.isnan(incremental.add_event("R", "'b'", 0.1))
+    assert incremental.add_event("R", "'z'", 0.2) is None
+    incremental.add_event("P", "'a'", 1.0)
+    assert incremental.add_event("R", "'a'", 1.3) == 1.0
+    assert incremental.matched_keys() == ["'b'", "'a'"]
@@ -5,7 +5,11 @@
 # https://opensource.org/licenses/MIT.
 
 import os
-from core.td_data_dict import TD_Data_Dictionary
+import shutil
+import tempfile
+import numpy as np
+from core.td_data_dict import TD_Data_Dictionary, make_arrow_table, make_dataframe
+from core.exceptions import MalformedCSVError
 
 
 def test_path():
@@ -51,3 +55,138 @@ def test_single_entry_kht_calculation():
     data = d1.calculate_key_hold_time()
     assert len(data) == 1
     assert list(data.values())[0] == 0.13029980659484863
+
+
+def test_columnar_storage():
+    path = os.path.join(os.getcwd(), "Test", "sources", "single-entry-template.csv")
+    holder = TD_Data_Dictionary(path)
+    assert holder.key_codes.dtype == np.int32
+    assert holder.action_column.dtype == np.uint8
+    assert holder.time_column.dtype == np.float64
+    assert list(holder.get_press_times_for_key("'a'")) == [1642214272.103678]
+    assert list(holder.get_release_times_for_key("'a'")) == [1642214272.222542]
+
+
+def test_key_index_follows_appended_events():
+    path = os.path.join(os.getcwd(), "Test", "sources", "single-entry-template.csv")
+    holder = TD_Data_Dictionary(path)
+    assert len(holder.get_press_times_for_key("'a'")) == 1
+    holder.append_events(["'a'", "'z'"], [0, 0], [1642214278.0, 1642214279.0])
+    assert list(holder.get_press_times_for_key("'a'")) == [
+        1642214272.103678,
+        1642214278.0,
+    ]
+    assert list(holder.get_press_times_for_key("'z'")) == [1642214279.0]
+    assert len(holder.get_all_times_for_key("'a'")) == 3
+
+
+def test_feature_cache():
+    path = os.path.join(os.getcwd(), "Test", "sources", "single-entry-template.csv")
+    holder = TD_Data_Dictionary(path)
+    first = holder.calculate_key_hold_time()
+    assert holder.calculate_key_hold_time() == first
+    assert holder.cache_info()["hits"] == 1
+    holder.invalidate()
+    assert holder.calculate_key_hold_time() == first
+    assert holder.cache_info() == {"hits": 0, "misses": 2, "size": 2}
+
+
+def test_feature_cache_results_are_detached():
+    path = os.path.join(os.getcwd(), "Test", "sources", "single-entry-template.csv")
+    holder = TD_Data_Dictionary(path)
+    kht = holder.calculate_key_hold_time()
+    kht["ID"] = "KHT"
+    assert kht["'missing'"] == 0.0
+    assert "ID" not in holder.calculate_key_hold_time()
+    assert "'missing'" not in holder.calculate_key_hold_time()
+    pairs = holder.get_key_pairs()
+    pairs[0].append("'x'")
+    assert len(holder.get_key_pairs()[0]) == 2
+    assert not holder.key_hold_times().holds.flags.writeable
+
+
+def test_bulk_and_row_ingest_agree():
+    path = os.path.join(os.getcwd(), "Test", "sources", "single-entry-template.csv")
+    bulk = TD_Data_Dictionary(path)
+    rows = TD_Data_Dictionary(path, bulk_ingest=False)
+    assert bulk.get_all_key_names() == rows.get_all_key_names()
+    assert np.array_equal(bulk.action_column, rows.action_column)
+    assert np.array_equal(bulk.time_column, rows.time_column)
+
+
+def test_malformed_header():
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "bad.csv")
+        with open(path, "w") as file:
+            file.write("Key,Time\n'a',1.0\n")
+        try:
+            TD_Data_Dictionary(path)
+            assert False
+        except MalformedCSVError:
+            pass
+
+
+def test_sidecar_write_failure_is_not_fatal():
+    source = os.path.join(os.getcwd(), "Test", "sources", "single-entry-template.csv")
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "session.csv")
+        shutil.copyfile(source, path)
+        # A plain file where the sidecar directory should go makes the write fail
+        with open(path + ".td", "w") as file:
+            file.write("")
+        assert len(TD_Data_Dictionary(path, use_sidecar=True).data()) == 9
+
+
+def test_row_ingest_fallback():
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "fallback.csv")
+        with open(path, "w") as file:
+            file.write("Press or Release,Key,Time\nP,'a',1.0\nR,'a',oops\nP,'b',2.0,x\n")
+        holder = TD_Data_Dictionary(path)
+        assert len(holder.data()) == 3
+        assert len(holder.times()) == 2
+
+
+def test_sidecar_round_trip():
+    source = os.path.join(os.getcwd(), "Test", "sources", "single-entry-template.csv")
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "session.csv")
+        shutil.copyfile(source, path)
+        parsed = TD_Data_Dictionary(path, use_sidecar=True)
+        assert os.path.isfile(os.path.join(path + ".td", "header.json"))
+        mapped = TD_Data_Dictionary(path, use_sidecar=True)
+        assert not mapped.time_column.flags.writeable
+        assert mapped.get_all_key_names() == parsed.get_all_key_names()
+        assert np.array_equal(mapped.time_column, parsed.time_column)
+        assert mapped.calculate_key_hold_time() == parsed.calculate_key_hold_time()
+        # A changed source must not be served from the stale sidecar
+        with open(path, "a") as file:
+            file.write("R,Key.ctrl,1642214277.5\n")
+        assert len(TD_Data_Dictionary(path, use_sidecar=True).data()) == 10
+
+
+def test_make_dataframe():
+    path = os.path.join(os.getcwd(), "Test", "sources", "single-entry-template.csv")
+    holder = TD_Data_Dictionary(path)
+    df = make_dataframe(holder)
+    assert list(df.columns) == ["Actions", "Keys", "Times"]
+    assert len(df) == 9
+    assert str(df["Keys"].dtype) == "category"
+    assert df["Keys"].tolist() == holder.get_all_key_names()
+    assert df["Actions"].tolist()[:2] == ["P", "R"]
+    assert df["Times"].dtype == np.float64
+
+
+def test_key_categories_are_session_local():
+    path = os.path.join(os.getcwd(), "Test", "sources", "single-entry-template.csv")
+    other = os.path.join(os.getcwd(), "Test", "sources", "single-entry-verification.csv")
+    holder = TD_Data_Dictionary(path)
+    TD_Data_Dictionary(other)
+    names = holder.get_all_key_names()
+    keys = make_dataframe(holder)["Keys"]
+    assert sorted(keys.cat.categories) == sorted(set(names))
+    table = make_arrow_table(holder)
+    assert sorted(table.column("Keys").chunk(0).dictionary.to_pylist()) == sorted(
+        set(names)
+    )
+    assert table.column("Keys").to_pylist() == names
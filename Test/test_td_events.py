@@ -0,0 +1,52 @@
+# Copyright 2022, Alvin Kuruvilla <alvineasokuruvilla@gmail.com>
+
+# Use of this source code is governed by an MIT-style
+# license that can be found in the LICENSE file or at
+# https://opensource.org/licenses/MIT.
+
+import numpy as np
+from core.td_events import (
+    ACTION_PRESS,
+    ACTION_RELEASE,
+    pair_key_holds,
+    extract_digraph_latencies,
+)
+
+P = ACTION_PRESS
+R = ACTION_RELEASE
+
+
+def test_pair_key_holds_rollover():
+    # a is still held down when b is pressed
+    codes = np.array([0, 1, 0, 1])
+    actions = np.array([P, P, R, R])
+    times = np.array([0.0, 0.1, 0.3, 0.35])
+    kht = pair_key_holds(codes, actions, times)
+    assert kht.means() == {0: 0.3, 1: 0.35 - 0.1}
+    assert len(kht.orphan_presses) == 0
+    assert len(kht.orphan_releases) == 0
+
+
+def test_pair_key_holds_orphans_and_repeats():
+    codes = np.array([0, 0, 0, 1, 2, 2])
+    actions = np.array([P, P, R, R, P, R])
+    times = np.array([1.0, 1.5, 2.0, 2.5, 3.0, 3.25])
+    kht = pair_key_holds(np.append(codes, 0), np.append(actions, P), np.append(times, 4.0))
+    # The repeated press of key 0 does not restart its hold
+    assert kht.hold_arrays()[0].tolist() == [1.0]
+    assert kht.hold_arrays()[2].tolist() == [0.25]
+    assert kht.repeated_presses.tolist() == [1]
+    assert kht.orphan_releases.tolist() == [3]
+    assert kht.orphan_presses.tolist() == [6]
+    assert list(kht.key_codes()) == [0, 2]
+
+
+def test_extract_digraph_latencies():
+    # Keystrokes a (0.0 - 0.2), b (0.1 - 0.3) and a again (0.5 - 0.6)
+    codes = np.array([0, 1, 0, 1, 0, 0])
+    actions = np.array([P, P, R, R, P, R])
+    times = np.array([0.0, 0.1, 0.2, 0.3, 0.5, 0.6])
+    kit = extract_digraph_latencies(pair_key_holds(codes, actions, times), 2, times)
+    assert set(kit.means().keys()) == {(0, 1), (1, 0)}
+    assert np.allclose(kit.means()[(0, 1)], [0.1, 0.3, -0.1, 0.1])
+    assert np.allclose(kit.means()[(1, 0)], [0.4, 0.5, 0.2, 0.3])
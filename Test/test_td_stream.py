@@ -0,0 +1,80 @@
+# Copyright 2022, Alvin Kuruvilla <alvineasokuruvilla@gmail.com>
+
+# Use of this source code is governed by an MIT-style
+# license that can be found in the LICENSE file or at
+# https://opensource.org/licenses/MIT.
+
+import os
+import random
+import tempfile
+import numpy as np
+from core.td_data_dict import TD_Data_Dictionary
+from core.td_stream import stream_features
+
+
+def write_random_session(path, events=400, seed=7):
+    # Overlapping keystrokes over a handful of keys, with a few presses never released
+    rng = random.Random(seed)
+    rows = []
+    time = 1642214272.0
+    for _ in range(events):
+        key = "'%s'" % rng.choice("abcdef")
+        time += rng.uniform(0.01, 0.2)
+        rows.append(("P", key, time))
+        if rng.random() > 0.05:
+            rows.append(("R", key, time + rng.uniform(0.05, 0.4)))
+    rows.sort(key=lambda row: row[2])
+    with open(path, "w") as file:
+        file.write("Press or Release,Key,Time\n")
+        for action, key, time in rows:
+            file.write("%s,%s,%r\n" % (action, key, time))
+
+
+def test_streamed_features_match_whole_file():
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "session.csv")
+        write_random_session(path)
+        whole = TD_Data_Dictionary(path)
+        expected_kht = whole.calculate_key_hold_time()
+        expected_kit = whole.calculate_key_interval_time()
+        for chunk_size in (7, 64, 10000):
+            kht, kit = stream_features(path, chunk_size=chunk_size)
+            streamed_kht = kht.result()
+            streamed_kit = kit.result()
+            assert streamed_kht.keys() == expected_kht.keys()
+            for key, value in expected_kht.items():
+                assert np.isclose(streamed_kht[key], value)
+            assert streamed_kit.keys() == expected_kit.keys()
+            for digraph, value in expected_kit.items():
+                assert np.allclose(streamed_kit[digraph], value)
+
+
+def test_overflowing_pending_keystrokes_are_orphaned():
+    # 'z' is held across 20 keystrokes, more than the accumulator may hold back
+    rows = [("P", "'z'", 0.0)]
+    time = 0.0
+    for i in range(20):
+        key = "'a'" if i % 2 == 0 else "'b'"
+        time += 0.1 + 0.01 * i
+        rows.append(("P", key, time))
+        rows.append(("R", key, time + 0.05))
+    rows.append(("R", "'z'", time + 0.2))
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "session.csv")
+        with open(path, "w") as file:
+            file.write("Press or Release,Key,Time\n")
+            for action, key, time in rows:
+                file.write("%s,%s,%r\n" % (action, key, time))
+        expected = TD_Data_Dictionary(path).calculate_key_interval_time()
+        _, kit = stream_features(path, chunk_size=4, max_pending=5)
+        _, unbounded = stream_features(path, chunk_size=4)
+    streamed = kit.result()
+    assert kit.orphaned == 1
+    # Without 'z' the remaining keystrokes form exactly the digraphs of the whole file
+    del expected[("'z'", "'a'")]
+    assert streamed.keys() == expected.keys()
+    for digraph, value in expected.items():
+        assert np.allclose(streamed[digraph], value)
+        assert streamed[digraph][0] > 0
+    assert unbounded.orphaned == 0
+    assert ("'z'", "'a'") in unbounded.result()
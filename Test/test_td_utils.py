@@ -0,0 +1,81 @@
+# Copyright 2022, Alvin Kuruvilla <alvineasokuruvilla@gmail.com>
+
+# Use of this source code is governed by an MIT-style
+# license that can be found in the LICENSE file or at
+# https://opensource.org/licenses/MIT.
+
+import os
+import tempfile
+import numpy as np
+from core.td_data_dict import TD_Data_Dictionary
+from core.td_utils import (
+    ComparisonContext,
+    KeyOverlapIndex,
+    count_key_matches,
+    find_matching_interval_keys,
+    find_matching_keys,
+    segment_session,
+    split_dictionary_by_key,
+)
+
+TEMPLATE = os.path.join(os.getcwd(), "Test", "sources", "single-entry-template.csv")
+VERIFICATION = os.path.join(
+    os.getcwd(), "Test", "sources", "single-entry-verification.csv"
+)
+
+
+def test_context_matches_paths():
+    context = ComparisonContext(TEMPLATE, VERIFICATION)
+    assert find_matching_keys(context) == find_matching_keys(TEMPLATE, VERIFICATION)
+    assert find_matching_keys(context) == ["'a'"]
+    assert count_key_matches(context) == 1
+    assert find_matching_interval_keys(context) == []
+
+
+def test_context_accepts_loaded_sessions():
+    template = TD_Data_Dictionary(TEMPLATE)
+    context = ComparisonContext(template, template)
+    assert context.template_dict is template
+    assert context.template_path() == TEMPLATE
+    assert len(find_matching_interval_keys(context)) == 3
+
+
+def test_key_overlap_index():
+    index = KeyOverlapIndex()
+    template = index.add(TEMPLATE)
+    verification = index.add(VERIFICATION)
+    counts = index.overlap_counts()
+    assert counts.tolist() == [[4, 1], [1, 1]]
+    assert index.overlap_counts(use_kit=True).tolist() == [[3, 0], [0, 0]]
+    assert index.candidate_pairs([template], [template, verification], 2) == [
+        (template, template)
+    ]
+
+
+def test_segment_session():
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "words.csv")
+        with open(path, "w") as file:
+            file.write("Press or Release,Key,Time\n")
+            rows = [
+                ("P", "'h'", 1.0),
+                ("R", "'h'", 1.1),
+                ("P", "'i'", 1.2),
+                ("R", "'i'", 1.3),
+                ("P", "Key.space", 1.4),
+                ("R", "Key.space", 1.5),
+                ("P", "'y'", 1.6),
+                ("R", "'y'", 1.7),
+                ("P", "'o'", 5.0),
+                ("R", "'o'", 5.1),
+            ]
+            for row in rows:
+                file.write("%s,%s,%r\n" % row)
+        session = TD_Data_Dictionary(path)
+        words = list(segment_session(session))
+        assert [len(word.data()) for word in words] == [4, 5]
+        assert words[0].calculate_key_hold_time().keys() == {"'h'", "'i'"}
+        assert np.shares_memory(words[1].time_column, session.time_column)
+        bursts = list(segment_session(session, idle_gap_ms=1000))
+        assert [len(burst.data()) for burst in bursts] == [4, 3, 2]
+        assert len(split_dictionary_by_key(session, "key.space")) == 1
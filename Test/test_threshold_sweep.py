@@ -0,0 +1,78 @@
+# Copyright 2022, Alvin Kuruvilla <alvineasokuruvilla@gmail.com>
+
+# Use of this source code is governed by an MIT-style
+# license that can be found in the LICENSE file or at
+# https://opensource.org/licenses/MIT.
+
+import numpy as np
+from verifiers.absolute_verifier import AbsoluteVerifier
+from verifiers.threshold_sweep import (
+    sweep_statistics,
+    sweep_thresholds,
+    valid_fractions,
+)
+from Test.sessions import make_session
+
+
+def test_valid_fractions():
+    generator = np.random.default_rng(11)
+    statistics = [generator.uniform(1, 3, size=n) for n in (5, 1, 0, 8)]
+    thresholds = np.linspace(1, 3, 9)
+    for strict in (False, True):
+        fractions = valid_fractions(statistics, thresholds, strict)
+        for i, values in enumerate(statistics):
+            for j, threshold in enumerate(thresholds):
+                passed = values < threshold if strict else values <= threshold
+                if len(values) == 0:
+                    assert np.isnan(fractions[i, j])
+                else:
+                    assert np.isclose(fractions[i, j], passed.mean())
+
+
+def test_sweep_statistics_eer():
+    genuine = [np.array([1.1]), np.array([1.2]), np.array([1.6])]
+    impostor = [np.array([1.5]), np.array([2.0]), np.array([3.0])]
+    sweep = sweep_statistics(genuine, impostor, [1.0, 1.3, 1.55, 2.5])
+    assert np.allclose(sweep.far, [0, 0, 1 / 3, 2 / 3])
+    assert np.allclose(sweep.frr, [1, 1 / 3, 1 / 3, 0])
+    assert sweep.eer_threshold() == 1.55
+    assert np.isclose(sweep.eer(), 1 / 3)
+
+
+def test_sweep_matches_verifier():
+    generator = np.random.default_rng(2)
+    keys = ["'%s'" % letter for letter in "abcdef"]
+    sessions = [
+        make_session([(key, generator.uniform(0.05, 0.3)) for key in keys])
+        for _ in range(4)
+    ]
+    genuine = [(sessions[0], sessions[1]), (sessions[0], sessions[2])]
+    impostor = [(sessions[0], sessions[3])]
+    thresholds = np.array([1.1, 1.5, 2.0, 3.0])
+    sweep = sweep_thresholds(AbsoluteVerifier, genuine, impostor, thresholds)
+    for j, threshold in enumerate(thresholds):
+        accepted = [
+            np.mean(AbsoluteVerifier(t, v, threshold).score_keys()[1]) > 0.5
+            for t, v in genuine
+        ]
+        assert np.isclose(sweep.frr[j], 1 - np.mean(accepted))
+        rejected = AbsoluteVerifier(sessions[0], sessions[3], threshold)
+        assert sweep.far[j] == float(np.mean(rejected.score_keys()[1]) > 0.5)
+
+
+def test_sweep_rejects_ratios_below_one():
+    # Negative hold times give ratios below 1, which the verifier never accepts
+    template = make_session(
+        [("'a'", 0.1), ("'b'", -0.2), ("'c'", 0.3), ("'d'", 0.2), ("'e'", -0.1)]
+    )
+    verification = make_session(
+        [("'a'", 0.15), ("'b'", 0.1), ("'c'", -0.3), ("'d'", 0.25), ("'e'", 0.1)]
+    )
+    thresholds = np.array([1.1, 1.3, 1.6, 3.0])
+    sweep = sweep_thresholds(
+        AbsoluteVerifier, [(template, verification)], [], thresholds
+    )
+    for j, threshold in enumerate(thresholds):
+        valid = AbsoluteVerifier(template, verification, threshold).score_keys()[1]
+        assert sweep.frr[j] == float(not np.mean(valid) > 0.5)
+    assert np.all(sweep.frr == 1.0)
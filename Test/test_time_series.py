@@ -0,0 +1,85 @@
+# Copyright 2022, Alvin Kuruvilla <alvineasokuruvilla@gmail.com>
+
+# Use of this source code is governed by an MIT-style
+# license that can be found in the LICENSE file or at
+# https://opensource.org/licenses/MIT.
+
+import numpy as np
+from numpy import inf
+from extractors.time_series import Feature_Set, _dtw_reference, _traceback
+
+
+def absolute_difference(a, b):
+    return abs(a - b)
+
+
+def test_dtw_matches_reference():
+    generator = np.random.default_rng(6)
+    cases = [(12, 15, inf, 1.0), (20, 17, 4, 1.0), (9, 9, 0, 1.0), (14, 11, 5, 1.7)]
+    for r, c, w, s in cases:
+        x = generator.normal(size=r)
+        y = generator.normal(size=c)
+        C, D0 = _dtw_reference(x, y, absolute_difference, 1, w, s)
+        for dist in (absolute_difference, "cityblock"):
+            distance, cost, accumulated, path = Feature_Set.dtw(x, y, dist, w=w, s=s)
+            assert np.allclose(cost, C)
+            assert np.allclose(accumulated, D0[1:, 1:])
+            assert np.isclose(distance, D0[-1, -1])
+            expected = _traceback(D0)
+            assert np.array_equal(path[0], expected[0])
+            assert np.array_equal(path[1], expected[1])
+
+
+def test_dtw_path():
+    x = np.array([0.0, 1.0, 2.0, 3.0])
+    y = np.array([0.0, 1.0, 1.0, 2.0, 3.0])
+    distance, _, _, (p, q) = Feature_Set.dtw(x, y, "euclidean")
+    assert distance == 0.0
+    assert p.tolist() == [0, 1, 1, 2, 3]
+    assert q.tolist() == [0, 1, 2, 3, 4]
+
+
+def test_dtw_warp_falls_back():
+    generator = np.random.default_rng(7)
+    x = generator.normal(size=(8, 2))
+    y = generator.normal(size=(10, 2))
+    distance, _, _, _ = Feature_Set.dtw(x, y, "euclidean", warp=2)
+    C, D0 = _dtw_reference(x, y, lambda a, b: np.linalg.norm(a - b), 2, inf, 1.0)
+    assert np.isclose(distance, D0[-1, -1])
+
+
+def test_dtw_distance():
+    generator = np.random.default_rng(9)
+    cases = [(12, 15, inf, 1.0), (30, 26, 6, 1.0), (9, 9, 0, 1.0), (14, 11, 5, 1.7)]
+    for r, c, w, s in cases:
+        x = generator.normal(size=(r, 2))
+        y = generator.normal(size=(c, 2))
+        expected = Feature_Set.dtw(x, y, "euclidean", w=w, s=s)[0]
+        distance = Feature_Set.dtw_distance(x, y, "euclidean", w=w, s=s)
+        assert np.isclose(distance, expected)
+        bounded = Feature_Set.dtw_distance(
+            x, y, "euclidean", w=w, s=s, upper_bound=expected
+        )
+        assert np.isclose(bounded, expected)
+        abandoned = Feature_Set.dtw_distance(
+            x, y, "euclidean", w=w, s=s, upper_bound=expected / 2
+        )
+        assert abandoned == inf
+    x = np.arange(5.0)
+    assert np.isclose(Feature_Set.dtw_distance(x, x, absolute_difference), 0.0)
+
+
+def test_dtw_distance_exact_bound():
+    # A bound equal to the distance must never abandon, whatever the window
+    generator = np.random.default_rng(17)
+    for _ in range(40):
+        r, c = generator.integers(5, 40, size=2)
+        x = generator.normal(size=(r, 2))
+        y = generator.normal(size=(c, 2))
+        for w in (abs(r - c), abs(r - c) + 3, abs(r - c) + 10, inf):
+            for s in (1.0, 1.5):
+                expected = Feature_Set.dtw(x, y, "euclidean", w=w, s=s)[0]
+                bounded = Feature_Set.dtw_distance(
+                    x, y, "euclidean", w=w, s=s, upper_bound=expected
+                )
+                assert bounded == expected
@@ -0,0 +1,75 @@
+# Copyright 2022, Alvin Kuruvilla <alvineasokuruvilla@gmail.com>
+
+# Use of this source code is governed by an MIT-style
+# license that can be found in the LICENSE file or at
+# https://opensource.org/licenses/MIT.
+
+from collections import OrderedDict
+from converters.pickle_driver import PickleDriver
+import os
+
+
+class Feature_Store:
+    """An in-memory LRU of precomputed KHT/KIT profile files
+
+    Entries are keyed by absolute path and modification time, so a file that is rewritten on disk
+    is reloaded on its next lookup. Loaded profiles are shared between callers and must be treated as read-only.
+    """
+
+    def __init__(self, capacity: int = 256):
+        self.capacity = capacity
+        self.driver = PickleDriver()
+        self.profiles = OrderedDict()
+        self.matches = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    __slots__ = ("capacity", "driver", "profiles", "matches", "hits", "misses")
+
+    def _key(self, filepath: str):
+        path = os.path.abspath(filepath)
+        return (path, os.stat(path).st_mtime_ns)
+
+    def _remember(self, table: OrderedDict, key, value) -> None:
+        table[key] = value
+        if len(table) > self.capacity:
+            table.popitem(last=False)
+
+    def load(self, filepath: str) -> dict:
+        """Returns the profile stored at `filepath`, reading it from disk only if it is not cached yet"""
+        key = self._key(filepath)
+        if key in self.profiles:
+            self.hits += 1
+            self.profiles.move_to_end(key)
+            return self.profiles[key]
+        self.misses += 1
+        profile = self.driver.load_as_dictionary(filepath)
+        self._remember(self.profiles, key, profile)
+        return profile
+
+    def matching_keys(self, template_path: str, verification_path: str) -> list:
+        """Returns the keys present in both profiles, in template order"""
+        template = self.load(template_path)
+        verification = self.load(verification_path)
+        key = (self._key(template_path), self._key(verification_path))
+        if key in self.matches:
+            self.matches.move_to_end(key)
+            return self.matches[key]
+        matches = [name for name in template.keys() if name in verification]
+        self._remember(self.matches, key, matches)
+        return matches
+
+    def invalidate(self) -> None:
+        self.profiles.clear()
+        self.matches.clear()
+
+    def info(self):
+        return {"hits": self.hits, "misses": self.misses, "size": len(self.profiles)}
+
+
+_shared_store = Feature_Store()
+
+
+def get_feature_store() -> Feature_Store:
+    """Returns the process-wide Feature_Store"""
+    return _shared_store
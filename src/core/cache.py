@@ -0,0 +1,98 @@
+# Copyright 2022, Alvin Kuruvilla <alvineasokuruvilla@gmail.com>
+
+# Use of this source code is governed by an MIT-style
+# license that can be found in the LICENSE file or at
+# https://opensource.org/licenses/MIT.
+
+import copy
+import functools
+import numpy as np
+
+
+def freeze(value):
+    """Converts (possibly nested) lists into tuples so they can be used as part of a cache key"""
+    if isinstance(value, (list, tuple)):
+        return tuple(freeze(item) for item in value)
+    return value
+
+
+def protect(value):
+    """Makes every array reachable from a cached value read-only, in place
+
+    Arrays are shared between the cache and its callers, so they are locked instead of copied.
+    Besides containers this covers result objects like KHT_Result that keep arrays in their slots.
+    """
+    if isinstance(value, np.ndarray):
+        value.setflags(write=False)
+    elif isinstance(value, dict):
+        for item in value.values():
+            protect(item)
+    elif isinstance(value, (list, tuple)):
+        for item in value:
+            protect(item)
+    else:
+        for name in getattr(type(value), "__slots__", ()):
+            item = getattr(value, name, None)
+            if isinstance(item, np.ndarray):
+                item.setflags(write=False)
+    return value
+
+
+def detach(value):
+    """Returns a copy of the containers of a cached value so that callers can modify what they get
+
+    Dictionaries keep their type, so a cached defaultdict is handed out as a new defaultdict and a
+    lookup of a missing key on it no longer reaches the cache. Read-only arrays are shared.
+    """
+    if isinstance(value, dict):
+        result = copy.copy(value)
+        for key, item in value.items():
+            result[key] = detach(item)
+        return result
+    if isinstance(value, list):
+        return [detach(item) for item in value]
+    return value
+
+
+class Feature_Cache:
+    """Memoizes derived features by method name and arguments
+
+    Every lookup returns a fresh copy of the cached dictionaries and lists, and the arrays inside
+    them are read-only, so a caller can never change what later callers get.
+    """
+
+    def __init__(self):
+        self.store = {}
+        self.hits = 0
+        self.misses = 0
+
+    __slots__ = ("store", "hits", "misses")
+
+    def get(self, name: str, args: tuple, compute):
+        key = (name, freeze(args))
+        if key in self.store:
+            self.hits += 1
+            return detach(self.store[key])
+        self.misses += 1
+        value = protect(compute())
+        self.store[key] = value
+        return detach(value)
+
+    def invalidate(self) -> None:
+        self.store.clear()
+
+    def info(self):
+        return {"hits": self.hits, "misses": self.misses, "size": len(self.store)}
+
+
+def cached_feature(method):
+    """Memoizes a method in the `feature_cache` of the instance it is called on"""
+
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        arguments = args + tuple(sorted(kwargs.items()))
+        return self.feature_cache.get(
+            method.__name__, arguments, lambda: method(self, *args, **kwargs)
+        )
+
+    return wrapper
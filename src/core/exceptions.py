@@ -22,3 +22,17 @@ class Invalid_Verifier(Exception):
     def __init__(self, message):
         self.message = message
         super().__init__(self.message)
+
+
+class MalformedCSVError(Exception):
+    """Exception raised if a csv file does not have the shape of a capture file.
+
+    Attributes:
+        path -- input path which caused the error
+        message -- explanation of the error
+    """
+
+    def __init__(self, path, message):
+        self.path = path
+        self.message = message
+        super().__init__(self.message)
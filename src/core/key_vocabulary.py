@@ -0,0 +1,132 @@
+# Copyright 2022, Alvin Kuruvilla <alvineasokuruvilla@gmail.com>
+
+# Use of this source code is governed by an MIT-style
+# license that can be found in the LICENSE file or at
+# https://opensource.org/licenses/MIT.
+
+import re
+import numpy as np
+import pandas as pd
+
+CONTROL_CHARACTER = re.compile(r"^\\x([0-1][0-9a-f]|7f)$")
+CONTROL_KEYS = ("key.ctrl", "key.ctrl_l", "key.ctrl_r")
+SPACE_KEYS = ("key.space", " ")
+# The keys that get_letters() keeps when extracting words
+WORD_KEYS = ("key.ctrl", "key.space")
+
+
+def normalize_key_name(raw: str) -> str:
+    """
+    Convert a raw key name as written by the key logger to its normalized form.
+
+    Printable keys are written wrapped in single quotes ("'a'") and special keys
+    are written as "Key.<name>", the normalized form drops the quotes and lower cases both.
+
+    Parameters
+    ----------
+    raw: str
+          The key name as it appears in the capture file.
+    Returns
+    -------
+    str
+    """
+    if len(raw) >= 3 and raw[0] == "'" and raw[-1] == "'":
+        raw = raw[1:-1]
+    return raw.lower()
+
+
+class KeyVocabulary:
+    """Interns raw key names as stable integer key codes
+
+    A key name is normalized and classified once, when it is first seen, and keeps its code for
+    the lifetime of the vocabulary. Codes are only meaningful within one vocabulary, so anything
+    that leaves the process should carry key names rather than codes.
+    """
+
+    def __init__(self):
+        self.names = []
+        self.normalized = []
+        self.codes_by_name = {}
+        self._flags = None
+
+    def __len__(self):
+        return len(self.names)
+
+    def code(self, name: str) -> int:
+        """Returns the code of `name`, assigning the next free code if it is new"""
+        code = self.codes_by_name.get(name)
+        if code is None:
+            code = len(self.names)
+            self.codes_by_name[name] = code
+            self.names.append(name)
+            self.normalized.append(normalize_key_name(name))
+            self._flags = None
+        return code
+
+    def lookup(self, name: str) -> int:
+        """Returns the code of `name` or -1 if it has never been seen"""
+        return self.codes_by_name.get(name, -1)
+
+    def encode(self, names) -> np.ndarray:
+        """Returns the int32 codes of a sequence of key names, interning the new ones"""
+        local, uniques = pd.factorize(np.asarray(names, dtype=object))
+        table = np.array([self.code(name) for name in uniques], dtype=np.int32)
+        if len(local) == 0:
+            return np.zeros(0, dtype=np.int32)
+        return table[local]
+
+    def name(self, code: int) -> str:
+        return self.names[code]
+
+    def decode(self, codes) -> np.ndarray:
+        """Returns the key names of an array of codes as an object array"""
+        return np.asarray(self.names, dtype=object)[np.asarray(codes, dtype=np.int64)]
+
+    def _classify(self):
+        if self._flags is None or len(self._flags["is_letter"]) != len(self.names):
+            normalized = self.normalized
+            self._flags = {
+                "is_letter": np.array(
+                    [len(n) == 1 and "a" <= n <= "z" for n in normalized], dtype=bool
+                ),
+                "is_control": np.array(
+                    [
+                        bool(CONTROL_CHARACTER.match(n)) or n in CONTROL_KEYS
+                        for n in normalized
+                    ],
+                    dtype=bool,
+                ),
+                "is_space": np.array([n in SPACE_KEYS for n in normalized], dtype=bool),
+                "is_word_key": np.array(
+                    [
+                        (len(n) == 1 and "a" <= n <= "z") or n in WORD_KEYS
+                        for n in normalized
+                    ],
+                    dtype=bool,
+                ),
+            }
+        return self._flags
+
+    def is_letter(self) -> np.ndarray:
+        """Returns a boolean array, indexed by code, of the keys that are the letters a to z"""
+        return self._classify()["is_letter"]
+
+    def is_control(self) -> np.ndarray:
+        """Returns a boolean array, indexed by code, of control characters and the ctrl keys"""
+        return self._classify()["is_control"]
+
+    def is_space(self) -> np.ndarray:
+        """Returns a boolean array, indexed by code, of the space keys"""
+        return self._classify()["is_space"]
+
+    def is_word_key(self) -> np.ndarray:
+        """Returns a boolean array, indexed by code, of the keys get_letters() keeps"""
+        return self._classify()["is_word_key"]
+
+
+_shared_vocabulary = KeyVocabulary()
+
+
+def get_key_vocabulary() -> KeyVocabulary:
+    """Returns the process-wide vocabulary shared by every session"""
+    return _shared_vocabulary
@@ -0,0 +1,171 @@
+# Copyright 2022, Alvin Kuruvilla <alvineasokuruvilla@gmail.com>
+
+# Use of this source code is governed by an MIT-style
+# license that can be found in the LICENSE file or at
+# https://opensource.org/licenses/MIT.
+
+from core.td_data_dict import TD_Data_Dictionary
+import numpy as np
+import pickle
+
+CTRL_C = "'\\x03'"
+
+
+class Latency_Statistics:
+    """The running count, mean and sum of squared deviations (M2) of the latencies of every key
+
+    Single samples are folded in with Welford's update and whole groups of samples with
+    Chan's parallel formula, so the statistics never need the samples they were built from.
+    Every entry holds `width` latencies, 1 for key hold times and 4 for digraph latencies.
+    """
+
+    def __init__(self, width: int = 1):
+        self.width = width
+        self.names = []
+        self.index = {}
+        self.count = np.zeros(0, dtype=np.int64)
+        self.mean = np.zeros((0, width), dtype=np.float64)
+        self.m2 = np.zeros((0, width), dtype=np.float64)
+
+    __slots__ = ("width", "names", "index", "count", "mean", "m2")
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def __contains__(self, name) -> bool:
+        return name in self.index
+
+    def keys(self) -> list:
+        """Returns the names in the order they were first added"""
+        return list(self.names)
+
+    def _slot(self, name) -> int:
+        if name in self.index:
+            return self.index[name]
+        slot = len(self.names)
+        if slot == len(self.count):
+            # Grow geometrically so that adding names stays amortized O(1)
+            capacity = max(16, 2 * slot)
+            self.count = np.resize(self.count, capacity)
+            self.mean = np.resize(self.mean, (capacity, self.width))
+            self.m2 = np.resize(self.m2, (capacity, self.width))
+            self.count[slot:] = 0
+            self.mean[slot:] = 0.0
+            self.m2[slot:] = 0.0
+        self.index[name] = slot
+        self.names.append(name)
+        return slot
+
+    def add(self, name, sample) -> None:
+        """Folds a single sample into the statistics of `name` in O(1)"""
+        slot = self._slot(name)
+        sample = np.asarray(sample, dtype=np.float64)
+        self.count[slot] += 1
+        delta = sample - self.mean[slot]
+        self.mean[slot] += delta / self.count[slot]
+        self.m2[slot] += delta * (sample - self.mean[slot])
+
+    def merge_groups(self, names, counts, means, m2) -> None:
+        """Folds the statistics of whole sample groups into the statistics of `names` at once"""
+        if len(names) == 0:
+            return
+        slots = np.array([self._slot(name) for name in names], dtype=np.int64)
+        counts = np.asarray(counts, dtype=np.int64)
+        means = np.asarray(means, dtype=np.float64).reshape(len(names), self.width)
+        m2 = np.asarray(m2, dtype=np.float64).reshape(len(names), self.width)
+        old_counts = self.count[slots]
+        total = old_counts + counts
+        delta = means - self.mean[slots]
+        weight = (counts / total)[:, None]
+        self.mean[slots] += delta * weight
+        self.m2[slots] += m2 + delta * delta * (old_counts * weight[:, 0])[:, None]
+        self.count[slots] = total
+
+    def merge(self, other) -> None:
+        """Folds another Latency_Statistics of the same width into this one"""
+        size = len(other)
+        self.merge_groups(
+            other.names, other.count[:size], other.mean[:size], other.m2[:size]
+        )
+
+    def lookup(self, names):
+        """Returns the counts, means and population variances of `names`
+
+        Names without statistics get a count of 0 and NaN means and variances
+        """
+        slots = np.array([self.index.get(name, -1) for name in names], dtype=np.int64)
+        known = slots >= 0
+        counts = np.zeros(len(slots), dtype=np.int64)
+        means = np.full((len(slots), self.width), np.nan)
+        variances = np.full((len(slots), self.width), np.nan)
+        counts[known] = self.count[slots[known]]
+        means[known] = self.mean[slots[known]]
+        variances[known] = self.m2[slots[known]] / counts[known][:, None]
+        return counts, means, variances
+
+
+class Template_Profile:
+    """A compact enrollment template holding per-key and per-digraph latency statistics
+
+    Profiles are built from one or many enrollment sessions, can be updated one sample at a time and
+    are stored with save() so verification does not need the enrollment csv files.
+    """
+
+    def __init__(self):
+        self.kht = Latency_Statistics(1)
+        self.kit = Latency_Statistics(4)
+        self.sessions = 0
+
+    __slots__ = ("kht", "kit", "sessions")
+
+    @classmethod
+    def from_sessions(cls, sessions):
+        """Builds a profile from csv paths or TD_Data_Dictionary objects"""
+        profile = cls()
+        for session in sessions:
+            profile.add_session(session)
+        return profile
+
+    def add_session(self, session) -> None:
+        if not isinstance(session, TD_Data_Dictionary):
+            session = TD_Data_Dictionary(session)
+        names = session.key_names
+        codes, counts, means, m2 = session.key_hold_times().statistics()
+        kept = [i for i, code in enumerate(codes) if names[code] != CTRL_C]
+        self.kht.merge_groups(
+            [names[codes[i]] for i in kept], counts[kept], means[kept], m2[kept]
+        )
+        kit = session.key_interval_times()
+        digraphs, counts, means, m2 = kit.statistics()
+        pairs = []
+        for digraph in digraphs:
+            first, second = kit.decode(digraph)
+            pairs.append((names[first], names[second]))
+        self.kit.merge_groups(pairs, counts, means, m2)
+        self.sessions += 1
+
+    def add_hold_time(self, key: str, hold: float) -> None:
+        self.kht.add(key, [hold])
+
+    def add_interval_time(self, pair, latencies) -> None:
+        """Adds one digraph sample, `latencies` holds its [PP, PR, RP, RR] latencies"""
+        self.kit.add(tuple(pair), latencies)
+
+    def merge(self, other) -> None:
+        self.kht.merge(other.kht)
+        self.kit.merge(other.kit)
+        self.sessions += other.sessions
+
+    def statistics(self, use_kit=False) -> Latency_Statistics:
+        if use_kit == False:
+            return self.kht
+        return self.kit
+
+    def save(self, path: str) -> None:
+        with open(path, "wb") as handle:
+            pickle.dump(self, handle, protocol=pickle.HIGHEST_PROTOCOL)
+
+    @staticmethod
+    def load(path: str):
+        with open(path, "rb") as handle:
+            return pickle.load(handle)
@@ -6,15 +6,32 @@
 
 from core.utils import (
     is_csv_file,
-    pair_subtract,
-    chunks,
     running_avg,
-    is_float,
-    unwrap_string,
+)
+from core.exceptions import MalformedCSVError
+from core.key_vocabulary import get_key_vocabulary
+from core.log import Logger
+from core.cache import Feature_Cache, cached_feature
+from core.td_events import (
+    ACTION_PRESS,
+    ACTION_RELEASE,
+    ACTION_NAMES,
+    encode_action,
+    encode_actions,
+    parse_time,
+    pair_key_holds,
+    KHT_Result,
+    extract_digraph_latencies,
+    KIT_Result,
 )
 import csv
+import hashlib
+import json
+import os
 from typing import List
 import collections
+from collections.abc import Mapping
+import numpy as np
 from prettytable import PrettyTable
 import pandas as pd
 from enum import Enum
@@ -41,108 +58,447 @@ class TD_Data_Value:
 
 
 class TD_Data_Key:
-    def __init__(self, key_name: str):
+    def __init__(self, key_name: str, index: int = -1):
         self.key_name = key_name
+        self.index = index
 
     def get_key_name(self):
         return self.key_name
 
-    __slots__ = "key_name"
+    def get_index(self):
+        return self.index
+
+    __slots__ = ("key_name", "index")
+
+
+CSV_HEADER = ["Press or Release", "Key", "Time"]
+
+
+def read_csv_header(path: str) -> List[str]:
+    """
+    Check that a capture file starts with a header of three columns.
+
+    Parameters
+    ----------
+    path: str
+          The path to the capture file.
+    Returns
+    -------
+    List[str]
+    """
+    with open(path, "r") as file:
+        header = next(csv.reader(file), None)
+    if header is None:
+        raise MalformedCSVError(path, path + " is empty")
+    if len(header) != len(CSV_HEADER):
+        raise MalformedCSVError(
+            path,
+            "%s has a header of %d columns, expected %d: %s"
+            % (path, len(header), len(CSV_HEADER), ",".join(CSV_HEADER)),
+        )
+    return header
+
+
+def read_csv_columns_bulk(path: str):
+    """
+    Parse a whole capture file into typed columns with the pandas C parser.
+
+    Parameters
+    ----------
+    path: str
+          The path to the capture file.
+    Returns
+    -------
+    The (key names, actions, times) columns, or None if the file is malformed
+    and has to go through `read_csv_columns` instead
+    """
+    try:
+        df = pd.read_csv(
+            path,
+            header=0,
+            names=CSV_HEADER,
+            dtype={CSV_HEADER[0]: str, CSV_HEADER[1]: str, CSV_HEADER[2]: np.float64},
+            na_filter=False,
+            engine="c",
+            # Parse times exactly as float() does so both ingest paths agree
+            float_precision="round_trip",
+        )
+    except (ValueError, pd.errors.ParserError):
+        return None
+    actions = encode_actions(df[CSV_HEADER[0]].to_numpy(dtype=object))
+    return (
+        df[CSV_HEADER[1]].to_numpy(dtype=object),
+        actions,
+        df[CSV_HEADER[2]].to_numpy(dtype=np.float64),
+    )
+
+
+def read_csv_columns(path: str):
+    """
+    Parse a capture file row by row, tolerating extra columns and times that are not floats.
+
+    Parameters
+    ----------
+    path: str
+          The path to the capture file.
+    Returns
+    -------
+    The (key names, actions, times) columns
+    """
+    key_names = []
+    actions = []
+    times = []
+    with open(path, "r") as file:
+        reader = csv.reader(file)
+        # Skip the header and move the reader forward to next line
+        next(reader)
+        for line in reader:
+            if len(line) == 0:
+                continue
+            if len(line) < len(CSV_HEADER):
+                raise MalformedCSVError(
+                    path,
+                    "%s line %d has %d fields, expected %d"
+                    % (path, reader.line_num, len(line), len(CSV_HEADER)),
+                )
+            key_names.append(line[1])
+            actions.append(encode_action(line[0]))
+            times.append(parse_time(line[2]))
+    return key_names, actions, times
+
+
+SIDECAR_VERSION = 1
+SIDECAR_COLUMNS = ("keys", "actions", "times")
+
+
+def sidecar_path(csv_path: str) -> str:
+    """Returns the directory holding the binary sidecar of a capture file"""
+    return csv_path + ".td"
+
+
+def hash_file(path: str) -> str:
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as file:
+        for block in iter(lambda: file.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def write_sidecar(data) -> str:
+    """
+    Write the columns of a session next to its capture file so later loads can skip parsing.
+
+    The sidecar is a directory of .npy columns plus a header.json that records the size,
+    modification time and hash of the source file. Key codes are stored relative to the key
+    names listed in the header, because vocabulary codes are only valid within one process.
+    The header is written last, so a sidecar is never read before all of its columns exist.
+
+    Parameters
+    ----------
+    data: TD_Data_Dictionary
+          The session to write, it must have been loaded from a csv file.
+    Returns
+    -------
+    str
+    """
+    directory = sidecar_path(data.path())
+    os.makedirs(directory, exist_ok=True)
+    stat = os.stat(data.path())
+    local_codes, codes = pd.factorize(data.key_codes)
+    header = {
+        "version": SIDECAR_VERSION,
+        "source_size": stat.st_size,
+        "source_mtime_ns": stat.st_mtime_ns,
+        "source_hash": hash_file(data.path()),
+        "events": len(data.time_column),
+        "key_names": data.vocabulary.decode(codes).tolist(),
+    }
+    columns = (local_codes.astype(np.int32), data.action_column, data.time_column)
+    suffix = ".%d.tmp" % os.getpid()
+    for name, column in zip(SIDECAR_COLUMNS, columns):
+        target = os.path.join(directory, name + ".npy")
+        with open(target + suffix, "wb") as file:
+            np.save(file, np.ascontiguousarray(column))
+        os.replace(target + suffix, target)
+    target = os.path.join(directory, "header.json")
+    with open(target + suffix, "w") as file:
+        json.dump(header, file)
+    os.replace(target + suffix, target)
+    return directory
+
+
+def read_sidecar(csv_path: str, verify_hash: bool = False):
+    """
+    Memory-map the sidecar of a capture file if it is still up to date.
+
+    The action and time columns are read-only memory maps of the sidecar files, so loading a warm
+    session costs a page-in and processes loading the same file share its pages. The key column is
+    translated to codes of the shared vocabulary.
+
+    Parameters
+    ----------
+    csv_path: str
+          The path to the capture file.
+    verify_hash: bool
+          Whether to also hash the source file rather than trusting its size and modification time.
+    Returns
+    -------
+    The (key codes, actions, times) columns, or None if there is no usable sidecar
+    """
+    directory = sidecar_path(csv_path)
+    try:
+        with open(os.path.join(directory, "header.json"), "r") as file:
+            header = json.load(file)
+        stat = os.stat(csv_path)
+        if (
+            header["version"] != SIDECAR_VERSION
+            or header["source_size"] != stat.st_size
+            or header["source_mtime_ns"] != stat.st_mtime_ns
+        ):
+            return None
+        if verify_hash and header["source_hash"] != hash_file(csv_path):
+            return None
+        keys, actions, times = [
+            np.load(os.path.join(directory, name + ".npy"), mmap_mode="r")
+            for name in SIDECAR_COLUMNS
+        ]
+    except (OSError, ValueError, KeyError):
+        return None
+    if not len(keys) == len(actions) == len(times) == header["events"]:
+        return None
+    table = get_key_vocabulary().encode(header["key_names"])
+    return table[keys] if len(keys) > 0 else keys, actions, times
+
+
+class TD_Data_View(Mapping):
+    """A read-only, dictionary-like view over the columns of a `TD_Data_Dictionary`
+
+    Iterating the view yields a `TD_Data_Key` per event and looking one up yields the
+    matching `TD_Data_Value`, so code written against the old dictionary of objects keeps working.
+    The objects are only created while iterating, they are never stored.
+    """
+
+    def __init__(self, td_data_dict):
+        self.td_data_dict = td_data_dict
+
+    __slots__ = "td_data_dict"
+
+    def __len__(self):
+        return len(self.td_data_dict.time_column)
+
+    def __iter__(self):
+        names = self.td_data_dict.key_names
+        for i, code in enumerate(self.td_data_dict.key_codes.tolist()):
+            yield TD_Data_Key(names[code], i)
+
+    def __getitem__(self, key):
+        index = key.get_index() if isinstance(key, TD_Data_Key) else key
+        if not isinstance(index, (int, np.integer)) or not 0 <= index < len(self):
+            raise KeyError(key)
+        action = self.td_data_dict.action_column[index]
+        time = self.td_data_dict.time_column[index]
+        return TD_Data_Value([ACTION_NAMES[action], repr(float(time))])
+
+    def items(self):
+        names = self.td_data_dict.key_names
+        codes = self.td_data_dict.key_codes.tolist()
+        actions = self.td_data_dict.action_column.tolist()
+        times = self.td_data_dict.time_column.tolist()
+        for i in range(len(codes)):
+            yield TD_Data_Key(names[codes[i]], i), TD_Data_Value(
+                [ACTION_NAMES[actions[i]], repr(times[i])]
+            )
+
+    def __eq__(self, other):
+        if not isinstance(other, TD_Data_View):
+            return NotImplemented
+        a = self.td_data_dict
+        b = other.td_data_dict
+        return (
+            a.get_all_key_names() == b.get_all_key_names()
+            and np.array_equal(a.action_column, b.action_column)
+            and np.array_equal(a.time_column, b.time_column, equal_nan=True)
+        )
+
+    __hash__ = None
 
 
 class TD_Data_Dictionary:
-    def __init__(self, csv_data_path: str) -> None:
+    """The keystroke events of a single capture file, stored column by column.
+
+    Every event is held as an integer key code, a uint8 action and a float64 time,
+    all accessors below are computed from these three arrays.
+    """
+
+    def __init__(
+        self, csv_data_path: str, bulk_ingest: bool = True, use_sidecar: bool = False
+    ) -> None:
         self.csv_data_path = csv_data_path
         is_csv_file(self.csv_data_path)
-        self.data_dict = {}
-        with open(self.csv_data_path, "r") as file:
-            reader = csv.reader(file)
-            # Skip the header and move the reader forward to next line
-            next(reader)
-            for i, line in enumerate(reader):
-                self.data_dict[TD_Data_Key(line[1])] = TD_Data_Value([line[0], line[2]])
-            #     print("line[{}] = {}".format(i, line))
-            # for k, v in self.data_dict.items():
-            #     print(k.get_key_name(), v.get_action(), v.get_time(), end=" \n")
-
-    __slots__ = ("csv_data_path", "data_dict")
+        if use_sidecar:
+            columns = read_sidecar(self.csv_data_path)
+            if columns is not None:
+                self._set_encoded_columns(*columns)
+                return
+        read_csv_header(self.csv_data_path)
+        columns = None
+        if bulk_ingest:
+            columns = read_csv_columns_bulk(self.csv_data_path)
+        if columns is None:
+            columns = read_csv_columns(self.csv_data_path)
+        self._set_columns(*columns)
+        if use_sidecar:
+            # The sidecar only speeds up later loads, a read-only or full disk must not fail this one
+            try:
+                write_sidecar(self)
+            except OSError as error:
+                Logger("TD_Data_Dictionary").km_error(
+                    "Could not write the sidecar of %s: %s" % (self.csv_data_path, error)
+                )
+
+    __slots__ = (
+        "csv_data_path",
+        "vocabulary",
+        "key_codes",
+        "action_column",
+        "time_column",
+        "_key_index",
+        "feature_cache",
+    )
+
+    @classmethod
+    def from_columns(cls, key_names, actions, times, csv_data_path=None):
+        """Build a dictionary directly from already parsed columns without touching the disk"""
+        instance = cls.__new__(cls)
+        instance.csv_data_path = csv_data_path
+        instance._set_columns(key_names, actions, times)
+        return instance
+
+    def view(self, start: int, end: int):
+        """Returns the events in [start, end) as a new dictionary whose columns are views of this one's.
+
+        Nothing is copied, the view supports every accessor of a full session."""
+        instance = self.__class__.__new__(self.__class__)
+        instance.csv_data_path = self.csv_data_path
+        instance._set_encoded_columns(
+            self.key_codes[start:end],
+            self.action_column[start:end],
+            self.time_column[start:end],
+        )
+        return instance
+
+    def _set_columns(self, key_names, actions, times):
+        self._set_encoded_columns(get_key_vocabulary().encode(key_names), actions, times)
+
+    def _set_encoded_columns(self, key_codes, actions, times):
+        # np.asarray keeps read-only memory maps as they are instead of copying them
+        self.vocabulary = get_key_vocabulary()
+        self.key_codes = np.asarray(key_codes, dtype=np.int32)
+        self.action_column = np.asarray(actions, dtype=np.uint8)
+        self.time_column = np.asarray(times, dtype=np.float64)
+        assert len(self.key_codes) == len(self.action_column) == len(self.time_column)
+        self.invalidate()
+
+    @property
+    def key_names(self):
+        """The key names of the shared vocabulary, indexed by key code"""
+        return self.vocabulary.names
+
+    def append_events(self, key_names, actions, times) -> None:
+        """Appends events to the end of the session"""
+        self.key_codes = np.concatenate((self.key_codes, self.vocabulary.encode(key_names)))
+        self.action_column = np.concatenate(
+            (self.action_column, np.asarray(actions, dtype=np.uint8))
+        )
+        self.time_column = np.concatenate(
+            (self.time_column, np.asarray(times, dtype=np.float64))
+        )
+        self.invalidate()
+
+    def invalidate(self) -> None:
+        """Drops everything derived from the columns, it is rebuilt on next use"""
+        self._key_index = None
+        self.feature_cache = Feature_Cache()
+
+    def cache_info(self):
+        """Returns the hit and miss counters of the derived feature cache"""
+        return self.feature_cache.info()
+
+    def _code_of(self, key: str) -> int:
+        """Returns the code used for `key` in this dictionary or -1 if it never occurs"""
+        return self.vocabulary.lookup(key)
+
+    def _index(self):
+        """Returns the inverted index from key code to the sorted event indices of its presses
+        and releases, building it on first use.
+
+        Each half of the index is a pair of arrays (offsets, positions), the events of key code
+        `c` are `positions[offsets[c] : offsets[c + 1]]`."""
+        if self._key_index is None:
+            self._key_index = {
+                action: self._build_index(self.action_column == action)
+                for action in (ACTION_PRESS, ACTION_RELEASE)
+            }
+        return self._key_index
+
+    def _build_index(self, mask):
+        positions = np.flatnonzero(mask)
+        codes = self.key_codes[positions]
+        positions = positions[np.argsort(codes, kind="stable")]
+        counts = np.bincount(codes, minlength=len(self.key_names))
+        offsets = np.zeros(len(self.key_names) + 1, dtype=np.int64)
+        np.cumsum(counts, out=offsets[1:])
+        return offsets, positions
+
+    def _lookup(self, key: str, action: int):
+        """Returns the sorted event indices of every `action` of `key`"""
+        code = self._code_of(key)
+        offsets, positions = self._index()[action]
+        if code == -1 or code + 1 >= len(offsets):
+            return np.empty(0, dtype=np.int64)
+        return positions[offsets[code] : offsets[code + 1]]
+
+    def get_all_key_names(self):
+        """Returns the key name of every event in file order"""
+        return self.vocabulary.decode(self.key_codes).tolist()
 
     def data(self):
-        return self.data_dict
+        return TD_Data_View(self)
 
     def times(self):
-        ret = []
-        for _, v in self.data().items():
-            if is_float(v.get_time()):
-                ret.append(v.get_time())
-        return ret
+        """Returns every event time that could be parsed as a float"""
+        return self.time_column[~np.isnan(self.time_column)]
 
     def debug(self):
         table = PrettyTable()
         table.field_names = ["Key", "Action", "Time"]
-        for k, v in self.data_dict.items():
+        for k, v in self.data().items():
             table.add_row([k.get_key_name(), v.get_action(), v.get_time()])
         print(table.get_string())
 
     def get_all_keys_pressed(self):
         """This gets every key pressed including repeats and keys that may have been pressed but not released for some reason.
         This will also remove instances of \x03 (ctrl+c)"""
-        res = []
-        for k, _ in self.data_dict.items():
-            if k.get_key_name() != "'\\x03'":
-                res.append(k.get_key_name())
-        return res
+        mask = self.key_codes != self._code_of("'\\x03'")
+        return self.vocabulary.decode(self.key_codes[mask]).tolist()
 
+    @cached_feature
     def get_unique_keys(self):
-        res = self.get_all_keys_pressed()
-        for key in res:
-            if res.count(key) % 2 != 0:
-                res.remove(key)
-        unique = []
-        for k in res:
-            if not k in unique:
-                unique.append(k)
-        return unique
+        """Returns every key with at least one completed press and release, ordered by first press"""
+        kht = self.key_hold_times()
+        ctrl_c = self._code_of("'\\x03'")
+        return [self.key_names[code] for code in kht.key_codes() if code != ctrl_c]
 
     def get_letters(self):
-        letters = [
-            "a",
-            "b",
-            "c",
-            "d",
-            "e",
-            "f",
-            "g",
-            "h",
-            "i",
-            "j",
-            "k",
-            "l",
-            "m",
-            "n",
-            "o",
-            "p",
-            "q",
-            "r",
-            "s",
-            "t",
-            "u",
-            "v",
-            "w",
-            "x",
-            "y",
-            "z",
-            "key.ctrl",
-            "key.space",
+        """Returns the normalized name of every pressed letter from a to z, Key.ctrl and Key.space"""
+        # The vocabulary normalizes and classifies every key name once, when it is first seen
+        mask = (self.action_column == ACTION_PRESS) & self.vocabulary.is_word_key()[
+            self.key_codes
         ]
-        result = []
-        for k, v in self.data_dict.items():
-            unwrapped_key = unwrap_string(k.get_key_name().lower())
-            if bool(unwrapped_key in letters) == True and v.get_action() == "P":
-                # print("Hello, world!")
-                result.append(unwrapped_key)
-        return result
+        normalized = np.asarray(self.vocabulary.normalized, dtype=object)
+        return normalized[self.key_codes[mask]].tolist()
 
+    @cached_feature
     def get_key_pairs(self):
         # NOTE: We use the get_all_keys_pressed() function because we don't want to forget about the pairs that have the same characters
         # This is because if we don't do this we forget about some key pairs
@@ -155,129 +511,114 @@ class TD_Data_Dictionary:
             pairs.append([unique[i], unique[i + 1]])
             i += 1
 
+    @cached_feature
+    def key_hold_times(self) -> KHT_Result:
+        """Pairs every press with its release in one pass over the events, see `pair_key_holds`"""
+        return pair_key_holds(self.key_codes, self.action_column, self.time_column)
+
+    @cached_feature
+    def get_key_hold_arrays(self):
+        """Returns a dictionary from key name to the array of all of its hold times"""
+        ctrl_c = self._code_of("'\\x03'")
+        return {
+            self.key_names[code]: holds
+            for code, holds in self.key_hold_times().hold_arrays().items()
+            if code != ctrl_c
+        }
+
+    @cached_feature
     def calculate_key_hold_time(self):
-        keys = self.get_unique_keys()
-        store = collections.defaultdict(list)
+        """Returns a dictionary from key name to its mean hold time, ordered by first press"""
         final = collections.defaultdict(float)
-        res = collections.defaultdict(list)
-        for key in keys:
-            for i, j in self.data_dict.items():
-                if key == i.get_key_name():
-                    store[i] = j.get_time()
-        for a, b in store.items():
-            # print(a.get_key_name(), b)
-            res[a.get_key_name()].append(b)
-            # So at this point we should have a dictionary called 'res' whose
-            # keys are the unique keys pressed and whose values are a list
-            # containing the sequential press and release times.
-            # Now all we have to do is if the values array has 2 entries we can
-            # just subtract them to find the key hit time for that key. If it
-            # has a multiple of 2 number of entries we have to split the array
-            # into groups of 2 elements, find the difference between the groups
-            # and finally average their differences together
-        for x, y in res.items():
-            if len(y) == 2:
-                # print("Index: ", x)
-                floats = [float(item) for item in y]
-                subtr = floats[1] - floats[0]
-                final[x] = subtr
-            elif len(y) % 2 == 0 and len(y) != 2:
-                subtraction_holder = []
-                multi_floats = [float(item) for item in y]
-                multi_diff = chunks(multi_floats, 2)
-                for diff in multi_diff:
-                    subtraction_holder.append(pair_subtract(diff))
-                multi_avg = running_avg(subtraction_holder)
-                final[x] = multi_avg
-            elif len(y) % 2 == 1:
-                while len(y) % 2 == 1:
-                    del y[-1]
-                subtraction_holder = []
-                multi_floats = [float(item) for item in y]
-                multi_diff = chunks(multi_floats, 2)
-                for diff in multi_diff:
-                    subtraction_holder.append(pair_subtract(diff))
-                multi_avg = running_avg(subtraction_holder)
-                final[x] = multi_avg
+        ctrl_c = self._code_of("'\\x03'")
+        for code, mean in self.key_hold_times().means().items():
+            if code != ctrl_c:
+                final[self.key_names[code]] = mean
         return final
 
-    def calculate_key_interval_time(self, nested_key_list: List[List[str]]):
+    @cached_feature
+    def key_interval_times(self) -> KIT_Result:
+        """Computes every digraph latency from the press-ordered keystrokes, see `extract_digraph_latencies`"""
+        kht = self.key_hold_times()
+        ctrl_c = self._code_of("'\\x03'")
+        if ctrl_c != -1:
+            kept = kht.codes != ctrl_c
+            kht = KHT_Result(
+                kht.codes[kept],
+                kht.press_index[kept],
+                kht.release_index[kept],
+                kht.holds[kept],
+                kht.orphan_presses,
+                kht.orphan_releases,
+                kht.repeated_presses,
+            )
+        return extract_digraph_latencies(kht, len(self.key_names), self.time_column)
+
+    @cached_feature
+    def calculate_key_interval_time(self, nested_key_list: List[List[str]] = None):
+        """Returns a dictionary from each digraph to its mean [PP, PR, RP, RR] latencies.
+
+        If a list of key pairs is given only those pairs are looked up, pairs that never occur
+        as consecutive keystrokes are left out."""
         store = {}
+        means = self.key_interval_times().means()
+        if nested_key_list is None:
+            for (first, second), latencies in means.items():
+                store[(self.key_names[first], self.key_names[second])] = latencies.tolist()
+            return store
         for key_set in nested_key_list:
-            # print("Press_Press: ", self.get_press_press_time(key_set))
-            # input("Look at the press press time")
-            store[tuple(key_set)] = [
-                self.get_press_press_time(key_set),
-                self.get_press_release_time(key_set),
-                self.get_release_press_time(key_set),
-                self.get_release_release_time(key_set),
-            ]
+            codes = (self._code_of(key_set[0]), self._code_of(key_set[1]))
+            if codes in means:
+                store[tuple(key_set)] = means[codes].tolist()
         return store
 
+    @cached_feature
     def make_kht_dictionary(self):
         # NOTE: This function will not calculate the average of multiple times.
         # Instead we will just store duplicate time entries in a list of values
         keys = self.get_unique_keys()
         res = {}
         for key in keys:
-            res[key] = self.get_all_times_for_key(key)
+            res[key] = self.get_all_times_for_key(key).tolist()
         return res
 
-    def make_kit_dictionary(self, nested_keyset: List[List[str]], kit_type: KIT_Type):
+    @cached_feature
+    def make_kit_dictionary(
+        self,
+        nested_keyset: List[List[str]] = None,
+        kit_type: KIT_Type = KIT_Type.Press_Press,
+    ):
         # NOTE: This function will not calculate the average of multiple times.
-        # Instead we will just store duplicate time entries in a list of values
-
-        # We also want to call this method for each element in the KIT_Type
-        # enum because we wamt to store all data combinations for each user
-        # FIXME: We heavily nest the value list in several sub lists, purely
-        # because some of the functions called here return lists, so we should probably change that somehow
+        # Instead we will just store every latency of the requested KIT_Type in a list of values.
+        # If no key sets are given every digraph that occurs is stored.
         res = {}
-        if kit_type == KIT_Type.Press_Press:
-            for keyset in nested_keyset:
-                res[tuple(keyset)] = self.get_press_press_times_for_keyset(keyset)
-            return res
-        elif kit_type == KIT_Type.Press_Release:
-            for keyset in nested_keyset:
-                res[tuple(keyset)] = self.get_press_release_times_for_keyset(keyset)
-            return res
-        elif kit_type == KIT_Type.Release_Press:
-            for keyset in nested_keyset:
-                res[tuple(keyset)] = self.get_release_press_times_for_keyset(keyset)
-            return res
-        elif kit_type == KIT_Type.Release_Release:
-            for keyset in nested_keyset:
-                res[tuple(keyset)] = self.get_release_release_times_for_keyset(keyset)
+        arrays = self.key_interval_times().latency_arrays(kit_type.value - 1)
+        if nested_keyset is None:
+            for (first, second), latencies in arrays.items():
+                res[(self.key_names[first], self.key_names[second])] = latencies.tolist()
             return res
+        for keyset in nested_keyset:
+            codes = (self._code_of(keyset[0]), self._code_of(keyset[1]))
+            if codes in arrays:
+                res[tuple(keyset)] = arrays[codes].tolist()
+        return res
 
     def get_all_times_for_key(self, key: str):
-        result = []
-        for k, v in self.data().items():
-            if k.get_key_name() == key:
-                result.append(float(v.get_time()))
-        return result
+        presses = self._lookup(key, ACTION_PRESS)
+        releases = self._lookup(key, ACTION_RELEASE)
+        return self.time_column[np.sort(np.concatenate((presses, releases)))]
 
     def get_press_times_for_key(self, key: str):
         # TODO: Remove this stipulation
         # NOTE: This function requires that the 'key' parameter is of the form: "'key'"
         # So for example, data_dict.get_press_times_for_key("'H'")
-        result = []
-        for k, v in self.data().items():
-            if k.get_key_name() == key and v.get_action() == "P":
-                # print("Key: " + k.get_key_name())
-                # print("Time: " + v.get_time())
-                # input("Look at the key and the time")
-                result.append(float(v.get_time()))
-        return result
+        return self.time_column[self._lookup(key, ACTION_PRESS)]
 
     def get_release_times_for_key(self, key: str):
         # TODO: Remove this stipulation
         # NOTE: This function requires that the 'key' parameter is of the form: "'key'"
         # So for example, data_dict.get_release_times_for_key("'H'")
-        result = []
-        for k, v in self.data().items():
-            if k.get_key_name() == key and v.get_action() == "R":
-                result.append(float(v.get_time()))
-        return result
+        return self.time_column[self._lookup(key, ACTION_RELEASE)]
 
     def get_press_press_times_for_keyset(self, keyset: List[str]):
         key1 = keyset[0]
@@ -349,19 +690,33 @@ class TD_Data_Dictionary:
         return self.csv_data_path
 
 
+def _session_key_codes(data: TD_Data_Dictionary):
+    # The vocabulary is shared by every session in the process, so the codes are renumbered
+    # over the keys this session actually contains
+    codes, local_codes = np.unique(data.key_codes, return_inverse=True)
+    names = data.vocabulary.names
+    return local_codes.astype(np.int32), [names[code] for code in codes]
+
+
+def _key_categorical(data: TD_Data_Dictionary):
+    codes, categories = _session_key_codes(data)
+    return pd.Categorical.from_codes(codes, categories=categories)
+
+
+def _action_categorical(data: TD_Data_Dictionary):
+    # ACTION_UNKNOWN is the only code above ACTION_RELEASE, so clipping maps it onto "?"
+    return pd.Categorical.from_codes(
+        np.minimum(data.action_column, 2), categories=["P", "R", "?"]
+    )
+
+
 def make_keys_dataframe(data: TD_Data_Dictionary):
-    keys = []
-    for k, _ in data.data().items():
-        keys.append(k.get_key_name())
-    r = {"Keys": keys}
+    r = {"Keys": _key_categorical(data)}
     return pd.DataFrame.from_dict(r)
 
 
 def make_actions_dataframe(data: TD_Data_Dictionary):
-    actions = []
-    for _, v in data.data().items():
-        actions.append(v.get_action())
-    r = {"Actions": actions}
+    r = {"Actions": _action_categorical(data)}
     return pd.DataFrame.from_dict(r)
 
 
@@ -372,8 +727,34 @@ def make_times_dataframe(data: TD_Data_Dictionary):
 
 
 def make_dataframe(data: TD_Data_Dictionary):
-    keys_df = make_keys_dataframe(data)
-    times_df = make_times_dataframe(data)
-    action_df = make_actions_dataframe(data)
-    df = pd.concat([action_df, keys_df, times_df], axis=1)
-    return df
+    """Wraps the columns of a session in a DataFrame with one row per event.
+
+    Actions and Keys are categoricals over the action names and the keys of the session, and Times is
+    the float64 time column as is, so unparsable times stay aligned as NaN."""
+    return pd.DataFrame(
+        {
+            "Actions": _action_categorical(data),
+            "Keys": _key_categorical(data),
+            "Times": data.time_column,
+        },
+        copy=False,
+    )
+
+
+def make_arrow_table(data: TD_Data_Dictionary):
+    """Exports the columns of a session as a pyarrow Table with dictionary encoded Actions and Keys.
+
+    pyarrow is an optional dependency and is only imported when this is called."""
+    try:
+        import pyarrow as pa
+    except ImportError:
+        raise ImportError("make_arrow_table requires pyarrow, install it with pip")
+    actions = pa.DictionaryArray.from_arrays(
+        pa.array(np.minimum(data.action_column, 2)), pa.array(["P", "R", "?"])
+    )
+    codes, names = _session_key_codes(data)
+    keys = pa.DictionaryArray.from_arrays(
+        pa.array(codes), pa.array(names, type=pa.string())
+    )
+    times = pa.array(np.ascontiguousarray(data.time_column), from_pandas=False)
+    return pa.table({"Actions": actions, "Keys": keys, "Times": times})
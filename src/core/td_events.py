@@ -0,0 +1,286 @@
+# Copyright 2022, Alvin Kuruvilla <alvineasokuruvilla@gmail.com>
+
+# Use of this source code is governed by an MIT-style
+# license that can be found in the LICENSE file or at
+# https://opensource.org/licenses/MIT.
+
+# Primitives that operate directly on the typed event columns of a session
+# (key codes, actions and times), independent of where the columns came from
+import numpy as np
+
+# The action column stores one byte per event instead of the raw "P"/"R" strings
+ACTION_PRESS = 0
+ACTION_RELEASE = 1
+ACTION_UNKNOWN = 255
+ACTION_NAMES = {ACTION_PRESS: "P", ACTION_RELEASE: "R", ACTION_UNKNOWN: "?"}
+ACTION_CODES = {"P": ACTION_PRESS, "R": ACTION_RELEASE}
+
+
+def encode_action(action: str) -> int:
+    return ACTION_CODES.get(action, ACTION_UNKNOWN)
+
+
+def encode_actions(actions) -> np.ndarray:
+    """Vectorized `encode_action` over an array of action strings"""
+    actions = np.asarray(actions, dtype=object)
+    encoded = np.full(len(actions), ACTION_UNKNOWN, dtype=np.uint8)
+    for name, code in ACTION_CODES.items():
+        encoded[actions == name] = code
+    return encoded
+
+
+def parse_time(value: str) -> float:
+    """Parse a time cell, mapping anything that is not a float to NaN"""
+    try:
+        return float(value)
+    except ValueError:
+        return np.nan
+
+
+class KHT_Result:
+    """The key holds found in a stream of events
+
+    The arrays `codes`, `press_index`, `release_index` and `holds` are aligned, one entry per
+    completed press/release pair. They are grouped by key code and in event order within a key.
+    The indices are positions in the event columns the result was computed from.
+
+    Attributes:
+        orphan_presses -- indices of presses that were never released
+        orphan_releases -- indices of releases that had no open press for their key
+        repeated_presses -- indices of presses that arrived while the key was already held down
+    """
+
+    def __init__(
+        self,
+        codes,
+        press_index,
+        release_index,
+        holds,
+        orphan_presses,
+        orphan_releases,
+        repeated_presses,
+    ):
+        self.codes = codes
+        self.press_index = press_index
+        self.release_index = release_index
+        self.holds = holds
+        self.orphan_presses = orphan_presses
+        self.orphan_releases = orphan_releases
+        self.repeated_presses = repeated_presses
+
+    __slots__ = (
+        "codes",
+        "press_index",
+        "release_index",
+        "holds",
+        "orphan_presses",
+        "orphan_releases",
+        "repeated_presses",
+    )
+
+    def _groups(self):
+        """Returns the distinct key codes and their [start, end) bounds in the hold arrays"""
+        if len(self.codes) == 0:
+            empty = np.empty(0, dtype=np.int64)
+            return empty, empty, empty
+        starts = np.flatnonzero(np.r_[True, self.codes[1:] != self.codes[:-1]])
+        ends = np.r_[starts[1:], len(self.codes)]
+        return self.codes[starts], starts, ends
+
+    def key_codes(self):
+        """Returns the codes of every key with at least one hold, ordered by their first press"""
+        codes, starts, _ = self._groups()
+        return codes[np.argsort(self.press_index[starts], kind="stable")]
+
+    def hold_arrays(self):
+        """Returns a dictionary from key code to the array of its hold times"""
+        codes, starts, ends = self._groups()
+        return {
+            int(code): self.holds[start:end]
+            for code, start, end in zip(codes, starts, ends)
+        }
+
+    def means(self):
+        """Returns a dictionary from key code to its mean hold time, ordered by first press"""
+        codes, starts, ends = self._groups()
+        if len(codes) == 0:
+            return {}
+        sums = np.add.reduceat(self.holds, starts)
+        averages = sums / (ends - starts)
+        order = np.argsort(self.press_index[starts], kind="stable")
+        return {int(codes[i]): float(averages[i]) for i in order}
+
+    def statistics(self):
+        """Returns the codes, sample counts, means and sums of squared deviations (M2) of every key, ordered by first press"""
+        codes, starts, ends = self._groups()
+        if len(codes) == 0:
+            empty = np.empty(0, dtype=np.float64)
+            return codes, codes, empty, empty
+        counts = ends - starts
+        means = np.add.reduceat(self.holds, starts) / counts
+        deviations = self.holds - np.repeat(means, counts)
+        m2 = np.add.reduceat(deviations * deviations, starts)
+        order = np.argsort(self.press_index[starts], kind="stable")
+        return codes[order], counts[order], means[order], m2[order]
+
+
+def pair_key_holds(key_codes, actions, times) -> KHT_Result:
+    """
+    Pair every press with the release that ends it, for all keys at once.
+
+    This is the vectorized form of a per-key open-press state machine run in a single pass:
+    a press opens its key, a release closes it and records the hold time. Presses of different
+    keys may overlap freely (rollover) because every key has its own state. A press that
+    arrives while its key is already open is an auto-repeat, so the hold is measured from the
+    first press. A release without an open press and a press that is never released are
+    reported rather than paired. Events with an unknown action or an unparsable time are skipped.
+
+    Parameters
+    ----------
+    key_codes: numpy.ndarray
+          The integer key code of every event.
+    actions: numpy.ndarray
+          The action (ACTION_PRESS or ACTION_RELEASE) of every event.
+    times: numpy.ndarray
+          The time of every event.
+    Returns
+    -------
+    KHT_Result
+    """
+    key_codes = np.asarray(key_codes)
+    actions = np.asarray(actions)
+    times = np.asarray(times, dtype=np.float64)
+    usable = np.flatnonzero(
+        ((actions == ACTION_PRESS) | (actions == ACTION_RELEASE)) & ~np.isnan(times)
+    )
+    # Group the events by key, keeping their original order within a key
+    order = usable[np.argsort(key_codes[usable], kind="stable")]
+    codes = key_codes[order]
+    is_press = actions[order] == ACTION_PRESS
+    same_key = np.r_[False, codes[1:] == codes[:-1]]
+    # The key was open before this event iff the previous event of the same key was a press
+    was_open = np.r_[False, is_press[:-1]] & same_key
+
+    opening = is_press & ~was_open
+    closing = ~is_press & was_open
+    positions = np.arange(len(order))
+    # Every closing release belongs to the press that opened its run of presses
+    last_opening = np.maximum.accumulate(np.where(opening, positions, -1))
+    opened_by = last_opening[closing]
+    unreleased = opening.copy()
+    unreleased[opened_by] = False
+
+    press_index = order[opened_by]
+    release_index = order[closing]
+    return KHT_Result(
+        codes[closing],
+        press_index,
+        release_index,
+        times[release_index] - times[press_index],
+        order[unreleased],
+        order[~is_press & ~was_open],
+        order[is_press & was_open],
+    )
+
+
+class KIT_Result:
+    """The key interval times of every consecutive pair of keystrokes (digraph)
+
+    `digraphs` holds the digraph code of every sample, sorted so that samples of the same digraph
+    are contiguous, and `pp`, `pr`, `rp` and `rr` hold the Press_Press, Press_Release,
+    Release_Press and Release_Release latencies aligned with it. A digraph code is
+    `first_key_code * n_codes + second_key_code`.
+    """
+
+    def __init__(self, digraphs, pp, pr, rp, rr, n_codes: int):
+        self.digraphs = digraphs
+        self.pp = pp
+        self.pr = pr
+        self.rp = rp
+        self.rr = rr
+        self.n_codes = n_codes
+
+    __slots__ = ("digraphs", "pp", "pr", "rp", "rr", "n_codes")
+
+    def latencies(self):
+        """Returns the four latency arrays stacked as a (samples, 4) array in KIT_Type order"""
+        return np.column_stack((self.pp, self.pr, self.rp, self.rr))
+
+    def _groups(self):
+        if len(self.digraphs) == 0:
+            empty = np.empty(0, dtype=np.int64)
+            return empty, empty, empty
+        starts = np.flatnonzero(np.r_[True, self.digraphs[1:] != self.digraphs[:-1]])
+        ends = np.r_[starts[1:], len(self.digraphs)]
+        return self.digraphs[starts], starts, ends
+
+    def decode(self, digraph: int):
+        """Returns the (first, second) key codes of a digraph code"""
+        return divmod(int(digraph), self.n_codes)
+
+    def latency_arrays(self, column: int):
+        """Returns a dictionary from (first, second) key codes to the latencies in `column`"""
+        stacked = self.latencies()
+        codes, starts, ends = self._groups()
+        return {
+            self.decode(code): stacked[start:end, column]
+            for code, start, end in zip(codes, starts, ends)
+        }
+
+    def means(self):
+        """Returns a dictionary from (first, second) key codes to the mean of the four latencies"""
+        codes, starts, ends = self._groups()
+        if len(codes) == 0:
+            return {}
+        sums = np.add.reduceat(self.latencies(), starts, axis=0)
+        averages = sums / (ends - starts)[:, None]
+        return {self.decode(code): averages[i] for i, code in enumerate(codes)}
+
+    def statistics(self):
+        """Returns the digraph codes, sample counts and (n, 4) means and sums of squared deviations (M2)"""
+        codes, starts, ends = self._groups()
+        if len(codes) == 0:
+            empty = np.empty((0, 4), dtype=np.float64)
+            return codes, codes, empty, empty
+        stacked = self.latencies()
+        counts = ends - starts
+        means = np.add.reduceat(stacked, starts, axis=0) / counts[:, None]
+        deviations = stacked - np.repeat(means, counts, axis=0)
+        m2 = np.add.reduceat(deviations * deviations, starts, axis=0)
+        return codes, counts, means, m2
+
+
+def extract_digraph_latencies(kht: KHT_Result, n_codes: int, times) -> KIT_Result:
+    """
+    Compute all four key interval times for every consecutive pair of keystrokes in one pass.
+
+    The keystrokes are the completed holds of `kht` ordered by their press, so for consecutive
+    keystrokes (p1, r1) and (p2, r2) the latencies are PP = p2 - p1, PR = r2 - p1,
+    RP = p2 - r1 and RR = r2 - r1.
+
+    Parameters
+    ----------
+    kht: KHT_Result
+          The paired holds of the session.
+    n_codes: int
+          An upper bound on the key codes, used to build the digraph codes.
+    times: numpy.ndarray
+          The time column the holds were computed from.
+    Returns
+    -------
+    KIT_Result
+    """
+    times = np.asarray(times, dtype=np.float64)
+    order = np.argsort(kht.press_index, kind="stable")
+    codes = kht.codes[order].astype(np.int64)
+    presses = times[kht.press_index[order]]
+    releases = times[kht.release_index[order]]
+    digraphs = codes[:-1] * n_codes + codes[1:]
+    pp = presses[1:] - presses[:-1]
+    pr = releases[1:] - presses[:-1]
+    rp = presses[1:] - releases[:-1]
+    rr = releases[1:] - releases[:-1]
+    grouped = np.argsort(digraphs, kind="stable")
+    return KIT_Result(
+        digraphs[grouped], pp[grouped], pr[grouped], rp[grouped], rr[grouped], n_codes
+    )
@@ -0,0 +1,331 @@
+# Copyright 2022, Alvin Kuruvilla <alvineasokuruvilla@gmail.com>
+
+# Use of this source code is governed by an MIT-style
+# license that can be found in the LICENSE file or at
+# https://opensource.org/licenses/MIT.
+
+# Bounded-memory feature extraction for capture files that are too large to load at once.
+# The file is read in fixed-size chunks and the accumulators below carry whatever state crosses
+# a chunk boundary, so KHT and KIT values match TD_Data_Dictionary for a file of any size.
+import collections
+import csv
+import numpy as np
+import pandas as pd
+from core.exceptions import MalformedCSVError
+from core.td_data_dict import (
+    CSV_HEADER,
+    TD_Data_Dictionary,
+    read_csv_header,
+)
+from core.key_vocabulary import get_key_vocabulary
+from core.td_events import (
+    ACTION_PRESS,
+    encode_action,
+    encode_actions,
+    pair_key_holds,
+    parse_time,
+)
+
+CTRL_C = "'\\x03'"
+
+
+def iter_event_chunks(path: str, chunk_size: int = 1000000, bulk_ingest: bool = True):
+    """
+    Lazily read a capture file as consecutive `TD_Data_Dictionary` chunks of at most `chunk_size` events.
+
+    Parameters
+    ----------
+    path: str
+          The path to the capture file.
+    chunk_size: int
+          The maximum number of events per chunk.
+    bulk_ingest: bool
+          Whether to parse with the pandas C parser. The row reader tolerates malformed rows.
+    Returns
+    -------
+    Generator[TD_Data_Dictionary]
+    """
+    read_csv_header(path)
+    if bulk_ingest:
+        reader = pd.read_csv(
+            path,
+            header=0,
+            names=CSV_HEADER,
+            dtype={CSV_HEADER[0]: str, CSV_HEADER[1]: str, CSV_HEADER[2]: np.float64},
+            na_filter=False,
+            engine="c",
+            float_precision="round_trip",
+            chunksize=chunk_size,
+        )
+        try:
+            for df in reader:
+                yield TD_Data_Dictionary.from_columns(
+                    df[CSV_HEADER[1]].to_numpy(dtype=object),
+                    encode_actions(df[CSV_HEADER[0]].to_numpy(dtype=object)),
+                    df[CSV_HEADER[2]].to_numpy(dtype=np.float64),
+                    path,
+                )
+        except (ValueError, pd.errors.ParserError) as e:
+            raise MalformedCSVError(
+                path, "%s could not be parsed in bulk, use bulk_ingest=False: %s" % (path, e)
+            )
+        return
+    key_names, actions, times = [], [], []
+    with open(path, "r") as file:
+        reader = csv.reader(file)
+        next(reader)
+        for line in reader:
+            if len(line) == 0:
+                continue
+            if len(line) < len(CSV_HEADER):
+                raise MalformedCSVError(
+                    path,
+                    "%s line %d has %d fields, expected %d"
+                    % (path, reader.line_num, len(line), len(CSV_HEADER)),
+                )
+            key_names.append(line[1])
+            actions.append(encode_action(line[0]))
+            times.append(parse_time(line[2]))
+            if len(times) == chunk_size:
+                yield TD_Data_Dictionary.from_columns(key_names, actions, times, path)
+                key_names, actions, times = [], [], []
+    if len(times) > 0:
+        yield TD_Data_Dictionary.from_columns(key_names, actions, times, path)
+
+
+class Keystrokes:
+    """Completed keystrokes, as aligned arrays of key names, global press indices and press and release times"""
+
+    def __init__(self, key_names, press_index, press_times, release_times):
+        self.key_names = key_names
+        self.press_index = press_index
+        self.press_times = press_times
+        self.release_times = release_times
+
+    __slots__ = ("key_names", "press_index", "press_times", "release_times")
+
+    def __len__(self):
+        return len(self.press_index)
+
+
+class KHT_Accumulator:
+    """Accumulates key hold times over consecutive chunks of one event stream
+
+    Presses that are still open at the end of a chunk are carried into the next one, so a hold
+    split across a chunk boundary is paired exactly as `pair_key_holds` pairs it in a whole file.
+    Memory is bounded by the number of distinct keys. Accumulators of independent streams can be
+    combined with `merge`.
+    """
+
+    def __init__(self):
+        self.vocabulary = get_key_vocabulary()
+        self.sums = np.zeros(0)
+        self.counts = np.zeros(0, dtype=np.int64)
+        self.open_codes = np.zeros(0, dtype=np.int64)
+        self.open_times = np.zeros(0)
+        self.open_index = np.zeros(0, dtype=np.int64)
+        self.events_seen = 0
+        self.orphan_releases = 0
+        self.repeated_presses = 0
+
+    def _grow(self):
+        missing = len(self.vocabulary) - len(self.sums)
+        if missing > 0:
+            self.sums = np.concatenate((self.sums, np.zeros(missing)))
+            self.counts = np.concatenate((self.counts, np.zeros(missing, dtype=np.int64)))
+
+    def update(self, chunk: TD_Data_Dictionary) -> Keystrokes:
+        """Consumes the next chunk of the stream and returns the keystrokes it completed"""
+        self._grow()
+        carried = len(self.open_codes)
+        count = len(chunk.time_column)
+        codes = np.concatenate((self.open_codes, chunk.key_codes))
+        actions = np.concatenate(
+            (np.full(carried, ACTION_PRESS, dtype=np.uint8), chunk.action_column)
+        )
+        times = np.concatenate((self.open_times, chunk.time_column))
+        index = np.concatenate(
+            (self.open_index, self.events_seen + np.arange(count, dtype=np.int64))
+        )
+        kht = pair_key_holds(codes, actions, times)
+        self.sums += np.bincount(kht.codes, weights=kht.holds, minlength=len(self.sums))
+        self.counts += np.bincount(kht.codes, minlength=len(self.counts))
+        self.orphan_releases += len(kht.orphan_releases)
+        self.repeated_presses += len(kht.repeated_presses)
+        self.open_codes = codes[kht.orphan_presses]
+        self.open_times = times[kht.orphan_presses]
+        self.open_index = index[kht.orphan_presses]
+        self.events_seen += count
+        return Keystrokes(
+            self.vocabulary.decode(kht.codes),
+            index[kht.press_index],
+            times[kht.press_index],
+            times[kht.release_index],
+        )
+
+    def oldest_open_press(self) -> int:
+        """Returns the global event index of the oldest unreleased press, or -1 if none is open"""
+        if len(self.open_index) == 0:
+            return -1
+        return int(self.open_index.min())
+
+    def merge(self, other) -> None:
+        """Adds the hold sums and counts of an accumulator over an independent stream.
+
+        The other accumulator may come from another process, so its codes are translated through
+        the key names of its own vocabulary."""
+        translate = self.vocabulary.encode(other.vocabulary.names[: len(other.sums)])
+        self._grow()
+        np.add.at(self.sums, translate, other.sums)
+        np.add.at(self.counts, translate, other.counts)
+        self.orphan_releases += other.orphan_releases
+        self.repeated_presses += other.repeated_presses
+
+    def orphan_presses(self) -> int:
+        """Returns the number of presses that have not been released so far"""
+        return len(self.open_codes)
+
+    def result(self):
+        """Returns a dictionary from key name to mean hold time, like `calculate_key_hold_time`"""
+        final = collections.defaultdict(float)
+        for code in np.flatnonzero(self.counts):
+            name = self.vocabulary.name(code)
+            if name != CTRL_C:
+                final[name] = float(self.sums[code] / self.counts[code])
+        return final
+
+
+class KIT_Accumulator:
+    """Accumulates the four key interval times of every digraph over consecutive chunks
+
+    Keystrokes are ordered by press, so a completed keystroke is held back while an earlier press
+    of another key is still open. At most `max_pending` keystrokes are held back, past that they are
+    all emitted and a press that was still open is treated as never released: its keystroke is
+    dropped when it completes later, and counted in `orphaned`.
+    """
+
+    def __init__(self, max_pending: int = 100000):
+        self.max_pending = max_pending
+        self.pending = []
+        self.last = None
+        # The highest press index emitted so far, keystrokes pressed before it can no longer be placed
+        self.emitted = -1
+        self.orphaned = 0
+        self.sums = {}
+        self.counts = collections.Counter()
+
+    def update(self, keystrokes: Keystrokes, oldest_open_press: int = -1) -> None:
+        """Consumes the keystrokes completed by a chunk, `oldest_open_press` is the global index
+        of the earliest press still waiting for its release"""
+        keep = keystrokes.key_names != CTRL_C
+        self.pending.append(
+            (
+                keystrokes.press_index[keep],
+                keystrokes.key_names[keep],
+                keystrokes.press_times[keep],
+                keystrokes.release_times[keep],
+            )
+        )
+        index, names, presses, releases = [
+            np.concatenate(column) for column in zip(*self.pending)
+        ]
+        order = np.argsort(index, kind="stable")
+        late = index[order] < self.emitted
+        self.orphaned += int(np.count_nonzero(late))
+        order = order[~late]
+        index, names, presses, releases = (
+            index[order],
+            names[order],
+            presses[order],
+            releases[order],
+        )
+        if oldest_open_press == -1 or len(index) > self.max_pending:
+            ready = len(index)
+        else:
+            ready = int(np.searchsorted(index, oldest_open_press))
+        self._emit(names[:ready], presses[:ready], releases[:ready])
+        if ready:
+            self.emitted = int(index[ready - 1])
+        self.pending = [
+            (index[ready:], names[ready:], presses[ready:], releases[ready:])
+        ]
+
+    def finalize(self) -> None:
+        """Flushes the held back keystrokes once the stream has ended"""
+        self.update(
+            Keystrokes(
+                np.zeros(0, dtype=object),
+                np.zeros(0, dtype=np.int64),
+                np.zeros(0),
+                np.zeros(0),
+            )
+        )
+
+    def _emit(self, names, presses, releases):
+        if len(names) == 0:
+            return
+        if self.last is not None:
+            names = np.r_[np.array([self.last[0]], dtype=object), names]
+            presses = np.r_[self.last[1], presses]
+            releases = np.r_[self.last[2], releases]
+        self.last = (names[-1], presses[-1], releases[-1])
+        latencies = np.column_stack(
+            (
+                presses[1:] - presses[:-1],
+                releases[1:] - presses[:-1],
+                presses[1:] - releases[:-1],
+                releases[1:] - releases[:-1],
+            )
+        )
+        for i, digraph in enumerate(zip(names[:-1], names[1:])):
+            if digraph not in self.sums:
+                self.sums[digraph] = np.zeros(4)
+            self.sums[digraph] += latencies[i]
+            self.counts[digraph] += 1
+
+    def merge(self, other) -> None:
+        """Adds the latency sums and counts of an accumulator over an independent stream"""
+        for digraph, sums in other.sums.items():
+            if digraph not in self.sums:
+                self.sums[digraph] = np.zeros(4)
+            self.sums[digraph] += sums
+        self.counts.update(other.counts)
+
+    def result(self):
+        """Returns a dictionary from digraph to mean [PP, PR, RP, RR], like `calculate_key_interval_time`"""
+        return {
+            digraph: (sums / self.counts[digraph]).tolist()
+            for digraph, sums in self.sums.items()
+        }
+
+
+def stream_features(
+    path: str,
+    chunk_size: int = 1000000,
+    bulk_ingest: bool = True,
+    max_pending: int = 100000,
+):
+    """
+    Compute the KHT and KIT accumulators of a capture file in constant memory.
+
+    Parameters
+    ----------
+    path: str
+          The path to the capture file.
+    chunk_size: int
+          The maximum number of events held in memory at once.
+    bulk_ingest: bool
+          Whether to parse with the pandas C parser.
+    max_pending: int
+          The maximum number of keystrokes held back behind an open press, see KIT_Accumulator.
+    Returns
+    -------
+    Tuple[KHT_Accumulator, KIT_Accumulator]
+    """
+    kht = KHT_Accumulator()
+    kit = KIT_Accumulator(max_pending)
+    for chunk in iter_event_chunks(path, chunk_size, bulk_ingest):
+        keystrokes = kht.update(chunk)
+        kit.update(keystrokes, kht.oldest_open_press())
+    kit.finalize()
+    return kht, kit
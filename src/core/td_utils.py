@@ -4,30 +4,127 @@
 # license that can be found in the LICENSE file or at
 # https://opensource.org/licenses/MIT.
 
-from converters.pickle_driver import PickleDriver
+from converters.feature_store import get_feature_store
 from core.td_data_dict import TD_Data_Dictionary
+from core.key_vocabulary import get_key_vocabulary
+from core.td_events import ACTION_PRESS
+import numpy as np
 import pandas as pd
 from typing import List
 from rich.traceback import install
 import itertools
-import copy
 
 install()
 
-#! I think this is the origin of the bad performance as a whole. We need to figure out a way to improve this function and the calculate_key_hold_time since that is the function be called inside of it
-#! Perhaps we can look into caching the result of calculate_key_hold_time
-def find_matching_keys(template_file_path: str, verification_file_path: str) -> list:
-    matches = []
-    template_dict = TD_Data_Dictionary(template_file_path)
-    verification_dict = TD_Data_Dictionary(verification_file_path)
-    template_data = template_dict.calculate_key_hold_time()
-    verification_data = verification_dict.calculate_key_hold_time()
-    template_keys = template_data.keys()
-    verification_keys = verification_data.keys()
-    for key in template_keys:
-        if key in verification_keys:
-            matches.append(key)
-    return matches
+
+def load_td_data_dict(source) -> TD_Data_Dictionary:
+    """Returns `source` if it is already a TD_Data_Dictionary, otherwise loads the csv file it points to"""
+    if isinstance(source, TD_Data_Dictionary):
+        return source
+    return TD_Data_Dictionary(source)
+
+
+class ComparisonContext:
+    """A template and verification session loaded once and compared many times
+
+    The matched key and digraph lists are computed on first use and then reused, so the
+    functions below and the verifiers can be called in per-key loops without re-parsing either file.
+    Both sessions can be given as csv paths or as already loaded TD_Data_Dictionary objects.
+    """
+
+    def __init__(self, template, verification):
+        self.template_dict = load_td_data_dict(template)
+        self.verification_dict = load_td_data_dict(verification)
+        self._matching_keys = None
+        self._matching_interval_keys = None
+        self._latency_vectors = {}
+
+    def template_path(self):
+        return self.template_dict.path()
+
+    def verification_path(self):
+        return self.verification_dict.path()
+
+    def matching_keys(self) -> list:
+        """Returns the keys with a KHT value in both sessions, in template order"""
+        if self._matching_keys is None:
+            template_data = self.template_dict.calculate_key_hold_time()
+            verification_data = self.verification_dict.calculate_key_hold_time()
+            self._matching_keys = [
+                key for key in template_data.keys() if key in verification_data
+            ]
+        return self._matching_keys
+
+    def matching_interval_keys(self) -> list:
+        """Returns the key pairs with a KIT value in both sessions, in template order"""
+        if self._matching_interval_keys is None:
+            template_data = self.template_dict.calculate_key_interval_time(
+                self.template_dict.get_key_pairs()
+            )
+            verification_data = self.verification_dict.calculate_key_interval_time(
+                self.verification_dict.get_key_pairs()
+            )
+            self._matching_interval_keys = [
+                key for key in template_data.keys() if key in verification_data
+            ]
+        return self._matching_interval_keys
+
+    def latency_vectors(self, use_kit=False):
+        """Returns the matched keys with their template and verification latencies as aligned arrays
+
+        Parameters
+        ----------
+        use_kit: bool
+            When False the keys are the matching KHT keys and both arrays have shape (n,).
+            When True the keys are the matching digraphs and both arrays have shape (n, 4),
+            one column per KIT type (PP, PR, RP, RR).
+
+        Returns
+        -------
+        tuple
+            (keys, template_latencies, verification_latencies), where row i of both arrays
+            belongs to keys[i]
+        """
+        if use_kit not in self._latency_vectors:
+            if use_kit:
+                keys = self.matching_interval_keys()
+                template_data = self.template_dict.calculate_key_interval_time(
+                    self.template_dict.get_key_pairs()
+                )
+                verification_data = self.verification_dict.calculate_key_interval_time(
+                    self.verification_dict.get_key_pairs()
+                )
+                shape = (len(keys), 4)
+            else:
+                keys = self.matching_keys()
+                template_data = self.template_dict.calculate_key_hold_time()
+                verification_data = self.verification_dict.calculate_key_hold_time()
+                shape = (len(keys),)
+            template_latencies = np.array(
+                [template_data[key] for key in keys], dtype=np.float64
+            ).reshape(shape)
+            verification_latencies = np.array(
+                [verification_data[key] for key in keys], dtype=np.float64
+            ).reshape(shape)
+            self._latency_vectors[use_kit] = (
+                keys,
+                template_latencies,
+                verification_latencies,
+            )
+        return self._latency_vectors[use_kit]
+
+
+def as_comparison_context(template, verification=None) -> ComparisonContext:
+    """Returns `template` if it already is a ComparisonContext, otherwise builds one from both arguments"""
+    if isinstance(template, ComparisonContext):
+        return template
+    return ComparisonContext(template, verification)
+
+
+def find_matching_keys(template_file_path, verification_file_path=None) -> list:
+    """The arguments are either two csv paths (or TD_Data_Dictionary objects) or a single ComparisonContext"""
+    context = as_comparison_context(template_file_path, verification_file_path)
+    return list(context.matching_keys())
 
 
 def is_between(comp, start, end):
@@ -38,23 +135,11 @@ def is_between(comp, start, end):
 
 
 def find_matching_interval_keys(
-    template_file_path: str, verification_file_path: str
+    template_file_path, verification_file_path=None
 ) -> list:
-    matches = []
-    template_dict = TD_Data_Dictionary(template_file_path)
-    verification_dict = TD_Data_Dictionary(verification_file_path)
-    template_pairs = template_dict.get_key_pairs()
-    verification_pairs = verification_dict.get_key_pairs()
-    template_data = template_dict.calculate_key_interval_time(template_pairs)
-    verification_data = verification_dict.calculate_key_interval_time(
-        verification_pairs
-    )
-    template_keys = template_data.keys()
-    verification_keys = verification_data.keys()
-    for key in template_keys:
-        if key in verification_keys:
-            matches.append(key)
-    return matches
+    """The arguments are either two csv paths (or TD_Data_Dictionary objects) or a single ComparisonContext"""
+    context = as_comparison_context(template_file_path, verification_file_path)
+    return list(context.matching_interval_keys())
 
 
 def dataframe_from_list(data: list, column_name: List[str]):
@@ -72,14 +157,106 @@ def compress_interval(intervals_list: List[List[str]]):
     return compress
 
 
-def count_key_matches(template_file_path: str, verification_file_path: str) -> int:
-    return len(find_matching_keys(template_file_path, verification_file_path))
+def count_key_matches(template_file_path, verification_file_path=None) -> int:
+    context = as_comparison_context(template_file_path, verification_file_path)
+    return len(context.matching_keys())
+
+
+def count_interval_key_matches(template_file_path, verification_file_path=None) -> int:
+    context = as_comparison_context(template_file_path, verification_file_path)
+    return len(context.matching_interval_keys())
+
+
+class KeyOverlapIndex:
+    """The key and digraph sets of a whole corpus of sessions, stored as packed bitmaps
+
+    Every session is reduced to one bit per key of the shared vocabulary (set if the key has a
+    KHT value, as in `find_matching_keys`) and one bit per digraph seen in the corpus (set if the
+    digraph has a KIT value, as in `find_matching_interval_keys`). The overlap counts between any
+    two groups of sessions are then one matrix product, which is enough to pre-filter candidate
+    pairs before running a verifier over them.
+    """
+
+    def __init__(self):
+        self.vocabulary = get_key_vocabulary()
+        self.digraph_ids = {}
+        self.names = []
+        self.key_bitmaps = []
+        self.digraph_bitmaps = []
+
+    def __len__(self):
+        return len(self.names)
+
+    def add(self, session, name=None) -> int:
+        """Adds a session (csv path or TD_Data_Dictionary) and returns its row in the index"""
+        session = load_td_data_dict(session)
+        keys = [self.vocabulary.code(key) for key in session.calculate_key_hold_time()]
+        digraphs = [
+            self.digraph_ids.setdefault(
+                (self.vocabulary.code(first), self.vocabulary.code(second)),
+                len(self.digraph_ids),
+            )
+            for first, second in session.calculate_key_interval_time(
+                session.get_key_pairs()
+            )
+        ]
+        self.key_bitmaps.append(_pack(keys))
+        self.digraph_bitmaps.append(_pack(digraphs))
+        self.names.append(session.path() if name is None else name)
+        return len(self.names) - 1
+
+    def add_all(self, sessions) -> List[int]:
+        return [self.add(session) for session in sessions]
+
+    def bitmap_matrix(self, rows=None, use_kit=False) -> np.ndarray:
+        """Returns the packed bitmaps of `rows` (all sessions by default) as one uint8 matrix"""
+        bitmaps = self.digraph_bitmaps if use_kit else self.key_bitmaps
+        rows = range(len(self.names)) if rows is None else rows
+        width = max((len(bitmaps[row]) for row in rows), default=0)
+        matrix = np.zeros((len(rows), width), dtype=np.uint8)
+        for i, row in enumerate(rows):
+            matrix[i, : len(bitmaps[row])] = bitmaps[row]
+        return matrix
+
+    def overlap_counts(self, rows=None, columns=None, use_kit=False) -> np.ndarray:
+        """
+        Count the matching keys (or digraphs) between every pair of sessions.
+
+        Parameters
+        ----------
+        rows: List[int]
+              The template sessions, all sessions by default.
+        columns: List[int]
+              The probe sessions, all sessions by default.
+        use_kit: bool
+              Whether to count digraphs instead of keys.
+        Returns
+        -------
+        numpy.ndarray of shape (len(rows), len(columns))
+        """
+        rows = range(len(self.names)) if rows is None else rows
+        columns = range(len(self.names)) if columns is None else columns
+        left = self.bitmap_matrix(rows, use_kit)
+        right = self.bitmap_matrix(columns, use_kit)
+        width = max(left.shape[1], right.shape[1])
+        left = np.unpackbits(left, axis=1, count=width * 8).astype(np.float32)
+        right = np.unpackbits(right, axis=1, count=width * 8).astype(np.float32)
+        # float32 counts are exact well beyond any vocabulary size
+        return (left @ right.T).astype(np.int64)
+
+    def candidate_pairs(self, rows=None, columns=None, min_overlap=1, use_kit=False):
+        """Returns the (row, column) session pairs that share at least `min_overlap` keys or digraphs"""
+        rows = list(range(len(self.names)) if rows is None else rows)
+        columns = list(range(len(self.names)) if columns is None else columns)
+        counts = self.overlap_counts(rows, columns, use_kit)
+        i, j = np.nonzero(counts >= min_overlap)
+        return [(rows[a], columns[b]) for a, b in zip(i, j)]
 
 
-def count_interval_key_matches(
-    template_file_path: str, verification_file_path: str
-) -> int:
-    return len(find_matching_interval_keys(template_file_path, verification_file_path))
+def _pack(ids) -> np.ndarray:
+    bits = np.zeros(max(ids, default=-1) + 1, dtype=bool)
+    bits[ids] = True
+    return np.packbits(bits)
 
 
 def find_matching_keys_from_dicts(template_data, verification_data):
@@ -101,16 +278,8 @@ def count_key_matches_from_dicts(template_data, verification_data):
 
 
 def read_matching_keys_from_files(template_path, verification_path):
-    driver = PickleDriver()
-    matches = []
-    template_dict = driver.load_as_dictionary(template_path)
-    verification_dict = driver.load_as_dictionary(verification_path)
-    template_keys = template_dict.keys()
-    verification_keys = verification_dict.keys()
-    for key in template_keys:
-        if key in verification_keys:
-            matches.append(key)
-    return matches
+    # Both profiles and their matches are served from the process-wide store after the first call
+    return list(get_feature_store().matching_keys(template_path, verification_path))
 
 
 def flatten(lst):
@@ -121,17 +290,79 @@ def merge_sublists(lst):
     return list(itertools.chain.from_iterable(lst))
 
 
-# FIXME: The method seems to work and gets both the sets of data, but it doesn't seem to retain one set or the other.
-# I suspect that this is because dictionaries don't support duplicate keys
+def segment_bounds(
+    dictionary: TD_Data_Dictionary,
+    delimiters=("key.space",),
+    idle_gap_ms=None,
+    include_delimiter=False,
+):
+    """
+    Find the [start, end) event ranges of the segments of a session.
+
+    A segment ends at every press of a delimiter key and, if `idle_gap_ms` is given, wherever
+    two consecutive events are further apart than that. Empty segments are dropped.
+
+    Parameters
+    ----------
+    dictionary: TD_Data_Dictionary
+          The session to segment.
+    delimiters: Iterable[str]
+          Normalized key names (see `normalize_key_name`) that end a segment, e.g. "key.enter".
+    idle_gap_ms: float
+          The idle time in milliseconds that ends a segment, None to not split on idle time.
+    include_delimiter: bool
+          Whether the delimiter press is kept as the last event of its segment.
+    Returns
+    -------
+    Tuple[numpy.ndarray, numpy.ndarray]
+    """
+    count = len(dictionary.time_column)
+    wanted = set(delimiters)
+    is_delimiter = np.array(
+        [name in wanted for name in dictionary.vocabulary.normalized], dtype=bool
+    )
+    boundary = np.zeros(count, dtype=bool)
+    if len(is_delimiter) > 0:
+        boundary = is_delimiter[dictionary.key_codes] & (
+            dictionary.action_column == ACTION_PRESS
+        )
+    delimiter_index = np.flatnonzero(boundary)
+    if include_delimiter:
+        ends = delimiter_index + 1
+        starts = delimiter_index + 1
+    else:
+        ends = delimiter_index
+        starts = delimiter_index + 1
+    if idle_gap_ms is not None:
+        gaps = np.flatnonzero(np.diff(dictionary.time_column) > idle_gap_ms / 1000.0) + 1
+        ends = np.concatenate((ends, gaps))
+        starts = np.concatenate((starts, gaps))
+        # An idle gap right before a delimiter must not pull the delimiter into the next segment
+        order = np.lexsort((starts, ends))
+        ends, starts = ends[order], starts[order]
+    starts = np.r_[0, starts]
+    ends = np.r_[ends, count]
+    keep = ends > starts
+    return starts[keep], ends[keep]
+
+
+def segment_session(
+    dictionary: TD_Data_Dictionary,
+    delimiters=("key.space",),
+    idle_gap_ms=None,
+    include_delimiter=False,
+):
+    """Lazily yields every segment of a session as a zero-copy `TD_Data_Dictionary.view`, see `segment_bounds`"""
+    starts, ends = segment_bounds(dictionary, delimiters, idle_gap_ms, include_delimiter)
+    for start, end in zip(starts.tolist(), ends.tolist()):
+        yield dictionary.view(start, end)
+
+
 def split_dictionary_by_key(dictionary: TD_Data_Dictionary, key):
-    res = []
-    d = {}
-    for k, v in dictionary.data().items():
-        if k.get_key_name().lower() == key:
-            store = copy.deepcopy(d)
-            res.append(store)
-            print("Result", res)
-            d.clear()
-        else:
-            d[k.get_key_name()] = v.get_time()
-    return res
+    """Returns the segments of a session that precede each press of `key` (a normalized key name)"""
+    starts, ends = segment_bounds(dictionary, [key])
+    if len(ends) > 0 and ends[-1] == len(dictionary.time_column):
+        starts, ends = starts[:-1], ends[:-1]
+    return [
+        dictionary.view(start, end) for start, end in zip(starts.tolist(), ends.tolist())
+    ]
@@ -12,11 +12,13 @@ from typing import List
 from numpy import array, zeros, full, argmin, inf
 from scipy.spatial.distance import cdist
 from math import isinf
+import numpy as np
 
 install()
 
 
 def _traceback(D):
+    # The path is collected from the end and reversed once, which keeps the traceback linear
     i, j = array(D.shape) - 2
     p, q = [i], [j]
     while (i > 0) or (j > 0):
@@ -28,9 +30,127 @@ def _traceback(D):
             i -= 1
         else:  # (tb == 2):
             j -= 1
-        p.insert(0, i)
-        q.insert(0, j)
-    return array(p), array(q)
+        p.append(i)
+        q.append(j)
+    return array(p[::-1]), array(q[::-1])
+
+
+def _band(i, c, w):
+    """Returns the [start, end) columns of row i that lie inside the Sakoe-Chiba window"""
+    if isinf(w):
+        return 0, c
+    return max(0, i - w), min(c, i + w + 1)
+
+
+def _as_rows(x):
+    x = np.asarray(x, dtype=np.float64)
+    if x.ndim == 1:
+        return x[:, np.newaxis]
+    return x
+
+
+def _pairwise(metric: str):
+    """Turns a cdist metric name into a function of two single entries"""
+
+    def dist(a, b):
+        a = np.asarray(a, dtype=np.float64).reshape(1, -1)
+        b = np.asarray(b, dtype=np.float64).reshape(1, -1)
+        return cdist(a, b, metric=metric)[0, 0]
+
+    return dist
+
+
+def _cost_row(x, y, dist, i, start, end):
+    """Returns the local costs of entry i of x against the entries [start, end) of y"""
+    if isinstance(dist, str):
+        return cdist(_as_rows(x[i : i + 1]), _as_rows(y[start:end]), metric=dist)[0]
+    return np.array([dist(x[i], y[j]) for j in range(start, end)], dtype=np.float64)
+
+
+def _local_cost(x, y, dist, w):
+    """
+    Compute the local cost of every pair of entries inside the window, the rest of the matrix is inf.
+
+    A string `dist` is handed to cdist as the metric name, so the whole matrix (or every window row)
+    is computed in compiled code. Any other `dist` is called once per pair inside the window.
+    """
+    r, c = len(x), len(y)
+    if isinstance(dist, str) and isinf(w):
+        return cdist(_as_rows(x), _as_rows(y), metric=dist)
+    C = full((r, c), inf)
+    for i in range(r):
+        start, end = _band(i, c, w)
+        C[i, start:end] = _cost_row(x, y, dist, i, start, end)
+    return C
+
+
+def _take(row, row_start, start, end):
+    """Returns the columns [start, end) of a window row that begins at column row_start, inf outside of it"""
+    positions = np.arange(start, end) - row_start
+    inside = (positions >= 0) & (positions < len(row))
+    values = full(end - start, inf)
+    values[inside] = row[positions[inside]]
+    return values
+
+
+def _accumulate(C, w, s):
+    """
+    Accumulate the local costs along anti-diagonals.
+
+    Every cell depends on its upper, left and upper-left neighbours only, so all cells of one
+    anti-diagonal are independent and are updated with a single array expression. Only the cells
+    inside the window are visited, which makes the accumulation O(n * w).
+    Returns the (r + 1) x (c + 1) matrix whose first row and column hold the boundary conditions.
+    """
+    r, c = C.shape
+    D0 = full((r + 1, c + 1), inf)
+    D0[0, 0] = 0
+    D0[1:, 1:] = C
+    for d in range(2, r + c + 1):
+        low, high = max(1, d - c), min(r, d - 1)
+        if not isinf(w):
+            # |I - J| <= w with J = d - I
+            low, high = max(low, (d - w + 1) // 2), min(high, (d + w) // 2)
+        if low > high:
+            continue
+        I = np.arange(low, high + 1)
+        J = d - I
+        D0[I, J] += np.minimum(
+            D0[I - 1, J - 1], s * np.minimum(D0[I - 1, J], D0[I, J - 1])
+        )
+    return D0
+
+
+def _dtw_reference(x, y, dist, warp, w, s):
+    """The cell by cell DTW, used for warp > 1 where a cell may look further than its direct neighbours"""
+    r, c = len(x), len(y)
+    if not isinf(w):
+        D0 = full((r + 1, c + 1), inf)
+        for i in range(1, r + 1):
+            D0[i, max(1, i - w) : min(c + 1, i + w + 1)] = 0
+        D0[0, 0] = 0
+    else:
+        D0 = zeros((r + 1, c + 1))
+        D0[0, 1:] = inf
+        D0[1:, 0] = inf
+    D1 = D0[1:, 1:]  # view
+    for i in range(r):
+        for j in range(c):
+            if isinf(w) or (max(0, i - w) <= j <= min(c, i + w)):
+                D1[i, j] = dist(x[i], y[j])
+    C = D1.copy()
+    jrange = range(c)
+    for i in range(r):
+        if not isinf(w):
+            jrange = range(max(0, i - w), min(c, i + w + 1))
+        for j in jrange:
+            min_list = [D0[i, j]]
+            for k in range(1, warp + 1):
+                i_k = min(i + k, r)
+                j_k = min(j + k, c)
+                min_list += [D0[i_k, j] * s, D0[i, j_k] * s]
+            D1[i, j] += min(min_list)
+    return C, D0
 
 
 class Feature_Set:
@@ -54,49 +174,33 @@ class Feature_Set:
     def get_KHT_value(self):
         return self.kht_feature[1]
 
+    @staticmethod
     def dtw(x, y, dist, warp=1, w=inf, s=1.0):
         """
         Computes Dynamic Time Warping (DTW) of two sequences.
         :param array x: N1*M array
         :param array y: N2*M array
-        :param func dist: distance used as cost measure
+        :param func dist: distance used as cost measure, or the name of a scipy.spatial.distance.cdist metric
+            such as "euclidean" which computes the cost matrix without calling back into Python
         :param int warp: how many shifts are computed.
         :param int w: window size limiting the maximal distance between indices of matched entries |i,j|.
         :param float s: weight applied on off-diagonal moves of the path. As s gets larger, the warping path is increasingly biased towards the diagonal
         Returns the minimum distance, the cost matrix, the accumulated cost matrix, and the wrap path.
+        With warp == 1 only the cells inside the window are computed and accumulated, so the cost is O(N1 * w).
         """
 
         assert len(x)
         assert len(y)
         assert isinf(w) or (w >= abs(len(x) - len(y)))
         assert s > 0
-        r, c = len(x), len(y)
-        if not isinf(w):
-            D0 = full((r + 1, c + 1), inf)
-            for i in range(1, r + 1):
-                D0[i, max(1, i - w) : min(c + 1, i + w + 1)] = 0
-            D0[0, 0] = 0
+        if warp == 1:
+            C = _local_cost(x, y, dist, w)
+            D0 = _accumulate(C, w, s)
         else:
-            D0 = zeros((r + 1, c + 1))
-            D0[0, 1:] = inf
-            D0[1:, 0] = inf
+            if isinstance(dist, str):
+                dist = _pairwise(dist)
+            C, D0 = _dtw_reference(x, y, dist, warp, w, s)
         D1 = D0[1:, 1:]  # view
-        for i in range(r):
-            for j in range(c):
-                if isinf(w) or (max(0, i - w) <= j <= min(c, i + w)):
-                    D1[i, j] = dist(x[i], y[j])
-        C = D1.copy()
-        jrange = range(c)
-        for i in range(r):
-            if not isinf(w):
-                jrange = range(max(0, i - w), min(c, i + w + 1))
-            for j in jrange:
-                min_list = [D0[i, j]]
-                for k in range(1, warp + 1):
-                    i_k = min(i + k, r)
-                    j_k = min(j + k, c)
-                    min_list += [D0[i_k, j] * s, D0[i, j_k] * s]
-                D1[i, j] += min(min_list)
         if len(x) == 1:
             path = zeros(len(y)), range(len(y))
         elif len(y) == 1:
@@ -105,6 +209,48 @@ class Feature_Set:
             path = _traceback(D0)
         return D1[-1, -1], C, D1, path
 
+    @staticmethod
+    def dtw_distance(x, y, dist, w=inf, s=1.0, upper_bound=inf):
+        """
+        Computes only the Dynamic Time Warping (DTW) distance of two sequences, see `dtw`.
+
+        Only the previous and the current row of the accumulated cost matrix are kept, limited to the
+        window when `w` is finite, so the memory does not grow with the length of x. No warp path is built.
+        :param float upper_bound: once every cell of a row exceeds this bound the distance can only be
+            larger and inf is returned straight away. Useful to skip candidates in a nearest-template search.
+            Abandoning requires non-negative costs and s >= 1, with s < 1 the bound is only applied at the end.
+        Returns the minimum distance, or inf if it exceeds upper_bound.
+        """
+        assert len(x)
+        assert len(y)
+        assert isinf(w) or (w >= abs(len(x) - len(y)))
+        assert s > 0
+        r, c = len(x), len(y)
+        # The boundary row of the accumulated matrix, only its corner before column 0 is reachable
+        previous, previous_start = np.array([0.0]), -1
+        for i in range(r):
+            start, end = _band(i, c, w)
+            cost = _cost_row(x, y, dist, i, start, end)
+            diagonal = _take(previous, previous_start, start - 1, end - 1)
+            up = _take(previous, previous_start, start, end)
+            row = cost + np.minimum(diagonal, s * up)
+            # The move from the left depends on the cell just computed, D[j] = min(entering[j], cost[j] + s * D[j - 1]).
+            # Relaxing the whole row until nothing improves reaches the same values with the same floating point
+            # operations as the cell by cell recurrence, in as many passes as the longest run of left moves
+            while len(row) > 1:
+                left = cost[1:] + s * row[:-1]
+                improved = left < row[1:]
+                if not improved.any():
+                    break
+                row[1:][improved] = left[improved]
+            if s >= 1.0 and row.min() > upper_bound:
+                return inf
+            previous, previous_start = row, start
+        distance = previous[-1]
+        if distance > upper_bound:
+            return inf
+        return distance
+
 
 class Point:
     """A Point consists of 2 elements:
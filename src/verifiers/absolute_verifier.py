@@ -4,9 +4,9 @@
 # license that can be found in the LICENSE file or at
 # https://opensource.org/licenses/MIT.
 
-from converters.pickle_driver import PickleDriver
-from core.td_data_dict import TD_Data_Dictionary
+from converters.feature_store import get_feature_store
 from core.td_utils import (
+    as_comparison_context,
     find_matching_keys,
     is_between,
     find_matching_interval_keys,
@@ -18,28 +18,56 @@ from core.log import Logger
 from rich.traceback import install
 from core.utils import running_avg
 from pprint import pprint
+import numpy as np
+import os
 
 install()
 
 
+def is_profile_path(source) -> bool:
+    """Whether `source` is the path of a precomputed profile, that is an existing file without a .csv extension"""
+    if not isinstance(source, str):
+        return False
+    if not os.path.exists(source):
+        raise FileNotFoundError("No such file: " + source)
+    return os.path.splitext(source)[1].lower() != ".csv"
+
+
 class AbsoluteVerifier:
-    def __init__(
-        self, template_file_path: str, verification_file_path: str, threshold: float
-    ):
+    def __init__(self, template_file_path, verification_file_path, threshold: float):
         self.THRESHOLD = threshold
-        self.template_file_path = template_file_path
-        self.verification_file_path = verification_file_path
-        self.template_td_data_dict = TD_Data_Dictionary(self.template_file_path)
-        self.verification_td_data_dict = TD_Data_Dictionary(self.verification_file_path)
+        self._load(template_file_path, verification_file_path)
+
+    def _load(self, template, verification) -> None:
+        # Either argument may be a csv path or an already loaded TD_Data_Dictionary, or the template
+        # may be a ComparisonContext whose extracted features are then shared with other verifiers.
+        # Two non-csv paths are precomputed profiles, which are only read in evaluating mode
+        if is_profile_path(template) and is_profile_path(verification):
+            self.context = None
+            self.template_td_data_dict = None
+            self.verification_td_data_dict = None
+            self.template_file_path = template
+            self.verification_file_path = verification
+            return
+        self.context = as_comparison_context(template, verification)
+        self.template_td_data_dict = self.context.template_dict
+        self.verification_td_data_dict = self.context.verification_dict
+        self.template_file_path = self.context.template_path()
+        self.verification_file_path = self.context.verification_path()
 
     def class_name() -> str:
         return "Absolute Verifier"
 
+    def _sources(self):
+        if self.context is None:
+            return (self.template_file_path, self.verification_file_path)
+        return (self.template_td_data_dict, self.verification_td_data_dict)
+
     def set_template_file_path(self, new_path: str) -> None:
-        self.template_file_path = new_path
+        self._load(new_path, self._sources()[1])
 
     def set_verification_file_path(self, new_path: str) -> None:
-        self.verification_file_path = new_path
+        self._load(self._sources()[0], new_path)
 
     def template_path(self):
         return self.template_file_path
@@ -59,20 +87,62 @@ class AbsoluteVerifier:
             else:
                 return self.check_key_interval_latencies(key, is_evaluating=True)
 
+    def key_means(self, use_kit=False):
+        """Returns the matched keys (or digraphs when use_kit is True) with their aligned template and
+        verification mean latencies. For digraphs only the Press-Press latency is kept, which is the
+        column the per-key check looks at.
+        """
+        keys, template_latencies, verification_latencies = self.context.latency_vectors(
+            use_kit
+        )
+        if use_kit:
+            template_latencies = template_latencies[:, 0]
+            verification_latencies = verification_latencies[:, 0]
+        return keys, template_latencies, verification_latencies
+
+    def key_ratios(self, use_kit=False):
+        """Returns the matched keys (or digraphs when use_kit is True) and the ratio of the larger
+        to the smaller of their template and verification mean latencies
+
+        Equal latencies have a ratio of exactly 1, see key_means() for the latencies compared.
+        """
+        keys, template_latencies, verification_latencies = self.key_means(use_kit)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            ratios = np.maximum(template_latencies, verification_latencies) / np.minimum(
+                template_latencies, verification_latencies
+            )
+        ratios[template_latencies == verification_latencies] = 1.0
+        return keys, ratios
+
+    def score_keys(self, use_kit=False):
+        """Checks every matched key (or digraph when use_kit is True) against the threshold at once
+
+        A key is valid when the ratio of its larger to its smaller mean latency lies in [1, THRESHOLD],
+        or when both latencies are equal, see key_ratios().
+
+        Returns
+        -------
+        tuple
+            (keys, valid) where valid is a boolean array aligned with keys
+        """
+        keys, ratios = self.key_ratios(use_kit)
+        valid = (ratios == 1.0) | ((ratios >= 1.0) & (ratios <= self.THRESHOLD))
+        return keys, valid
+
+    def check_latencies(self, template_latency, verification_latency) -> bool:
+        """The per-key test of score_keys() for a single pair of mean latencies"""
+        if template_latency == verification_latency:
+            return True
+        larger = max(template_latency, verification_latency)
+        smaller = min(template_latency, verification_latency)
+        if smaller == 0:
+            return False
+        return 1.0 <= larger / smaller <= self.THRESHOLD
+
     def calculate_absolute_score(self, use_kit=False, is_evaluating=False):
         if is_evaluating == False:
-            if use_kit == False:
-                matches = find_matching_keys(
-                    self.template_file_path, self.verification_file_path
-                )
-                valids = self.find_all_valid_keys()
-                return 1 - (len(valids) / len(matches))
-            else:
-                matches = find_matching_interval_keys(
-                    self.template_file_path, self.verification_file_path
-                )
-                valids = self.find_all_valid_keys(use_kit=True)
-                return 1 - (len(valids) / len(matches))
+            keys, valid = self.score_keys(use_kit)
+            return 1 - (np.count_nonzero(valid) / len(keys))
         elif is_evaluating == True:
             if use_kit == False:
                 matches = read_matching_keys_from_files(
@@ -100,9 +170,7 @@ class AbsoluteVerifier:
                 verification_hit_dict = (
                     self.verification_td_data_dict.calculate_key_hold_time()
                 )
-                key_matches = find_matching_keys(
-                    self.template_file_path, self.verification_file_path
-                )
+                key_matches = find_matching_keys(self.context)
                 if not key in key_matches:
                     log.km_error("Key not found")
                     return
@@ -127,9 +195,7 @@ class AbsoluteVerifier:
                         verification_pairs
                     )
                 )
-                key_matches = find_matching_interval_keys(
-                    self.template_file_path, self.verification_file_path
-                )
+                key_matches = find_matching_interval_keys(self.context)
                 if not key in key_matches:
                     log.km_error("Key not found")
                     return
@@ -137,22 +203,14 @@ class AbsoluteVerifier:
                 v_latency = verification_inteval_dict.get(key)
                 return [t_latency, v_latency]
         elif is_evaluating == True:
-            # Read the KHT and KIT values from the files
-            key_matches = read_matching_keys_from_files(
-                self.template_file_path, self.verification_file_path
-            )
-            # input("Matches")
-            # print(key_matches)
-
-            if not key in key_matches:
+            # Read the KHT and KIT values from the files, which are only loaded once per process
+            store = get_feature_store()
+            # NOTE: THESE PATHS MUST POINT TO FILES CONTAINING KIT DATA
+            template_inteval_dict = store.load(self.template_file_path)
+            verification_inteval_dict = store.load(self.verification_file_path)
+            if not (key in template_inteval_dict and key in verification_inteval_dict):
                 log.km_error("Key not found")
                 return
-            driver = PickleDriver()
-            # NOTE: THESE PATHS MUST POINT TO FILES CONTAINING KIT DATA
-            template_inteval_dict = driver.load_as_dictionary(self.template_file_path)
-            verification_inteval_dict = driver.load_as_dictionary(
-                self.verification_file_path
-            )
             # input("Verification Dictionary")
             # print(verification_inteval_dict)
 
@@ -167,23 +225,8 @@ class AbsoluteVerifier:
     def find_all_valid_keys(self, use_kit=False, is_evaluating=False):
         valids = []
         if is_evaluating == False:
-            if use_kit == False:
-                matches = find_matching_keys(
-                    self.template_file_path, self.verification_file_path
-                )
-                for key in matches:
-                    if self.is_key_valid(key):
-                        valids.append(key)
-                return valids
-            else:
-                matches = find_matching_interval_keys(
-                    self.template_file_path, self.verification_file_path
-                )
-                # print("IN HERE")
-                for key in matches:
-                    if self.is_key_valid(key, use_kit=True):
-                        valids.append(key)
-                return valids
+            keys, valid = self.score_keys(use_kit)
+            return [key for key, is_valid in zip(keys, valid) if is_valid]
         elif is_evaluating == True:
             matches = read_matching_keys_from_files(
                 self.template_file_path, self.verification_file_path
@@ -316,10 +359,10 @@ class AbsoluteVerifier:
             pass
 
     def get_threshold(self):
-        return self.threshold
+        return self.THRESHOLD
 
     def set_threshold(self, threshold):
-        self.threshold = threshold
+        self.THRESHOLD = threshold
 
     def count_valid_key_matches(self, is_evaluating=False):
         if is_evaluating == False:
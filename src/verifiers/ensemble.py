@@ -0,0 +1,69 @@
+# Copyright 2022, Alvin Kuruvilla <alvineasokuruvilla@gmail.com>
+
+# Use of this source code is governed by an MIT-style
+# license that can be found in the LICENSE file or at
+# https://opensource.org/licenses/MIT.
+
+from core.exceptions import Invalid_Verifier
+from core.td_utils import as_comparison_context
+from verifiers.absolute_verifier import AbsoluteVerifier
+from verifiers.relative_verifier import RelativeVerifier
+from verifiers.similarity_verifier import SimilarityVerifier
+
+
+def verifier_score(verifier, use_kit=False) -> float:
+    """Returns the score a verifier reports for its pair, NaN if the pair has too few matched keys to score"""
+    if isinstance(verifier, RelativeVerifier):
+        if len(verifier.ranks(use_kit)[0]) < 2:
+            return float("nan")
+        return verifier.absolute_degree_of_disorder(use_kit)
+    keys, _ = verifier.score_keys(use_kit)
+    if len(keys) == 0:
+        return float("nan")
+    if isinstance(verifier, AbsoluteVerifier):
+        return verifier.calculate_absolute_score(use_kit)
+    if isinstance(verifier, SimilarityVerifier):
+        return verifier.calculate_similarity_score(use_kit)
+    raise Invalid_Verifier("Provided verifier is not a valid type")
+
+
+def score_all(template, verification=None, thresholds=None, use_kit=False) -> dict:
+    """
+    Score one template/verification pair with several verifiers over a single feature extraction.
+
+    Both sessions are parsed and their matched keys and aligned latency vectors extracted once, in a
+    ComparisonContext that every verifier then reads from.
+
+    Parameters
+    ----------
+    template:
+          A csv path, a TD_Data_Dictionary or a ComparisonContext (then `verification` is ignored).
+    verification:
+          A csv path or a TD_Data_Dictionary.
+    thresholds: dict
+          From verifier class to the threshold it is run with. Defaults to all three verifiers with a threshold of 1.
+    use_kit: bool
+          Score key interval times instead of key hold times.
+    Returns
+    -------
+    dict
+          From verifier class name to its score, see verifier_score().
+    """
+    if thresholds is None:
+        thresholds = {
+            AbsoluteVerifier: 1.0,
+            RelativeVerifier: 1.0,
+            SimilarityVerifier: 1.0,
+        }
+    context = as_comparison_context(template, verification)
+    scores = {}
+    for verifier_class, threshold in thresholds.items():
+        if verifier_class not in (
+            AbsoluteVerifier,
+            RelativeVerifier,
+            SimilarityVerifier,
+        ):
+            raise Invalid_Verifier("Provided verifier is not a valid type")
+        verifier = verifier_class(context, None, threshold)
+        scores[verifier_class.__name__] = verifier_score(verifier, use_kit)
+    return scores
@@ -9,11 +9,20 @@ from core.utils import is_csv_file
 from verifiers.relative_verifier import RelativeVerifier
 from verifiers.absolute_verifier import AbsoluteVerifier
 from verifiers.similarity_verifier import SimilarityVerifier
+from core.log import Logger
+from core.profile import Template_Profile
 from core.td_utils import *
+from concurrent.futures import ProcessPoolExecutor
+import json
+import multiprocessing
+import numpy as np
 import os
+import pandas as pd
+import time
 
 
 def evaluate_against_files(template_path, other_filepath, verifier, use_kit=False):
+    """`template_path` may also be a ComparisonContext, in which case `other_filepath` is ignored"""
     if not validate_verifier_type(verifier):
         raise Invalid_Verifier("Provided verifier is not a valid type")
     if use_kit == False:
@@ -28,26 +37,389 @@ def evaluate_against_files(template_path, other_filepath, verifier, use_kit=Fals
         return (percent, is_majority(percent))
 
 
+def count_valid_matches(verifier, use_kit=False):
+    """Returns the number of matched keys (or digraphs) of a verifier and how many of them are valid"""
+    if isinstance(verifier, RelativeVerifier):
+        if use_kit == False:
+            total_matches = count_key_matches(verifier.context)
+        else:
+            total_matches = count_interval_key_matches(verifier.context)
+        if total_matches == 0:
+            return 0, 0
+        return total_matches, len(verifier.find_all_valid_keys(use_kit))
+    # The absolute and similarity verifiers score every matched key in one pass
+    keys, valid = verifier.score_keys(use_kit)
+    return len(keys), int(np.count_nonzero(valid))
+
+
+# The template and verifier settings of the running evaluate_against_directory call. Worker processes
+# receive them once through the pool initializer, with the fork start method they are inherited
+# copy-on-write instead of being pickled.
+_directory_job = None
+
+
+def _init_directory_worker(job) -> None:
+    global _directory_job
+    verifier_class, threshold, use_kit, template = job
+    _directory_job = (verifier_class, threshold, use_kit, load_td_data_dict(template))
+
+
+def _evaluate_probe(probe_path: str) -> dict:
+    verifier_class, threshold, use_kit, template = _directory_job
+    start = time.perf_counter()
+    result = {
+        "file": probe_path,
+        "total_matches": 0,
+        "valid_matches": 0,
+        "percent": float("nan"),
+        "majority": False,
+        "seconds": 0.0,
+        "error": None,
+    }
+    # One unreadable or degenerate probe must not abort the whole directory, its error is reported instead
+    try:
+        verifier = verifier_class(template, probe_path, threshold)
+        total_matches, valid_matches = count_valid_matches(verifier, use_kit)
+        result["total_matches"] = total_matches
+        if total_matches:
+            result["valid_matches"] = valid_matches
+            result["percent"] = valid_matches / total_matches
+            result["majority"] = is_majority(result["percent"])
+    except Exception as error:
+        result["error"] = "%s: %s" % (type(error).__name__, error)
+    result["seconds"] = time.perf_counter() - start
+    return result
+
+
 def evaluate_against_directory(
-    template_path: str, directory_path: str, verifier, use_kit=False
+    template_path: str,
+    directory_path: str,
+    verifier,
+    use_kit=False,
+    workers=None,
+    chunksize=64,
+    output_path=None,
 ):
+    """
+    Evaluate every csv file in a directory against one template in parallel.
+
+    The template is parsed once in the calling process and shared with the worker processes,
+    every probe file is compared against it by a fresh verifier of the same type and threshold as `verifier`.
+
+    Parameters
+    ----------
+    template_path: str
+          The path to the template csv file.
+    directory_path: str
+          The directory holding the probe csv files, entries that are not csv files are skipped.
+    verifier:
+          A RelativeVerifier, AbsoluteVerifier or SimilarityVerifier whose type and threshold are used.
+    use_kit: bool
+          Compare key interval times instead of key hold times.
+    workers: int
+          The number of worker processes, defaults to the number of cores. With 1 the files are evaluated in this process.
+    chunksize: int
+          The number of probe files sent to a worker at a time.
+    output_path: str
+          If given, every result is appended to this file as a JSON line as soon as it is available.
+    Returns
+    -------
+    pandas.DataFrame
+          One row per probe file with its match counts, percent, majority decision, evaluation time
+          in seconds and the error that stopped its evaluation, if any.
+    """
+    global _directory_job
+    if not validate_verifier_type(verifier):
+        raise Invalid_Verifier("Provided verifier is not a valid type")
     if not is_csv_file(template_path):
         raise NotCSVFileError(template_path, template_path + " is not a CSV file")
     if not os.path.isdir(directory_path):
         raise ValueError(directory_path + " is not a directory")
-    for file in os.listdir(directory_path):
-        if not is_csv_file(file):
-            raise NotCSVFileError(file, file + " is not a CSV file")
-        if use_kit == False:
-            total_matches = count_key_matches(template_path, file)
-            valid_matches = verifier.count_valid_key_matches()
-            percent = valid_matches / total_matches
-            print(file, percent, is_majority(percent))
-        elif use_kit == True:
-            total_matches = count_interval_key_matches(template_path, file)
-            valid_matches = verifier.count_valid_interval_key_matches()
-            percent = valid_matches / total_matches
-            print(file, percent, is_majority(percent))
+    probe_paths = []
+    for file in sorted(os.listdir(directory_path)):
+        probe_path = os.path.join(directory_path, file)
+        # Anything else in the directory, such as the .td sidecars of the probes, is not a probe
+        if not (file.lower().endswith(".csv") and os.path.isfile(probe_path)):
+            continue
+        probe_paths.append(probe_path)
+
+    template = load_td_data_dict(template_path)
+    # Compute the template features before forking so every worker shares them
+    template.calculate_key_hold_time()
+    template.calculate_key_interval_time(template.get_key_pairs())
+    job = (type(verifier), verifier.get_threshold(), use_kit, template)
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if workers == 1:
+        _init_directory_worker(job)
+        results = map(_evaluate_probe, probe_paths)
+        executor = None
+    else:
+        if "fork" in multiprocessing.get_all_start_methods():
+            context = multiprocessing.get_context("fork")
+        else:
+            # Key codes are only valid in the process that created them, so spawned workers reload the template
+            context = multiprocessing.get_context()
+            job = job[:3] + (template_path,)
+        executor = ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=context,
+            initializer=_init_directory_worker,
+            initargs=(job,),
+        )
+        results = executor.map(_evaluate_probe, probe_paths, chunksize=chunksize)
+    rows = []
+    output = open(output_path, "a") if output_path is not None else None
+    try:
+        for result in results:
+            rows.append(result)
+            if output is not None:
+                output.write(json.dumps(result) + "\n")
+                output.flush()
+    finally:
+        if output is not None:
+            output.close()
+        if executor is not None:
+            executor.shutdown()
+        _directory_job = None
+    return pd.DataFrame(
+        rows,
+        columns=[
+            "file",
+            "total_matches",
+            "valid_matches",
+            "percent",
+            "majority",
+            "seconds",
+            "error",
+        ],
+    )
+
+
+# The sessions and verifier settings of the running evaluate_all_pairs call, handed to the
+# workers like _directory_job
+_matrix_job = None
+
+
+def _init_matrix_worker(job) -> None:
+    global _matrix_job
+    verifiers, use_kit, sessions, profiles, block_size, checkpoint_directory = job
+    sessions = [load_td_data_dict(session) for session in sessions]
+    for session in sessions:
+        session.calculate_key_hold_time()
+        session.calculate_key_interval_time(session.get_key_pairs())
+    # Profiles that were built before the workers forked are shared as they are
+    if profiles is None:
+        profiles = [None] * len(sessions)
+        if any(verifier_class is SimilarityVerifier for verifier_class, _ in verifiers):
+            profiles = [
+                Template_Profile.from_sessions([session]) for session in sessions
+            ]
+    _matrix_job = (
+        verifiers,
+        use_kit,
+        sessions,
+        profiles,
+        block_size,
+        checkpoint_directory,
+    )
+
+
+def block_checkpoint_path(checkpoint_directory: str, row: int, column: int) -> str:
+    return os.path.join(checkpoint_directory, "block_%d_%d.npz" % (row, column))
+
+
+def _evaluate_block(block) -> tuple:
+    verifiers, use_kit, sessions, profiles, block_size, checkpoint_directory = _matrix_job
+    row, column = block
+    rows = range(row * block_size, min((row + 1) * block_size, len(sessions)))
+    columns = range(
+        column * block_size, min((column + 1) * block_size, len(sessions))
+    )
+    scores = {}
+    failures = []
+    for verifier_class, threshold in verifiers:
+        matrix = np.full((len(rows), len(columns)), np.nan)
+        for i, template in enumerate(rows):
+            for j, probe in enumerate(columns):
+                if verifier_class is SimilarityVerifier:
+                    source = profiles[template]
+                else:
+                    source = sessions[template]
+                # A degenerate pair leaves its score as NaN instead of aborting the block,
+                # its error is recorded so that it can be reported
+                try:
+                    verifier = verifier_class(source, sessions[probe], threshold)
+                    total_matches, valid_matches = count_valid_matches(
+                        verifier, use_kit
+                    )
+                except Exception as error:
+                    failures.append(
+                        {
+                            "template": template,
+                            "probe": probe,
+                            "verifier": verifier_class.__name__,
+                            "error": "%s: %s" % (type(error).__name__, error),
+                        }
+                    )
+                    continue
+                if total_matches:
+                    matrix[i, j] = valid_matches / total_matches
+        scores[verifier_class.__name__] = matrix
+    if checkpoint_directory is not None:
+        # Written under a temporary name first so a crash never leaves a truncated block behind
+        target = block_checkpoint_path(checkpoint_directory, row, column)
+        temporary = target + ".%d.tmp.npz" % os.getpid()
+        np.savez(temporary, _failures=np.array(json.dumps(failures)), **scores)
+        os.replace(temporary, target)
+    return block, scores, failures
+
+
+def evaluate_all_pairs(
+    session_paths,
+    verifiers,
+    use_kit=False,
+    checkpoint_directory=None,
+    block_size=32,
+    workers=None,
+):
+    """
+    Score every session as template against every session as probe, for several verifiers at once.
+
+    The sessions are parsed and their features extracted once, then the N x N matrix is split into
+    blocks of block_size x block_size pairs that are evaluated in parallel. Every finished block is
+    saved to `checkpoint_directory`, and a later call with the same arguments only evaluates the blocks
+    that are missing there, so an interrupted run resumes where it stopped.
+
+    Parameters
+    ----------
+    session_paths: list
+          The csv files of the sessions, in matrix order.
+    verifiers: list
+          RelativeVerifier, AbsoluteVerifier or SimilarityVerifier objects whose types and thresholds are used.
+    use_kit: bool
+          Compare key interval times instead of key hold times.
+    checkpoint_directory: str
+          Where finished blocks are stored, nothing is checkpointed if it is None.
+    block_size: int
+          The number of templates and probes per block.
+    workers: int
+          The number of worker processes, defaults to the number of cores. With 1 the blocks are evaluated in this process.
+    Returns
+    -------
+    dict
+          From verifier class name to the (N, N) matrix holding the fraction of valid matched keys of every
+          template (row) and probe (column) pair, NaN where the pair has no matched keys or could not be
+          evaluated. The pairs that could not be evaluated are listed under "failures", each with its
+          template and probe index, verifier class name and error.
+    """
+    for verifier in verifiers:
+        if not validate_verifier_type(verifier):
+            raise Invalid_Verifier("Provided verifier is not a valid type")
+    settings = [(type(verifier), verifier.get_threshold()) for verifier in verifiers]
+    session_paths = [os.path.abspath(path) for path in session_paths]
+    n_blocks = -(-len(session_paths) // block_size)
+    blocks = [(row, column) for row in range(n_blocks) for column in range(n_blocks)]
+    size = len(session_paths)
+    names = [verifier_class.__name__ for verifier_class, _ in settings]
+    results = {name: np.full((size, size), np.nan) for name in names}
+    failures = []
+
+    def store(block, scores, block_failures) -> None:
+        row, column = block
+        for name, matrix in scores.items():
+            results[name][
+                row * block_size : row * block_size + matrix.shape[0],
+                column * block_size : column * block_size + matrix.shape[1],
+            ] = matrix
+        failures.extend(block_failures)
+
+    pending = blocks
+    if checkpoint_directory is not None:
+        os.makedirs(checkpoint_directory, exist_ok=True)
+        manifest = {
+            "sessions": session_paths,
+            "verifiers": [
+                [verifier_class.__name__, threshold]
+                for verifier_class, threshold in settings
+            ],
+            "use_kit": use_kit,
+            "block_size": block_size,
+        }
+        manifest_path = os.path.join(checkpoint_directory, "manifest.json")
+        if os.path.exists(manifest_path):
+            with open(manifest_path) as file:
+                if json.load(file) != manifest:
+                    raise ValueError(
+                        checkpoint_directory
+                        + " holds the checkpoints of a different evaluation"
+                    )
+        else:
+            with open(manifest_path, "w") as file:
+                json.dump(manifest, file)
+        pending = []
+        for block in blocks:
+            path = block_checkpoint_path(checkpoint_directory, *block)
+            if os.path.exists(path):
+                with np.load(path) as checkpoint:
+                    store(
+                        block,
+                        {name: checkpoint[name] for name in names},
+                        json.loads(str(checkpoint["_failures"])),
+                    )
+            else:
+                pending.append(block)
+    if pending:
+        _evaluate_pending_blocks(
+            pending,
+            (settings, use_kit, session_paths, None, block_size, checkpoint_directory),
+            workers,
+            store,
+        )
+    failures.sort(key=lambda failure: (failure["template"], failure["probe"]))
+    if failures:
+        log = Logger("evaluate_all_pairs")
+        for failure in failures:
+            log.km_error(
+                "%s could not evaluate %s against %s: %s"
+                % (
+                    failure["verifier"],
+                    session_paths[failure["probe"]],
+                    session_paths[failure["template"]],
+                    failure["error"],
+                )
+            )
+    results["failures"] = failures
+    return results
+
+
+def _evaluate_pending_blocks(pending, job, workers, store) -> None:
+    global _matrix_job
+    if workers is None:
+        workers = os.cpu_count() or 1
+    try:
+        if workers == 1:
+            _init_matrix_worker(job)
+            for block in pending:
+                store(*_evaluate_block(block))
+            return
+        if "fork" in multiprocessing.get_all_start_methods():
+            # Parse the sessions and build the profiles once here so that every forked worker shares them
+            context = multiprocessing.get_context("fork")
+            _init_matrix_worker(job)
+            job = job[:2] + _matrix_job[2:4] + job[4:]
+        else:
+            context = multiprocessing.get_context()
+        with ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=context,
+            initializer=_init_matrix_worker,
+            initargs=(job,),
+        ) as executor:
+            for result in executor.map(_evaluate_block, pending):
+                store(*result)
+    finally:
+        _matrix_job = None
 
 
 def evaluate_against_dictionaries(
@@ -75,6 +447,125 @@ def is_majority(percent: float) -> bool:
         return False
 
 
+def sequential_decision(valids, total: int, threshold: float = 0.5):
+    """
+    Decide whether more than `threshold` of `total` keys are valid, stopping as soon as the outcome is certain.
+
+    After k of the total keys, v of them valid, the final fraction lies between v / total and
+    (v + total - k) / total. Once the lower bound exceeds the threshold the pair is accepted, once
+    the upper bound no longer does it is rejected, and the remaining keys are never looked at.
+
+    Parameters
+    ----------
+    valids: iterable
+          The validity of every key in the order they should be considered, consumed lazily.
+    total: int
+          The number of keys `valids` yields when fully consumed.
+    threshold: float
+          The fraction of valid keys that must be exceeded, 0.5 gives the is_majority() rule.
+    Returns
+    -------
+    tuple
+          (decision, consumed, valid) with the outcome, the number of keys looked at and how many of those were valid.
+    """
+    if total == 0:
+        return False, 0, 0
+    valids = iter(valids)
+    consumed = 0
+    valid = 0
+    # The bounds are checked before pulling a key so that no key past the decision is computed
+    while valid / total <= threshold and (valid + total - consumed) / total > threshold:
+        is_valid = next(valids, None)
+        if is_valid is None:
+            break
+        consumed += 1
+        if is_valid:
+            valid += 1
+    return valid / total > threshold, consumed, valid
+
+
+def sequential_key_checks(verifier, template, verification, positions):
+    """Yields the per-key check of `verifier` for the keys at `positions`, one key at a time
+
+    `template` and `verification` are the mean latencies aligned with the matched keys, see key_means().
+    """
+    for position in positions:
+        yield verifier.check_latencies(template[position], verification[position])
+
+
+def sequential_key_order(verifier, keys, order="frequency", use_kit=False):
+    """
+    Return the positions of `keys` in the order a sequential decision should consider them.
+
+    Parameters
+    ----------
+    verifier:
+          The AbsoluteVerifier or SimilarityVerifier the keys belong to.
+    keys: list
+          The matched keys (or digraphs) of the verifier.
+    order:
+          "template" keeps the matched key order, "frequency" puts the keys typed most often in the
+          verification session first and a dictionary from key to weight puts the heaviest keys first,
+          for example weights measuring how well each key separates users.
+    Returns
+    -------
+    numpy.ndarray
+    """
+    if isinstance(order, dict):
+        weights = np.array([order.get(key, 0.0) for key in keys], dtype=np.float64)
+        return np.argsort(-weights, kind="stable")
+    if order == "template":
+        return np.arange(len(keys))
+    if order == "frequency":
+        session = verifier.verification_td_data_dict
+        names = session.key_names
+        if use_kit == False:
+            codes, counts, _, _ = session.key_hold_times().statistics()
+            frequency = {names[code]: count for code, count in zip(codes, counts)}
+        else:
+            kit = session.key_interval_times()
+            digraphs, counts, _, _ = kit.statistics()
+            frequency = {}
+            for digraph, count in zip(digraphs, counts):
+                first, second = kit.decode(digraph)
+                frequency[(names[first], names[second])] = count
+        counts = np.array([frequency.get(key, 0) for key in keys], dtype=np.int64)
+        return np.argsort(-counts, kind="stable")
+    raise ValueError("Unknown key order " + str(order))
+
+
+def evaluate_sequentially(verifier, use_kit=False, order="frequency", threshold=0.5):
+    """
+    Make the majority decision of a verifier over its matched keys with early exit, see sequential_decision().
+
+    Only the AbsoluteVerifier and the SimilarityVerifier judge keys individually, the RelativeVerifier
+    reaches one verdict for the whole table and so has nothing to stop early on.
+
+    Returns
+    -------
+    dict
+          The decision, the number of keys consumed and valid among them and the total number of matched keys.
+    """
+    if isinstance(verifier, RelativeVerifier) or not validate_verifier_type(verifier):
+        raise Invalid_Verifier(
+            "Sequential evaluation needs an AbsoluteVerifier or a SimilarityVerifier"
+        )
+    # Only the aligned latencies are extracted up front, each key is checked when the decision asks for it
+    keys, template, verification = verifier.key_means(use_kit)
+    positions = sequential_key_order(verifier, keys, order, use_kit)
+    decision, consumed, valid_count = sequential_decision(
+        sequential_key_checks(verifier, template, verification, positions),
+        len(keys),
+        threshold,
+    )
+    return {
+        "decision": decision,
+        "consumed": consumed,
+        "valid": valid_count,
+        "total": len(keys),
+    }
+
+
 def validate_verifier_type(verifier):
     if isinstance(verifier, RelativeVerifier):
         return True
@@ -99,11 +590,22 @@ class Verifier_Evaluator:
         kit_valids = self.verifier.find_all_valid_keys(True)
         return (kht_valids, kit_valids)
 
+    def matched_keys(self, use_kit=False):
+        """Returns the keys (or digraphs) the valid keys of extract_features() are counted against"""
+        if isinstance(self.verifier, RelativeVerifier):
+            if use_kit == False:
+                return find_matching_keys(self.verifier.context)
+            return find_matching_interval_keys(self.verifier.context)
+        if isinstance(self.verifier, AbsoluteVerifier) and self.verifier.context is None:
+            raise Invalid_Verifier(
+                "An AbsoluteVerifier built from two profiles can only be scored with is_evaluating=True"
+            )
+        # The SimilarityVerifier may score against a profile, so the keys come from the verifier itself
+        return self.verifier.score_keys(use_kit)[0]
+
     def evaluate(self, kht_valids, kit_valids):
-        t_path = self.get_template_file_path()
-        v_path = self.get_verification_file_path()
-        total_kht = find_matching_keys(t_path, v_path)
-        total_kit = find_matching_interval_keys(t_path, v_path)
+        total_kht = self.matched_keys()
+        total_kit = self.matched_keys(use_kit=True)
         # Now that we have the number of actual matches and the number of total potential matches
         # we can just divide them and see if they exceed a threshold
         kht_percent = len(kht_valids) / len(total_kht)
@@ -113,6 +615,10 @@ class Verifier_Evaluator:
         else:
             return tuple("False")
 
+    def evaluate_sequentially(self, use_kit=False, order="frequency"):
+        """Decides whether the valid key fraction exceeds the evaluator threshold, stopping once it is certain"""
+        return evaluate_sequentially(self.verifier, use_kit, order, self.threshold)
+
     def get_template_file_path(self):
         return self.verifier.template_path()
 
@@ -5,12 +5,17 @@
 # https://opensource.org/licenses/MIT.
 
 
-from math import pow
-from core.td_data_dict import TD_Data_Dictionary
 from core.log import Logger
 from rich.traceback import install
+import numpy as np
+import bisect
 
-from core.td_utils import find_matching_keys, find_matching_interval_keys
+from core.td_utils import (
+    as_comparison_context,
+    load_td_data_dict,
+    find_matching_keys,
+    find_matching_interval_keys,
+)
 
 install()
 # NOTE: As far as I can tell this verifier operates on the entire set of verification data
@@ -34,15 +39,75 @@ def dictionary_sort_by_value(d, ascending=True):
     return sorted_dictionary
 
 
+def latency_ranks(latencies: np.ndarray) -> np.ndarray:
+    """Ranks the latencies of every row in ascending order, ties keep their column order
+
+    NaN entries are ranked after all real values, so the real values of a row with n of them
+    always receive the ranks 0..n-1.
+    """
+    order = np.argsort(latencies, axis=-1, kind="stable")
+    ranks = np.empty_like(order)
+    np.put_along_axis(
+        ranks, order, np.arange(latencies.shape[-1])[np.newaxis, :], axis=-1
+    )
+    return ranks
+
+
+def max_rank_disorder(n):
+    """The largest possible sum of absolute rank differences between two orderings of n elements
+
+    This is floor(n^2 / 2), which equals (n^2 - 1) / 2 for odd n and n^2 / 2 for even n
+    """
+    return np.floor_divide(np.square(n), 2)
+
+
+def rank_disorder(template_latencies, verification_latencies) -> np.ndarray:
+    """Computes the degree of disorder of every verification row against its template row
+
+    Parameters
+    ----------
+    template_latencies: array_like
+        Shape (m, k), the template latency of each of k keys, repeated or varied per row
+    verification_latencies: array_like
+        Shape (m, k), one verification session per row. NaN marks a key the session does not contain,
+        the matching template entry is ignored for that row.
+
+    Returns
+    -------
+    tuple
+        (disorder, n) with the summed absolute rank differences and the number of compared keys of each row
+    """
+    verification_latencies = np.atleast_2d(
+        np.asarray(verification_latencies, dtype=np.float64)
+    )
+    template_latencies = np.broadcast_to(
+        np.asarray(template_latencies, dtype=np.float64), verification_latencies.shape
+    )
+    present = ~np.isnan(verification_latencies) & ~np.isnan(template_latencies)
+    template_ranks = latency_ranks(np.where(present, template_latencies, np.nan))
+    verification_ranks = latency_ranks(
+        np.where(present, verification_latencies, np.nan)
+    )
+    disorder = np.where(present, np.abs(template_ranks - verification_ranks), 0)
+    return disorder.sum(axis=-1), np.count_nonzero(present, axis=-1)
+
+
 class RelativeVerifier:
     def __init__(
-        self, template_file_path: str, verification_file_path: str, threshold: float
+        self, template_file_path, verification_file_path, threshold: float
     ) -> None:
         self.THRESHOLD = threshold
-        self.template_file_path = template_file_path
-        self.verification_file_path = verification_file_path
-        self.template_td_data_dict = TD_Data_Dictionary(self.template_file_path)
-        self.verification_td_data_dict = TD_Data_Dictionary(self.verification_file_path)
+        self._load(template_file_path, verification_file_path)
+
+    def _load(self, template, verification) -> None:
+        # Either argument may be a csv path or an already loaded TD_Data_Dictionary, or the template
+        # may be a ComparisonContext whose extracted features are then shared with other verifiers
+        self.context = as_comparison_context(template, verification)
+        self.template_td_data_dict = self.context.template_dict
+        self.verification_td_data_dict = self.context.verification_dict
+        self.template_file_path = self.context.template_path()
+        self.verification_file_path = self.context.verification_path()
+        self._ranks = {}
 
     def class_name(self) -> str:
         return "Relative Verifier"
@@ -67,30 +132,33 @@ class RelativeVerifier:
         #    Table 2: | C | H | M | Q | W |
         # So the degree of disorder for table V is 8
 
-        # NOTE: In our specific use case, I think the first table should be the verification attempt array and
-        # the sorted table should be the template array
-        # Thus we should iterate every element in the template table and keep a running sum of its distance
-        # to the corresponding entry in the verification table using the self.find_distance() function.
-        disorder = 0
-        if use_kit == False:
-            verification_keys = find_matching_keys(
-                self.template_file_path, self.verification_file_path
+        # In our use case the ordered table is the template and the other table the verification attempt,
+        # each ordered by ascending latency over the keys both sessions share
+        template_ranks, verification_ranks = self.ranks(use_kit)
+        return int(np.abs(template_ranks - verification_ranks).sum())
+
+    def ranks(self, use_kit=False):
+        """Returns the template and verification latency rank of every matched key, in matched key order
+
+        KIT ranks are taken over the Press-Press latencies
+        """
+        if use_kit not in self._ranks:
+            _, template_latencies, verification_latencies = self.context.latency_vectors(
+                use_kit
             )
-            for entry in verification_keys:
-                disorder += self.find_distance(entry)
-            return disorder
-        else:
-            verification_keys = find_matching_interval_keys(
-                self.template_file_path, self.verification_file_path
+            if use_kit:
+                template_latencies = template_latencies[:, 0]
+                verification_latencies = verification_latencies[:, 0]
+            self._ranks[use_kit] = (
+                latency_ranks(template_latencies[np.newaxis, :])[0],
+                latency_ranks(verification_latencies[np.newaxis, :])[0],
             )
-            for entry in verification_keys:
-                disorder += self.find_distance(entry, True)
-            return disorder
+        return self._ranks[use_kit]
 
     def absolute_degree_of_disorder(self, use_kit=False) -> float:
         # The formula to calculate the absolute degree of disorder is simply:
         #   1) Find the degree of disorder for the entire table
-        #   2) Calculate the maximum degree of disorder for a table with n elements accroding to the formula (n^2 -1)/2
+        #   2) Calculate the maximum degree of disorder for a table with n elements, see max_degree_of_disorder()
         #   3) Divide the degree of disorder with the maximum calculated in the previous step
         if use_kit == False:
             return self.degree_of_disorder() / self.max_degree_of_disorder()
@@ -101,17 +169,10 @@ class RelativeVerifier:
         self.THRESHOLD = threshold
 
     def max_degree_of_disorder(self, use_kit=False) -> float:
-        # To calculate the maximum degree of disorder for a table with n elements use the formula (n^2 -1)/2
-        if use_kit == False:
-            verification_hit_dict = self.template_td_data_dict.calculate_key_hold_time()
-            n = len(list(verification_hit_dict.keys()))
-            return (pow(n, 2) - 1) / 2
-        else:
-            verification_hit_dict = (
-                self.template_td_data_dict.calculate_key_interval_time()
-            )
-            n = len(list(verification_hit_dict.keys()))
-            return (pow(n, 2) - 1) / 2
+        # The maximum degree of disorder for a table with n elements is (n^2 - 1)/2 when n is odd
+        # and n^2/2 when n is even, where n is the number of keys the two tables share
+        n = len(self.ranks(use_kit)[0])
+        return float(max_rank_disorder(n))
 
     def is_key_valid(self, use_kit=False) -> bool:
         # Maybe to see if typing samples are valid we compare the absolute degree of disorder with a given
@@ -128,38 +189,64 @@ class RelativeVerifier:
                 return False
 
     def find_distance(self, entry, use_kit=False) -> int:
-        # Finds the distance between a given entry from the template table and
-        # the corresponding key letter entry in the verification table
+        # Finds the distance between the position of a given entry in the ordered template table and
+        # the position of the same entry in the verification table
         log = Logger("find_distance")
-        template_hit_dict = self.template_td_data_dict.calculate_key_hold_time()
-        store = dictionary_sort_by_value(template_hit_dict)
-        distance = 0
         if use_kit == False:
-            verification_keys = find_matching_keys(
-                self.template_file_path, self.verification_file_path
-            )
+            verification_keys = find_matching_keys(self.context)
         else:
-            verification_keys = find_matching_interval_keys(
-                self.template_file_path, self.verification_file_path
-            )
-        sorted_template_keys = list(store.keys())
-
-        if not entry in sorted_template_keys:
-            log.km_fatal(
-                "Provided entry" + entry + "is not in the list of sorted template keys"
-            )
-            return
+            verification_keys = find_matching_interval_keys(self.context)
         if not entry in verification_keys:
             log.km_fatal(
-                "Provided entry" + entry + "is not in the list of verification keys"
+                "Provided entry" + str(entry) + "is not in the list of verification keys"
             )
             return
-        for cell in verification_keys:
-            if cell == entry:
-                return distance
+        template_ranks, verification_ranks = self.ranks(use_kit)
+        position = verification_keys.index(entry)
+        return int(abs(template_ranks[position] - verification_ranks[position]))
+
+    def score_sessions(self, verifications, use_kit=False):
+        """Computes the absolute degree of disorder of the template against many verification sessions
+
+        Parameters
+        ----------
+        verifications: list
+            csv paths or TD_Data_Dictionary objects
+        use_kit: bool
+            Compare Press-Press digraph latencies instead of key hold times
+
+        Returns
+        -------
+        np.ndarray
+            One absolute degree of disorder per session, NaN for sessions sharing fewer than two keys with the template
+        """
+        if use_kit == False:
+            template_data = self.template_td_data_dict.calculate_key_hold_time()
+        else:
+            template_data = self.template_td_data_dict.calculate_key_interval_time(
+                self.template_td_data_dict.get_key_pairs()
+            )
+        keys = list(template_data.keys())
+        template_latencies = np.array(
+            [template_data[key] for key in keys], dtype=np.float64
+        ).reshape(len(keys), -1)[:, 0]
+        verification_latencies = np.full(
+            (len(verifications), len(keys)), np.nan, dtype=np.float64
+        )
+        for row, verification in enumerate(verifications):
+            session = load_td_data_dict(verification)
+            if use_kit == False:
+                data = session.calculate_key_hold_time()
             else:
-                distance += 1
-        return distance
+                data = session.calculate_key_interval_time(session.get_key_pairs())
+            for column, key in enumerate(keys):
+                latency = data.get(key)
+                if latency is not None:
+                    verification_latencies[row, column] = np.ravel(latency)[0]
+        disorder, n = rank_disorder(template_latencies, verification_latencies)
+        maximum = max_rank_disorder(n)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return np.where(maximum > 0, disorder / maximum, np.nan)
 
     def template_path(self):
         return self.template_file_path
@@ -171,41 +258,165 @@ class RelativeVerifier:
         return self.THRESHOLD
 
     def find_all_valid_keys(self, use_kit=False):
-        valids = []
+        # The verdict covers the whole table, so it is computed once and applies to every key
         if use_kit == False:
-            matches = find_matching_keys(
-                self.template_file_path, self.verification_file_path
-            )
-
-            for key in matches:
-                if self.is_key_valid(False):
-                    valids.append(key)
-            return valids
+            matches = find_matching_keys(self.context)
         else:
-            matches = find_matching_interval_keys(
-                self.template_file_path, self.verification_file_path
-            )
-            for key in matches:
-                if self.is_key_valid(True):
-                    valids.append(key)
-            return valids
+            matches = find_matching_interval_keys(self.context)
+        if matches and self.is_key_valid(use_kit):
+            return matches
+        return []
 
     # NOTE: We don't _have_ to do the loop because self.absolute_degree_of_disorder() operates on the whole table
     # anyway. So it is okay that each key has the same timing value from the verifiers perspective
     def get_valid_keys_data(self, use_kit=False):
         data = {}
         if use_kit == False:
-            matches = find_matching_keys(
-                self.template_file_path, self.verification_file_path
-            )
-            for key in matches:
-                if self.absolute_degree_of_disorder() < self.THRESHOLD:
-                    data[key] = self.absolute_degree_of_disorder()
+            matches = find_matching_keys(self.context)
         else:
-            matches = find_matching_interval_keys(
-                self.template_file_path, self.verification_file_path
-            )
+            matches = find_matching_interval_keys(self.context)
+        if not matches:
+            return data
+        disorder = self.absolute_degree_of_disorder(use_kit)
+        if disorder < self.THRESHOLD:
             for key in matches:
-                if self.absolute_degree_of_disorder(True) < self.THRESHOLD:
-                    data[key] = self.absolute_degree_of_disorder(True)
+                data[key] = disorder
         return data
+
+
+class IncrementalRelativeVerifier:
+    """Keeps the degree of disorder of a live verification session against a template up to date
+
+    Hold times arrive one at a time, through add_hold() or as raw events through add_event(). The
+    verification ranking is a sorted list of running per-key means. A binary search finds the new
+    position of the updated key, but moving it within the list and shifting the ranks of the keys
+    it passes, or of every key above the insertion point of a new key, is linear, so an update
+    costs O(K) for K distinct keys. That is still far cheaper than re-ranking the whole session.
+    After every update the state equals what RelativeVerifier reports for the session typed so far.
+    """
+
+    def __init__(self, template, threshold: float) -> None:
+        self.THRESHOLD = threshold
+        self.template_td_data_dict = load_td_data_dict(template)
+        self.template_file_path = self.template_td_data_dict.path()
+        template_data = self.template_td_data_dict.calculate_key_hold_time()
+        # Equal latencies are ordered by the template key order, like the stable argsort of the batch path
+        self.template_entries = {
+            key: (template_data[key], position)
+            for position, key in enumerate(template_data.keys())
+        }
+        self.reset()
+
+    def reset(self) -> None:
+        self.sums = {}
+        self.counts = {}
+        self.open_presses = {}
+        self.template_order = []
+        self.verification_order = []
+        self.template_rank = {}
+        self.verification_rank = {}
+        self.disorder = 0
+
+    def class_name(self) -> str:
+        return "Incremental Relative Verifier"
+
+    def template_path(self):
+        return self.template_file_path
+
+    def get_threshold(self):
+        return self.THRESHOLD
+
+    def set_threshold(self, threshold):
+        self.THRESHOLD = threshold
+
+    def matched_keys(self) -> list:
+        """Returns the keys seen so far that also occur in the template, in verification latency order"""
+        return [entry[2] for entry in self.verification_order]
+
+    def _distance(self, key) -> int:
+        return abs(self.template_rank[key] - self.verification_rank[key])
+
+    def _shift(self, order, ranks, start, end, delta) -> None:
+        # Moves the keys at positions [start, end) of `order` by `delta` ranks and updates the disorder
+        for entry in order[start:end]:
+            key = entry[2]
+            self.disorder -= self._distance(key)
+            ranks[key] += delta
+            self.disorder += self._distance(key)
+
+    def _insert(self, order, ranks, entry) -> None:
+        position = bisect.bisect_left(order, entry)
+        order.insert(position, entry)
+        ranks[entry[2]] = position
+        self._shift(order, ranks, position + 1, len(order), 1)
+
+    def add_hold(self, key: str, hold: float) -> float:
+        """Adds one hold time of `key` and returns the updated absolute degree of disorder
+
+        Keys that do not occur in the template are ignored
+        """
+        if key not in self.template_entries:
+            return self.absolute_degree_of_disorder()
+        latency, position = self.template_entries[key]
+        if key not in self.counts:
+            self.sums[key] = hold
+            self.counts[key] = 1
+            # Ranks of a new key start at 0 so that the shifts below do not count it
+            self.template_rank[key] = 0
+            self.verification_rank[key] = 0
+            self._insert(
+                self.template_order, self.template_rank, (latency, position, key)
+            )
+            self._insert(
+                self.verification_order,
+                self.verification_rank,
+                (hold, position, key),
+            )
+            self.disorder += self._distance(key)
+            return self.absolute_degree_of_disorder()
+        self.sums[key] += hold
+        self.counts[key] += 1
+        old = self.verification_rank[key]
+        self.disorder -= self._distance(key)
+        del self.verification_order[old]
+        entry = (self.sums[key] / self.counts[key], position, key)
+        new = bisect.bisect_left(self.verification_order, entry)
+        self.verification_order.insert(new, entry)
+        if new > old:
+            self._shift(self.verification_order, self.verification_rank, old, new, -1)
+        elif new < old:
+            self._shift(
+                self.verification_order, self.verification_rank, new + 1, old + 1, 1
+            )
+        self.verification_rank[key] = new
+        self.disorder += self._distance(key)
+        return self.absolute_degree_of_disorder()
+
+    def add_event(self, action: str, key: str, time: float):
+        """Feeds one raw event, returns the updated absolute degree of disorder when it completes a hold
+
+        Like the batch pairing, a repeated press of a held key keeps the first press and
+        a release without an open press is dropped.
+        """
+        if action == "P":
+            self.open_presses.setdefault(key, time)
+            return None
+        if action == "R" and key in self.open_presses:
+            return self.add_hold(key, time - self.open_presses.pop(key))
+        return None
+
+    def degree_of_disorder(self) -> int:
+        return self.disorder
+
+    def max_degree_of_disorder(self) -> float:
+        return float(max_rank_disorder(len(self.verification_order)))
+
+    def absolute_degree_of_disorder(self) -> float:
+        """The current degree of disorder divided by its maximum, NaN until two keys have been matched"""
+        maximum = self.max_degree_of_disorder()
+        if maximum == 0:
+            return float("nan")
+        return self.disorder / maximum
+
+    def is_valid(self) -> bool:
+        return self.absolute_degree_of_disorder() < self.THRESHOLD
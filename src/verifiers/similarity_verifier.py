@@ -5,20 +5,18 @@
 # https://opensource.org/licenses/MIT.
 
 import statistics
+import numpy as np
 from core.log import Logger
-from core.td_utils import find_matching_keys, find_matching_interval_keys
-from core.td_data_dict import TD_Data_Dictionary
+from core.profile import Template_Profile
+from core.td_utils import as_comparison_context, load_td_data_dict
 from rich.traceback import install
 
 install()
 
-# TODO: Add functionallity to __init__ to directly construct a verifier from TD_Data_Dictionary
+
 class SimilarityVerifier:
-    def __init__(self, template_file_path: str, verification_file_path: str, threshold):
-        self.template_file_path = template_file_path
-        self.verification_file_path = verification_file_path
-        self.template_td_data_dict = TD_Data_Dictionary(self.template_file_path)
-        self.verification_td_data_dict = TD_Data_Dictionary(self.verification_file_path)
+    def __init__(self, template_file_path, verification_file_path, threshold):
+        self._load(template_file_path, verification_file_path)
         self.THRESHOLD = threshold
 
     __slots__ = (
@@ -27,8 +25,29 @@ class SimilarityVerifier:
         "THRESHOLD",
         "template_td_data_dict",
         "verification_td_data_dict",
+        "context",
+        "profile",
     )
 
+    def _load(self, template, verification) -> None:
+        # Either argument may be a csv path or an already loaded TD_Data_Dictionary, or the template
+        # may be a ComparisonContext whose extracted features are then shared with other verifiers,
+        # the template may also be a Template_Profile in which case no template session is loaded
+        if isinstance(template, Template_Profile):
+            self.profile = template
+            self.context = None
+            self.template_td_data_dict = None
+            self.verification_td_data_dict = load_td_data_dict(verification)
+            self.template_file_path = None
+            self.verification_file_path = self.verification_td_data_dict.path()
+            return
+        self.profile = None
+        self.context = as_comparison_context(template, verification)
+        self.template_td_data_dict = self.context.template_dict
+        self.verification_td_data_dict = self.context.verification_dict
+        self.template_file_path = self.context.template_path()
+        self.verification_file_path = self.context.verification_path()
+
     def class_name(self) -> str:
         return "Similarity Verifier"
 
@@ -36,7 +55,7 @@ class SimilarityVerifier:
         return self.template_file_path
 
     def set_threshold(self, threshold):
-        self.threshold = threshold
+        self.THRESHOLD = threshold
 
     def get_threshold(self):
         return self.THRESHOLD
@@ -45,10 +64,74 @@ class SimilarityVerifier:
         return self.verification_file_path
 
     def set_template_file_path(self, new_template_file_path: str):
-        self.template_file_path = new_template_file_path
+        self._load(new_template_file_path, self.verification_td_data_dict)
 
     def set_verification_file_path(self, new_verification_file_path: str):
-        self.verification_file_path = new_verification_file_path
+        if self.context is None:
+            self._load(self.profile, new_verification_file_path)
+        else:
+            self._load(self.template_td_data_dict, new_verification_file_path)
+
+    def template_profile(self) -> Template_Profile:
+        """Returns the profile to score against, built from the template session on first use"""
+        if self.profile is None:
+            self.profile = Template_Profile.from_sessions([self.template_td_data_dict])
+        return self.profile
+
+    def verification_latencies(self, use_kit=False) -> dict:
+        if use_kit == False:
+            return self.verification_td_data_dict.calculate_key_hold_time()
+        return self.verification_td_data_dict.calculate_key_interval_time(
+            self.verification_td_data_dict.get_key_pairs()
+        )
+
+    def key_means(self, use_kit=False):
+        """Returns the keys (or digraphs) shared by the profile and the verification session with their
+        aligned template and verification mean latencies. Digraphs keep their Press-Press latencies.
+        """
+        if self.context is not None:
+            # A template session shares the aligned latencies other verifiers already extracted
+            keys, template_means, verification_means = self.context.latency_vectors(
+                use_kit
+            )
+            if use_kit:
+                template_means = template_means[:, 0]
+                verification_means = verification_means[:, 0]
+        else:
+            statistics = self.profile.statistics(use_kit)
+            verification_data = self.verification_latencies(use_kit)
+            keys = [key for key in statistics.keys() if key in verification_data]
+            _, template_means, _ = statistics.lookup(keys)
+            template_means = template_means[:, 0]
+            verification_means = np.array(
+                [np.ravel(verification_data[key])[0] for key in keys], dtype=np.float64
+            )
+        return keys, template_means, verification_means
+
+    def key_deviations(self, use_kit=False):
+        """Returns the keys (or digraphs) shared by the profile and the verification session and the
+        population standard deviation of their template and verification means
+
+        The standard deviation of two values is |t - v| / 2, so all keys are handled by one array
+        expression, see key_means() for the latencies compared.
+        """
+        keys, template_means, verification_means = self.key_means(use_kit)
+        return keys, np.abs(template_means - verification_means) / 2
+
+    def check_latencies(self, template_latency, verification_latency) -> bool:
+        """The per-key test of score_keys() for a single pair of mean latencies"""
+        return abs(template_latency - verification_latency) / 2 <= self.THRESHOLD
+
+    def score_keys(self, use_kit=False):
+        """Runs the dispersion test for every key (or digraph) shared by the profile and the verification
+
+        Returns
+        -------
+        tuple
+            (keys, valid) where valid is a boolean array aligned with keys
+        """
+        keys, sdev = self.key_deviations(use_kit)
+        return keys, sdev <= self.THRESHOLD
 
     def calculate_standard_deviation(self, data: list):
         sdev = statistics.pstdev(data)
@@ -57,59 +140,25 @@ class SimilarityVerifier:
     def find_latency_averages(self, key: str, use_kit=False):
         log = Logger("similarity_find_latency_averages")
         # NOTE: This function does not actually calculate the average latency
-        # for the key, rather it perform a lookup on the dictionary returned by calculate_key_hold_time()
-        # function for both of the td_data_dict's.
-        # This is because the returned KHT dictionary already performs a mean operation if there are
-        # multiple latencies for a particular key
+        # for the key, rather it perform a lookup on the template profile and on the dictionary returned by
+        # calculate_key_hold_time() (or calculate_key_interval_time()) for the verification td_data_dict.
+        # Both already hold the mean if there are multiple latencies for a particular key
+        statistics = self.template_profile().statistics(use_kit)
+        verification_data = self.verification_latencies(use_kit)
+        if not (key in statistics and key in verification_data):
+            log.km_error("Key %s not found" % (key,))
+            return
+        _, template_means, _ = statistics.lookup([key])
         if use_kit == False:
-            template_hit_dict = self.template_td_data_dict.calculate_key_hold_time()
-            verification_hit_dict = (
-                self.verification_td_data_dict.calculate_key_hold_time()
-            )
-            key_matches = find_matching_keys(
-                self.template_file_path, self.verification_file_path
-            )
-            if not key in key_matches:
-                log.km_error("Key %s not found" % key)
-                return
-            t_latency = template_hit_dict.get(key)
-            v_latency = verification_hit_dict.get(key)
-            return [t_latency, v_latency]
-        elif use_kit == True:
-            template_pairs = self.template_td_data_dict.get_key_pairs()
-            verification_pairs = self.verification_td_data_dict.get_key_pairs()
-            template_hit_dict = self.template_td_data_dict.calculate_key_interval_time(
-                template_pairs
-            )
-            verification_hit_dict = (
-                self.verification_td_data_dict.calculate_key_interval_time(
-                    verification_pairs
-                )
-            )
-            key_matches = find_matching_interval_keys(
-                self.template_file_path, self.verification_file_path
-            )
-            if not key in key_matches:
-                log.km_error("Key %s not found" % key)
-                return
-            # TODO: Double check that this is what we actually want to do here
-            t_latency = template_hit_dict.get(key)
-            v_latency = verification_hit_dict.get(key)
-            return [t_latency, v_latency]
+            t_latency = float(template_means[0, 0])
+        else:
+            t_latency = template_means[0].tolist()
+        v_latency = verification_data[key]
+        return [t_latency, v_latency]
 
     def calculate_similarity_score(self, use_kit=False):
-        if use_kit == False:
-            matches = find_matching_keys(
-                self.template_file_path, self.verification_file_path
-            )
-            valids = self.find_all_valid_keys()
-            return 1 - (len(valids) / len(matches))
-        elif use_kit == True:
-            matches = find_matching_interval_keys(
-                self.template_file_path, self.verification_file_path
-            )
-            valids = self.find_all_valid_keys(use_kit=True)
-            return 1 - (len(valids) / len(matches))
+        keys, valid = self.score_keys(use_kit)
+        return 1 - (np.count_nonzero(valid) / len(keys))
 
     def is_key_valid(self, key: str, use_kit=False) -> bool:
         if use_kit == False:
@@ -124,7 +173,10 @@ class SimilarityVerifier:
         elif use_kit == True:
             latencies = self.find_latency_averages(key, use_kit=True)
             assert len(latencies) == 2
-            sdev = self.calculate_standard_deviation(latencies)
+            # Digraphs are compared on their Press-Press latencies
+            sdev = self.calculate_standard_deviation(
+                [latencies[0][0], latencies[1][0]]
+            )
             # print("The standard deviation is: ", sdev)
             if sdev <= self.THRESHOLD:
                 return True
@@ -132,26 +184,8 @@ class SimilarityVerifier:
                 return False
 
     def find_all_valid_keys(self, use_kit=False):
-        if use_kit == False:
-            valids = []
-            matches = find_matching_keys(
-                self.template_file_path, self.verification_file_path
-            )
-            for key in matches:
-                if self.is_key_valid(key):
-                    valids.append(key)
-            print("Valids: ", valids)
-            return valids
-        elif use_kit == True:
-            valids = []
-            matches = find_matching_interval_keys(
-                self.template_file_path, self.verification_file_path
-            )
-            for key in matches:
-                if self.is_key_valid(key):
-                    valids.append(key)
-            print("Valids: ", valids)
-            return valids
+        keys, valid = self.score_keys(use_kit)
+        return [key for key, is_valid in zip(keys, valid) if is_valid]
 
     def count_valid_key_matches(self, use_kit=False):
         if use_kit == False:
@@ -0,0 +1,187 @@
+# Copyright 2022, Alvin Kuruvilla <alvineasokuruvilla@gmail.com>
+
+# Use of this source code is governed by an MIT-style
+# license that can be found in the LICENSE file or at
+# https://opensource.org/licenses/MIT.
+
+from core.exceptions import Invalid_Verifier
+from verifiers.absolute_verifier import AbsoluteVerifier
+from verifiers.relative_verifier import RelativeVerifier
+from verifiers.similarity_verifier import SimilarityVerifier
+import numpy as np
+import pandas as pd
+
+
+class Threshold_Sweep:
+    """The false acceptance and false rejection rates of a verifier over a range of thresholds
+
+    `far[j]` is the fraction of impostor pairs accepted and `frr[j]` the fraction of genuine pairs
+    rejected at `thresholds[j]`. The equal error rate is read off at the threshold where the two
+    rates are closest.
+    """
+
+    def __init__(self, thresholds, far, frr):
+        self.thresholds = thresholds
+        self.far = far
+        self.frr = frr
+
+    __slots__ = ("thresholds", "far", "frr")
+
+    def _eer_index(self) -> int:
+        return int(np.argmin(np.abs(self.far - self.frr)))
+
+    def eer(self) -> float:
+        j = self._eer_index()
+        return float((self.far[j] + self.frr[j]) / 2)
+
+    def eer_threshold(self) -> float:
+        """Returns the threshold at which the false acceptance and false rejection rates are closest"""
+        return float(self.thresholds[self._eer_index()])
+
+    def to_dataframe(self) -> pd.DataFrame:
+        return pd.DataFrame(
+            {"Threshold": self.thresholds, "FAR": self.far, "FRR": self.frr}
+        )
+
+
+def pair_statistics(verifier_class, template, verification, use_kit=False):
+    """
+    Compute the statistic a verifier compares against its threshold for one template/verification pair.
+
+    Parameters
+    ----------
+    verifier_class: type
+          AbsoluteVerifier, SimilarityVerifier or RelativeVerifier.
+    template:
+          A csv path or TD_Data_Dictionary, or a Template_Profile for the SimilarityVerifier.
+    verification:
+          A csv path or TD_Data_Dictionary.
+    use_kit: bool
+          Use key interval times instead of key hold times.
+    Returns
+    -------
+    numpy.ndarray
+          The per-key latency ratios with inf for those no threshold accepts (AbsoluteVerifier), the per-key standard deviations (SimilarityVerifier)
+          or the absolute degree of disorder as a single element array (RelativeVerifier).
+    """
+    # The threshold passed here is never looked at, the statistics do not depend on it
+    if verifier_class is AbsoluteVerifier:
+        ratios = verifier_class(template, verification, 1.0).key_ratios(use_kit)[1]
+        # score_keys() rejects a ratio below 1 at every threshold, which only a negative latency gives
+        ratios[ratios < 1.0] = np.inf
+        return ratios
+    if verifier_class is SimilarityVerifier:
+        return verifier_class(template, verification, 1.0).key_deviations(use_kit)[1]
+    if verifier_class is RelativeVerifier:
+        verifier = verifier_class(template, verification, 1.0)
+        if len(verifier.ranks(use_kit)[0]) < 2:
+            return np.empty(0, dtype=np.float64)
+        return np.array([verifier.absolute_degree_of_disorder(use_kit)])
+    raise Invalid_Verifier("Provided verifier is not a valid type")
+
+
+def valid_fractions(statistics, thresholds, strict=False):
+    """
+    Compute, for every pair and every threshold, the fraction of the pair's statistics that pass the threshold.
+
+    A statistic s passes threshold t when s <= t, or s < t when `strict` is True. All pairs and
+    thresholds are handled in one pass: each statistic is placed on the sorted threshold axis with a
+    binary search, and a cumulative sum along that axis turns the placements into pass counts.
+
+    Parameters
+    ----------
+    statistics: list
+          One array of statistics per pair, see pair_statistics().
+    thresholds: array_like
+          The thresholds to evaluate, in ascending order.
+    strict: bool
+          Whether a statistic equal to the threshold fails.
+    Returns
+    -------
+    numpy.ndarray
+          Shape (pairs, thresholds). Pairs without statistics get NaN.
+    """
+    thresholds = np.asarray(thresholds, dtype=np.float64)
+    if len(statistics) == 0:
+        return np.empty((0, len(thresholds)))
+    sizes = np.array([len(values) for values in statistics], dtype=np.int64)
+    values = np.concatenate(
+        [np.asarray(values, dtype=np.float64) for values in statistics]
+    )
+    pairs = np.repeat(np.arange(len(statistics)), sizes)
+    # The first threshold a statistic passes, len(thresholds) if it passes none
+    first = np.searchsorted(thresholds, values, side="right" if strict else "left")
+    passes = np.zeros((len(statistics), len(thresholds) + 1), dtype=np.int64)
+    np.add.at(passes, (pairs, first), 1)
+    passes = np.cumsum(passes[:, :-1], axis=1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return passes / sizes[:, None]
+
+
+def sweep_statistics(
+    genuine_statistics,
+    impostor_statistics,
+    thresholds,
+    strict=False,
+    min_valid_fraction=0.5,
+) -> Threshold_Sweep:
+    """
+    Compute FAR and FRR curves from precomputed pair statistics.
+
+    A pair is accepted at a threshold when more than `min_valid_fraction` of its statistics pass it,
+    the same majority rule is_majority() applies to the percentage of valid keys.
+    """
+    thresholds = np.asarray(thresholds, dtype=np.float64)
+    genuine = (
+        valid_fractions(genuine_statistics, thresholds, strict) > min_valid_fraction
+    )
+    impostor = (
+        valid_fractions(impostor_statistics, thresholds, strict) > min_valid_fraction
+    )
+    far = impostor.mean(axis=0) if len(impostor) else np.zeros(len(thresholds))
+    frr = 1 - genuine.mean(axis=0) if len(genuine) else np.zeros(len(thresholds))
+    return Threshold_Sweep(thresholds, far, frr)
+
+
+def sweep_thresholds(
+    verifier_class,
+    genuine_pairs,
+    impostor_pairs,
+    thresholds,
+    use_kit=False,
+    min_valid_fraction=0.5,
+) -> Threshold_Sweep:
+    """
+    Compute FAR, FRR and EER of a verifier type over many thresholds at once.
+
+    The statistic of every pair is computed once, all thresholds are then evaluated in a single vectorized pass.
+
+    Parameters
+    ----------
+    verifier_class: type
+          AbsoluteVerifier, SimilarityVerifier or RelativeVerifier.
+    genuine_pairs: list
+          (template, verification) pairs typed by the same user.
+    impostor_pairs: list
+          (template, verification) pairs typed by different users.
+    thresholds: array_like
+          The verifier thresholds to evaluate, in ascending order.
+    use_kit: bool
+          Use key interval times instead of key hold times.
+    min_valid_fraction: float
+          The fraction of valid keys a pair must exceed to be accepted.
+    Returns
+    -------
+    Threshold_Sweep
+    """
+    genuine = [
+        pair_statistics(verifier_class, template, verification, use_kit)
+        for template, verification in genuine_pairs
+    ]
+    impostor = [
+        pair_statistics(verifier_class, template, verification, use_kit)
+        for template, verification in impostor_pairs
+    ]
+    # The RelativeVerifier accepts a disorder strictly below its threshold
+    strict = verifier_class is RelativeVerifier
+    return sweep_statistics(genuine, impostor, thresholds, strict, min_valid_fraction)